@@ -1,12 +1,18 @@
 import streamlit as st
 import tempfile
 import os
-from moviepy import VideoFileClip, AudioFileClip, CompositeAudioClip, concatenate_videoclips
-from PIL import Image, ImageDraw, ImageFont
-import numpy as np
-import cv2
-from pptx import Presentation
-import io
+from contextlib import contextmanager
+
+# 重いライブラリ（moviepy等）は使用するツールの分岐内、または movie_converter の各関数内で読み込む
+from movie_converter import bgm, spool, supervisor
+from movie_converter.combine import TRANSITIONS
+from movie_converter.cover import MAX_COVERS, TOP_K, cover_path
+from movie_converter.jobs import run_combine_job, run_pptx_job, run_shorts_job
+from movie_converter.metrics import start_metrics_server
+from movie_converter.presentation import analyse_presentation
+from movie_converter.ratecontrol import DEFAULT_QUALITY, QUALITY_PRESETS
+from movie_converter.shorts import RENDITION_PRESETS, rendition_path
+from movie_converter.voicevox import generate_voice_with_voicevox
 
 # ✅ 実験完了: GitHub Actionsが構文エラーを正常に検出しました
 
@@ -16,804 +22,137 @@ st.set_page_config(
     layout="wide"
 )
 
-# サイドバーでツール選択
-st.sidebar.title("🛠️ ツール選択")
-tool = st.sidebar.radio(
-    "使用するツール",
-    ["ショート動画変換", "動画結合", "パワポナレーション動画"]
-)
+# 処理状況のメトリクスを別ポートで公開（スクリプトの再実行時は何もしない）
+start_metrics_server()
 
-if tool == "ショート動画変換":
-    st.title("🎬 ショート動画コンバーター8")
-    st.markdown("動画をアップロードして、YouTubeショート向けの縦型動画に変換しましょう！")
-elif tool == "動画結合":
-    st.title("🔗 動画結合ツール")
-    st.markdown("複数のショート動画を選択して、長時間動画に結合しましょう！")
-else:  # パワポナレーション動画
-    st.title("📊 パワポナレーション動画")
-    st.markdown("PowerPointファイルをアップロードして、ノート部分を読み上げる動画を作成しましょう！")
 
-def resize_video_to_shorts(video_path, output_path, scale_factor=1.0, start_time=None, end_time=None, keep_original_size=False):
-    """動画をYouTubeショート形式(9:16)にリサイズ、または元のサイズを維持"""
-    import subprocess
-    
-    # FFmpegコマンドで動画変換
-    ffmpeg_cmd = ['ffmpeg', '-i', video_path]
-    
-    # トリミングが指定されている場合
-    if start_time is not None and end_time is not None:
-        ffmpeg_cmd.extend(['-ss', str(start_time), '-t', str(end_time - start_time)])
 
-    if not keep_original_size:
-        # 元の動画情報を取得
-        clip = VideoFileClip(video_path)
-        original_width, original_height = clip.size
-        original_ratio = original_width / original_height
-        clip.close()
-        
-        # YouTubeショートの推奨解像度: 1080x1920 (9:16)
-        target_width = 1080
-        target_height = 1920
-        target_ratio = target_width / target_height
-        
-        # 基本スケール計算（ターゲット枠に収まるサイズ）
-        if original_ratio > target_ratio:
-            # 横長の場合、幅をターゲット幅に合わせる
-            base_width = target_width
-            base_height = int(target_width / original_ratio)
-        else:
-            # 縦長の場合、高さをターゲット高さに合わせる
-            base_height = target_height
-            base_width = int(target_height * original_ratio)
-        
-        # scale_factorを適用（拡大倍率による調整）
-        final_width = int(base_width * scale_factor)
-        final_height = int(base_height * scale_factor)
-        
-        # 拡大倍率が1.0より大きい場合、動画がターゲットフレームからはみ出すのは正常
-        # パディングエラーを避けるため、最小サイズは1ピクセル以上を保証
-        final_width = max(1, final_width)
-        final_height = max(1, final_height)
-        
-        # ビデオフィルターを構築
-        if scale_factor > 1.0:
-            # 拡大時：スケール→中央クロップ→パディング
-            vf = f'scale={final_width}:{final_height},crop={min(final_width, target_width)}:{min(final_height, target_height)},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black'
-        else:
-            # 縮小時：スケール→パディング
-            vf = f'scale={final_width}:{final_height},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black'
-        
-        ffmpeg_cmd.extend([
-            '-vf', vf
-        ])
-    
-    ffmpeg_cmd.extend([
-        '-c:v', 'libx264',
-        '-c:a', 'aac',
-        '-b:v', '8000k',
-        '-crf', '18',
-        '-preset', 'slow',
-        '-y',  # overwrite output file
-        output_path
-    ])
-    
-    try:
-        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-        return output_path
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"FFmpeg処理でエラーが発生しました: {e.stderr.decode()}")
-    except FileNotFoundError:
-        raise Exception("FFmpegが見つかりません。システムにFFmpegがインストールされていることを確認してください。")
+def _session_liveness():
+    """このセッションが続いているかを返す関数（判定できない場合は None = 常に継続）
 
-def get_voicevox_url():
-    """VOICEVOX接続URLを取得（環境変数を優先）"""
-    import os
-    
-    # 環境変数から取得（Docker環境で設定）
-    voicevox_url = os.getenv('VOICEVOX_URL')
-    if voicevox_url:
-        return voicevox_url
-    
-    # Docker Compose環境では voicevox サービス名で接続
+    Streamlit の内部APIを使うため、バージョンアップで見つからなくなった場合は取り消しだけを諦め、
+    変換自体はそのまま行う。
+    """
     try:
-        # Docker環境かチェック
-        if os.path.exists('/.dockerenv'):
-            return "http://voicevox:50021"
-    except:
-        pass
-    
-    # WSL環境の場合はWindowsホストIPを取得
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
     try:
-        with open('/etc/resolv.conf', 'r') as f:
-            for line in f:
-                if line.startswith('nameserver'):
-                    host_ip = line.split()[1]
-                    return f"http://{host_ip}:50021"
-    except:
-        pass
-    
-    # フォールバック: localhost
-    return "http://localhost:50021"
+        # 処理中にウィジェットを操作すると再実行が要求される（Streamlit の内部状態を参照）
+        from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequestType
+    except ImportError:
+        ScriptRequestType = None   # タブを閉じたかどうかだけ判定する
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
 
-def generate_voice_with_voicevox(text, speaker_id=10, output_path=None):
-    """VOICEVOXを使用して音声を生成（雨晴はう: speaker_id=10）"""
-    import requests
-    import json
-    import tempfile
-    
-    if output_path is None:
-        output_path = tempfile.mktemp(suffix='.wav')
-    
-    # 環境に適したVOICEVOX URLを取得
-    base_url = get_voicevox_url()
-    
-    try:
-        # VOICEVOXエンジンの起動確認
-        response = requests.get(f"{base_url}/speakers", timeout=5)
-        if response.status_code != 200:
-            raise Exception(f"VOICEVOXエンジンが起動していません (接続先: {base_url})")
-        
-        # 音響特徴量の生成
-        query_response = requests.post(
-            f"{base_url}/audio_query?text={text}&speaker={speaker_id}",
-            timeout=10
-        )
-        query_response.raise_for_status()
-        query_data = query_response.json()
-        
-        # 音声合成
-        synthesis_response = requests.post(
-            f"{base_url}/synthesis?speaker={speaker_id}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(query_data),
-            timeout=30
-        )
-        synthesis_response.raise_for_status()
-        
-        # 音声ファイルを保存
-        with open(output_path, 'wb') as f:
-            f.write(synthesis_response.content)
-        
-        return output_path
-        
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"VOICEVOXとの通信に失敗しました (接続先: {base_url}): {str(e)}")
-    except Exception as e:
-        raise Exception(f"音声生成に失敗しました: {str(e)}")
+    def is_alive():
+        try:
+            if not Runtime.instance().is_active_session(ctx.session_id):
+                return False   # タブを閉じた
+            requests = getattr(ctx, 'script_requests', None)
+            if ScriptRequestType is None or requests is None:
+                return True
+            return requests._state == ScriptRequestType.CONTINUE
+        except Exception:
+            return True
 
-def add_multiple_voices_to_video(video_path, output_path, voices, original_volume=1.0):
-    """動画に複数の音声を追加（FFmpeg直接実行版）"""
-    import subprocess
-    import tempfile
-    
-    print(f"DEBUG: FFmpeg直接実行版で音声追加開始")
-    
-    temp_voice_files = []
-    try:
-        # VOICEVOX音声を生成
-        voice_files = []
-        for voice in voices:
-            try:
-                voice_path = generate_voice_with_voicevox(voice['text'])
-                temp_voice_files.append(voice_path)
-                voice_files.append({
-                    'path': voice_path,
-                    'start_time': voice['start_time'],
-                    'volume': voice['volume']
-                })
-            except Exception as e:
-                st.warning(f"⚠️ 音声「{voice['text'][:20]}...」の生成をスキップしました: {str(e)}")
-                continue
-        
-        if not voice_files:
-            # 音声追加がない場合は元動画をそのままコピー
-            import shutil
-            shutil.copy2(video_path, output_path)
-            return output_path
-        
-        # FFmpegコマンドを構築（動画ストリームはコピー、音声のみ処理）
-        ffmpeg_cmd = ['ffmpeg', '-i', video_path, '-y']
-        
-        # 各音声ファイルを入力として追加
-        for voice_file in voice_files:
-            ffmpeg_cmd.extend(['-i', voice_file['path']])
-        
-        # フィルター構築（シンプルに音声をミックス）
-        if len(voice_files) == 1:
-            # 1つの音声のみ
-            voice = voice_files[0]
-            delay_ms = int(voice['start_time'] * 1000)  # ミリ秒に変換
-            if delay_ms > 0:
-                audio_filter = f'[1:a]volume={voice["volume"]},adelay={delay_ms}[voice];[0:a][voice]amix=inputs=2:duration=first[audio]'
-            else:
-                audio_filter = f'[1:a]volume={voice["volume"]}[voice];[0:a][voice]amix=inputs=2:duration=first[audio]'
-        else:
-            # 複数音声をミックス
-            voice_filters = []
-            for i, voice in enumerate(voice_files):
-                delay_ms = int(voice['start_time'] * 1000)  # ミリ秒に変換
-                if delay_ms > 0:
-                    voice_filters.append(f'[{i+1}:a]volume={voice["volume"]},adelay={delay_ms}[voice{i}]')
-                else:
-                    voice_filters.append(f'[{i+1}:a]volume={voice["volume"]}[voice{i}]')
-            
-            # 全音声をミックス
-            voice_labels = ''.join(f'[voice{i}]' for i in range(len(voice_files)))
-            audio_filter = ';'.join(voice_filters) + f';[0:a]{voice_labels}amix=inputs={len(voice_files)+1}:duration=first[audio]'
-        
-        # 動画ストリームはコピー、音声のみ処理
-        ffmpeg_cmd.extend([
-            '-filter_complex', audio_filter,
-            '-map', '0:v',  # 動画ストリームはそのままコピー
-            '-map', '[audio]',  # 処理された音声
-            '-c:v', 'copy',  # 動画は再エンコードしない（重要！）
-            '-c:a', 'aac',
-            output_path
-        ])
-        
-        print(f"DEBUG: FFmpeg実行: {' '.join(ffmpeg_cmd)}")
-        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"DEBUG: FFmpeg エラー: {result.stderr}")
-            raise Exception(f"FFmpeg処理に失敗しました: {result.stderr}")
-        
-        print(f"DEBUG: FFmpeg成功")
-        
-    finally:
-        # 一時ファイル削除
-        for temp_file in temp_voice_files:
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
-    
-    return output_path
+    return is_alive
 
 
-def add_bgm_to_video(video_path, output_path, bgm_path=None, bgm_volume=0.5, original_volume=1.0, loop_bgm=True, bgm_start_time=0.0):
-    """動画にBGMを追加（FFmpegを使用してより正確に）"""
-    import subprocess
-    import tempfile
-    
-    print(f"DEBUG BGM: FFmpeg方式でBGM追加開始")
-    
-    # 元の動画の情報を取得
-    clip = VideoFileClip(video_path)
-    original_video_duration = clip.duration
-    original_fps = clip.fps
-    print(f"DEBUG BGM: 元の動画 - 長さ: {original_video_duration}秒, FPS: {original_fps}")
-    clip.close()
-    
-    if bgm_path and os.path.exists(bgm_path):
-        try:
-            # FFmpegでBGMを追加
-            bgm_info = AudioFileClip(bgm_path)
-            bgm_duration = bgm_info.duration
-            bgm_info.close()
-            
-            ffmpeg_cmd = ['ffmpeg', '-i', video_path, '-i', bgm_path, '-y']
-            
-            # フィルター構築
-            filter_parts = []
-            
-            # 動画トラック
-            filter_parts.append('[0:v]copy[video]')
-            
-            # BGM処理
-            if loop_bgm and bgm_duration < original_video_duration:
-                # ループが必要な場合
-                loops_needed = int(original_video_duration / bgm_duration) + 1
-                filter_parts.append(f'[1:a]stream_loop={loops_needed},atrim=0:{original_video_duration},volume={bgm_volume}[bgm]')
-            else:
-                # ループ不要またはBGMが十分長い場合
-                filter_parts.append(f'[1:a]atrim=0:{original_video_duration},volume={bgm_volume}[bgm]')
-            
-            # BGMの開始時間調整
-            if bgm_start_time > 0.0:
-                delay_ms = int(bgm_start_time * 1000)
-                filter_parts[-1] = f'[1:a]atrim=0:{original_video_duration},adelay={delay_ms}|{delay_ms},volume={bgm_volume}[bgm]'
-            
-            # 元の音声がある場合はミックス
-            if VideoFileClip(video_path).audio is not None:
-                filter_parts.append(f'[0:a]volume={original_volume}[orig]')
-                filter_parts.append('[orig][bgm]amix=inputs=2:duration=first[audio]')
-            else:
-                filter_parts.append('[bgm]acopy[audio]')
-            
-            # フィルターグラフを完成
-            filter_complex = ';'.join(filter_parts)
-            ffmpeg_cmd.extend([
-                '-filter_complex', filter_complex,
-                '-map', '[video]',
-                '-map', '[audio]',
-                '-t', str(original_video_duration),
-                '-r', str(original_fps),
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-crf', '18',
-                '-preset', 'slow',
-                output_path
-            ])
-            
-            print(f"DEBUG BGM: FFmpeg実行: {' '.join(ffmpeg_cmd)}")
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"DEBUG BGM: FFmpeg成功")
-                return output_path
-            else:
-                print(f"DEBUG BGM: FFmpeg エラー: {result.stderr}")
-                # フォールバック処理へ続行
-                
-        except Exception as e:
-            print(f"DEBUG BGM: FFmpeg方式失敗: {str(e)}")
-            # フォールバック処理へ続行
-        
-        # フォールバック：MoviePy方式
-        print("DEBUG BGM: MoviePyフォールバック方式を使用")
-        clip = VideoFileClip(video_path)
-        bgm = AudioFileClip(bgm_path)
-        
-        # BGMの音量を調整
-        bgm = bgm.with_fps(44100)
-        if bgm_volume != 1.0:
-            bgm = bgm.with_volume_scaled(bgm_volume)
-        
-        # BGMをループ再生するかどうか
-        if loop_bgm and bgm.duration < original_video_duration:
-            # BGMをループして動画の長さに合わせる
-            loops_needed = int(clip.duration / bgm.duration) + 1
-            try:
-                # ループ処理を行い、動画の長さに合わせてカット
-                bgm = bgm.audio_loop(n=loops_needed).subclipped(0, clip.duration)
-            except Exception as e:
-                # ループ処理に失敗した場合は、単純に繰り返し再生
-                bgm_list = []
-                current_duration = 0
-                while current_duration < clip.duration:
-                    remaining_duration = clip.duration - current_duration
-                    if remaining_duration >= bgm.duration:
-                        bgm_list.append(bgm)
-                        current_duration += bgm.duration
-                    else:
-                        bgm_list.append(bgm.subclipped(0, remaining_duration))
-                        current_duration += remaining_duration
-                
-                if bgm_list:
-                    bgm = concatenate_audioclips(bgm_list)
-                else:
-                    bgm = bgm.subclipped(0, min(bgm.duration, clip.duration))
-        else:
-            # BGMを動画の長さに合わせてカット
-            bgm = bgm.subclipped(0, min(bgm.duration, clip.duration))
-        
-        # BGMの開始時間を適用
-        if bgm_start_time > 0.0 and bgm_start_time < clip.duration:
-            # 無音の音声を作成してBGMの前に追加
-            silence_duration = min(bgm_start_time, clip.duration)
-            remaining_duration = clip.duration - silence_duration
-            
-            if remaining_duration > 0:
-                # BGMを残り時間に合わせてカット
-                bgm = bgm.subclipped(0, min(bgm.duration, remaining_duration))
-                # 無音とBGMを結合
-                bgm = bgm.with_start(bgm_start_time)
-            else:
-                # 開始時間が動画の長さを超えている場合は無音
-                bgm = None
-        
-        # 元の音声があるかチェック
-        if clip.audio is not None:
-            # 元の音声の音量を調整
-            original_audio = clip.audio
-            if original_volume != 1.0:
-                original_audio = original_audio.with_volume_scaled(original_volume)
-            # BGMと元の音声を合成
-            if bgm is not None:
-                final_audio = CompositeAudioClip([original_audio, bgm])
-            else:
-                final_audio = original_audio
-        else:
-            # 元の音声がない場合はBGMのみ
-            if bgm is not None:
-                final_audio = bgm
-            else:
-                final_audio = None
-        
-        # 動画に音声を設定（フレームレートを維持）
-        if final_audio is not None:
-            # 音声の長さを動画の長さに合わせる
-            if final_audio.duration > original_video_duration:
-                final_audio = final_audio.subclipped(0, original_video_duration)
-            elif final_audio.duration < original_video_duration:
-                final_audio = final_audio.with_duration(original_video_duration)
-            
-            # 重要：元の動画のFPSを保持
-            final_clip = clip.with_audio(final_audio).with_fps(original_fps)
-        else:
-            final_clip = clip.with_fps(original_fps)
-        
-        # 動画の長さを確実に設定
-        final_clip = final_clip.with_duration(original_video_duration)
-        
-        # 出力（元のFPSを明示的に指定）
-        final_clip.write_videofile(
-            output_path,
-            codec='libx264',
-            audio_codec='aac',
-            bitrate='8000k',
-            fps=original_fps,  # 重要：元のFPSを明示的に指定
-            ffmpeg_params=['-crf', '18', '-preset', 'slow']
-        )
-        
-        # リソースをクリーンアップ
-        clip.close()
-        bgm.close()
-        final_clip.close()
-        if clip.audio is not None:
-            original_audio.close()
-        final_audio.close()
-    else:
-        # BGMがない場合は元の動画をそのままコピー（FPSを保持）
-        clip = VideoFileClip(video_path)
-        final_clip = clip.with_fps(original_fps).with_duration(original_video_duration)
-        final_clip.write_videofile(
-            output_path,
-            codec='libx264',
-            audio_codec='aac',
-            bitrate='8000k',
-            fps=original_fps,
-            ffmpeg_params=['-crf', '18', '-preset', 'slow']
-        )
-        clip.close()
-        final_clip.close()
-    
-    return output_path
+def _session_cancel_token():
+    """このセッションの処理用の取り消しトークン（前回の処理が残っていれば取り消す）"""
+    previous = st.session_state.get('cancel_token')
+    if previous is not None:
+        previous.cancel()
+    token = supervisor.CancelToken(is_alive=_session_liveness())
+    st.session_state.cancel_token = token
+    return token
 
-def add_text_to_video(video_path, output_path, telops, font_size=60):
-    """動画に時間ベースのテキストオーバーレイを追加"""
-    import cv2
-    import numpy as np
-    from PIL import Image, ImageDraw, ImageFont
-    
-    # OpenCVとPillowを使用してテキストを追加
-    clip = VideoFileClip(video_path)
-    
-    def add_text_frame(get_frame, t):
-        frame = get_frame(t)
-        # numpy配列をPIL Imageに変換
-        img = Image.fromarray(frame.astype('uint8'))
-        draw = ImageDraw.Draw(img)
-        
-        # 日本語対応フォントを優先的に使用
-        japanese_fonts = [
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "fonts/NotoSansJP-Regular.ttf",
-            "NotoSansCJK-Regular.ttc"
-        ]
-        
-        font = None
-        for font_path in japanese_fonts:
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-                break
-            except:
-                continue
-        
-        if font is None:
-            try:
-                font = ImageFont.load_default(size=font_size)
-            except:
-                font = ImageFont.load_default()
-        
-        # 現在の時間に表示すべきテロップを描画
-        for telop in telops:
-            # 時間範囲内かチェック
-            if telop['start_time'] <= t <= telop['end_time']:
-                text = telop['text']
-                position = telop['position']
-                
-                if not text:  # 空のテキストはスキップ
-                    continue
-                    
-                # テキストサイズを取得
-                bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                
-                # 位置を計算（中央寄りに調整）
-                if position == "top":
-                    x = (img.width - text_width) // 2
-                    y = img.height // 4 - text_height // 2  # 中央寄りの上
-                elif position == "bottom":
-                    x = (img.width - text_width) // 2
-                    y = img.height * 3 // 4 - text_height // 2  # 中央寄りの下
-                else:  # center
-                    x = (img.width - text_width) // 2
-                    y = (img.height - text_height) // 2
-                
-                # テロップの色設定（デフォルトは白）
-                text_color = telop.get('color', (255, 255, 255))
-                
-                # テキストを描画（影付き）
-                draw.text((x+2, y+2), text, font=font, fill=(0, 0, 0))  # 影
-                draw.text((x, y), text, font=font, fill=text_color)  # テキスト
-        
-        return np.array(img)
-    
-    # テキスト付きの動画を作成
-    final_video = clip.transform(add_text_frame)
-    
-    # 出力（高画質設定）
-    final_video.write_videofile(
-        output_path, 
-        codec='libx264', 
-        audio_codec='aac',
-        bitrate='8000k',  # 高ビットレート
-        ffmpeg_params=['-crf', '18', '-preset', 'slow']  # 高画質・低圧縮
-    )
-    clip.close()
-    final_video.close()
-    
-    return output_path
-
-def extract_slides_and_notes(pptx_file):
-    """PowerPointファイルからスライドと speaker notes を抽出"""
-    presentation = Presentation(pptx_file)
-    slides_data = []
-    
-    for i, slide in enumerate(presentation.slides):
-        # スライドを画像として保存
-        slide_image_path = tempfile.mktemp(suffix=f'_slide_{i}.png')
-        
-        # スライドの画像を取得するため、まずPILで空の画像を作成
-        # 注意: python-pptxはスライドの直接的な画像変換をサポートしていないため、
-        # ここではスライドのテキスト内容とノートのみを抽出します
-        
-        # スライドのテキスト内容を取得
-        slide_text = ""
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                slide_text += shape.text + " "
-        
-        # スピーカーノートを取得
-        notes_slide = slide.notes_slide
-        notes_text = ""
-        if notes_slide:
-            notes_text_frame = notes_slide.notes_text_frame
-            if notes_text_frame:
-                notes_text = notes_text_frame.text
-        
-        slides_data.append({
-            'slide_number': i + 1,
-            'slide_text': slide_text.strip(),
-            'notes_text': notes_text.strip(),
-            'slide_image_path': None  # 実際の画像抽出は別の方法で実装
-        })
-    
-    return slides_data
 
-def create_slide_images_from_pptx(pptx_file):
-    """PowerPointスライドを画像ファイルに変換する（LibreOfficeを使用）"""
-    import subprocess
-    import shutil
-    
-    # 一時ディレクトリを作成
-    temp_dir = tempfile.mkdtemp()
-    pptx_path = os.path.join(temp_dir, "presentation.pptx")
-    
-    # アップロードファイルを保存
-    with open(pptx_path, 'wb') as f:
-        pptx_file.seek(0)
-        f.write(pptx_file.read())
-    
+@contextmanager
+def supervised_run():
+    """タブを閉じた・別の操作で再実行された場合に、実行中の ffmpeg などを止める"""
     try:
-        # LibreOfficeでPDFに変換
-        cmd = [
-            'libreoffice', 
-            '--headless', 
-            '--convert-to', 'pdf',
-            '--outdir', temp_dir,
-            pptx_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        
-        if result.returncode != 0:
-            raise Exception(f"LibreOffice変換エラー: {result.stderr}")
-        
-        # PDFをPNG画像に変換（pdftoppmを使用 - より安定）
-        pdf_path = os.path.join(temp_dir, "presentation.pdf")
-        if not os.path.exists(pdf_path):
-            raise Exception("PDF変換に失敗しました")
-        
-        # pdftoppmでPDFの各ページをPNGに変換
-        cmd = [
-            'pdftoppm',
-            '-png',
-            '-r', '150',  # 解像度150dpi
-            pdf_path,
-            os.path.join(temp_dir, 'slide')
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        
-        if result.returncode != 0:
-            # pdftoppmが失敗した場合はImageMagickを試行
-            cmd = [
-                'convert',
-                '-density', '150',
-                '-background', 'white',
-                '-alpha', 'remove',
-                '-quality', '90',
-                pdf_path,
-                os.path.join(temp_dir, 'slide-%03d.png')
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-            
-            if result.returncode != 0:
-                raise Exception(f"画像変換エラー: {result.stderr}")
-        
-        # 生成された画像ファイルパスを取得
-        slide_images = []
-        
-        # pdftoppmの出力形式に対応
-        for file in sorted(os.listdir(temp_dir)):
-            if file.startswith('slide') and file.endswith('.png'):
-                image_path = os.path.join(temp_dir, file)
-                if os.path.exists(image_path):
-                    # 永続的な場所にコピー
-                    slide_num = len(slide_images)
-                    permanent_path = tempfile.mktemp(suffix=f'_slide_{slide_num}.png')
-                    shutil.copy(image_path, permanent_path)
-                    slide_images.append(permanent_path)
-        
-        if not slide_images:
-            raise Exception("スライド画像の生成に失敗しました")
-        
-        return slide_images, temp_dir
-        
-    except subprocess.TimeoutExpired:
-        raise Exception("変換処理がタイムアウトしました")
-    except Exception as e:
-        # 一時ディレクトリをクリーンアップ
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        raise e
+        with supervisor.supervise(_session_cancel_token(), 'interactive'):
+            yield
+    except supervisor.Cancelled:
+        st.stop()
 
-def create_slide_video_with_narration(slide_image_path, narration_audio_path, duration, output_path):
-    """スライド画像とナレーション音声から動画を作成"""
-    from moviepy import ImageClip
-    
-    # スライド画像から動画クリップを作成
-    slide_clip = ImageClip(slide_image_path, duration=duration)
-    
-    # 音声を読み込み
-    audio = AudioFileClip(narration_audio_path)
-    
-    # 画像クリップに音声を追加
-    final_clip = slide_clip.with_audio(audio)
-    
-    # 出力
-    final_clip.write_videofile(
-        output_path,
-        codec='libx264',
-        audio_codec='aac',
-        fps=1,  # スライドなので低いFPSで十分
-        ffmpeg_params=['-crf', '18', '-preset', 'fast']
-    )
-    
-    # クリーンアップ
-    slide_clip.close()
-    audio.close()
-    final_clip.close()
-    
-    return output_path
 
-def create_text_slide_image(text, title, width=1920, height=1080):
-    """テキストからスライド画像を生成"""
-    # 空の画像を作成
-    img = Image.new('RGB', (width, height), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    try:
-        # 日本語フォントを読み込み
-        title_font = ImageFont.truetype("NotoSansCJK-Regular.ttc", 72)
-        text_font = ImageFont.truetype("NotoSansCJK-Regular.ttc", 48)
-    except:
-        try:
-            title_font = ImageFont.load_default(size=72)
-            text_font = ImageFont.load_default(size=48)
-        except:
-            title_font = ImageFont.load_default()
-            text_font = ImageFont.load_default()
-    
-    # タイトルを描画
-    title_bbox = draw.textbbox((0, 0), title, font=title_font)
-    title_width = title_bbox[2] - title_bbox[0]
-    title_x = (width - title_width) // 2
-    draw.text((title_x, 100), title, fill='black', font=title_font)
-    
-    # テキストを描画（改行対応）
-    lines = text.split('\n')
-    y_offset = 250
-    line_height = 60
-    
-    for line in lines:
-        if not line.strip():
-            continue
-        
-        # 長い行を自動改行
-        words = line.split()
-        current_line = ""
-        
-        for word in words:
-            test_line = current_line + word + " "
-            bbox = draw.textbbox((0, 0), test_line, font=text_font)
-            test_width = bbox[2] - bbox[0]
-            
-            if test_width > width - 200:  # マージンを考慮
-                if current_line:
-                    # 現在の行を描画
-                    text_bbox = draw.textbbox((0, 0), current_line, font=text_font)
-                    text_width = text_bbox[2] - text_bbox[0]
-                    text_x = (width - text_width) // 2
-                    draw.text((text_x, y_offset), current_line, fill='black', font=text_font)
-                    y_offset += line_height
-                current_line = word + " "
-            else:
-                current_line = test_line
-        
-        # 残りのテキストを描画
-        if current_line.strip():
-            text_bbox = draw.textbbox((0, 0), current_line, font=text_font)
-            text_width = text_bbox[2] - text_bbox[0]
-            text_x = (width - text_width) // 2
-            draw.text((text_x, y_offset), current_line, fill='black', font=text_font)
-            y_offset += line_height
-    
-    # 画像を保存
-    output_path = tempfile.mktemp(suffix='.png')
-    img.save(output_path)
-    
-    return output_path
+def run_with_live_preview(run, progress, on_warning=None, width=400):
+    """run(preview_dir=..., progress=..., on_warning=...) を別スレッドで実行し、最後のエンコード中は
+    書き出し済みの部分（preview.live_hls のセグメント）を表示する
+
+    Streamlit の表示はスクリプトのスレッドからしか更新できないため、進捗・警告はキューで受け取ります。
+    supervised_run() の中で呼ぶと、取り消しは実行中のスレッドの子プロセスにも届きます。
+    """
+    import contextvars
+    import queue
+    import shutil
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from movie_converter.preview import join_live_segments
 
-def combine_videos(video_paths, output_path):
-    """複数の動画を結合する"""
-    clips = []
+    events = queue.Queue()
+    placeholder = st.empty()
+    preview_dir = tempfile.mkdtemp(prefix='live_preview_')
+    partial_path = os.path.join(preview_dir, 'partial.mp4')
+    shown = 0
+    executor = ThreadPoolExecutor(max_workers=1)
+    # supervisor.supervise の設定（取り消しトークン・優先度）をスレッドに引き継ぐ
+    future = executor.submit(
+        contextvars.copy_context().run, run, preview_dir=preview_dir,
+        progress=lambda percent, message: events.put((progress, percent, message)),
+        on_warning=lambda message: events.put((on_warning, message)),
+    )
     try:
-        for video_path in video_paths:
-            # ファイルの存在確認
-            if not os.path.exists(video_path):
-                raise FileNotFoundError(f"ファイルが見つかりません: {video_path}")
-            
-            clip = VideoFileClip(video_path)
-            clips.append(clip)
-        
-        # 動画を結合
-        final_clip = concatenate_videoclips(clips, method="compose")
-        
-        # 出力（高画質設定）
-        final_clip.write_videofile(
-            output_path,
-            codec='libx264',
-            audio_codec='aac',
-            bitrate='8000k',
-            ffmpeg_params=['-crf', '18', '-preset', 'slow']
-        )
-        
-        return output_path
-        
+        while True:
+            finished = future.done()
+            while not events.empty():
+                callback, *args = events.get()
+                if callback is not None:
+                    callback(*args)
+            if finished:
+                break
+            count = join_live_segments(preview_dir, partial_path)
+            if count > shown:
+                shown = count
+                with placeholder.container():
+                    st.caption(f"⏳ エンコード中のプレビュー（{shown}セグメント）")
+                    st.video(partial_path, width=width)
+            time.sleep(0.5)
+        return future.result()
+    except BaseException:
+        # 再実行・停止でスクリプトが中断された場合も、実行中の処理を止めてから抜ける
+        token = supervisor.current_token()
+        if token is not None:
+            token.cancel()
+        raise
     finally:
-        # リソースをクリーンアップ
-        for clip in clips:
-            try:
-                clip.close()
-            except:
-                pass
-        try:
-            final_clip.close()
-        except:
-            pass
+        executor.shutdown(wait=True)
+        placeholder.empty()
+        shutil.rmtree(preview_dir, ignore_errors=True)
+
+
+# サイドバーでツール選択
+st.sidebar.title("🛠️ ツール選択")
+tool = st.sidebar.radio(
+    "使用するツール",
+    ["ショート動画変換", "動画結合", "パワポナレーション動画"]
+)
+
+if tool == "ショート動画変換":
+    st.title("🎬 ショート動画コンバーター8")
+    st.markdown("動画をアップロードして、YouTubeショート向けの縦型動画に変換しましょう！")
+elif tool == "動画結合":
+    st.title("🔗 動画結合ツール")
+    st.markdown("複数のショート動画を選択して、長時間動画に結合しましょう！")
+else:  # パワポナレーション動画
+    st.title("📊 パワポナレーション動画")
+    st.markdown("PowerPointファイルをアップロードして、ノート部分を読み上げる動画を作成しましょう！")
 
 # メインインターface
 if tool == "ショート動画変換":
@@ -844,6 +183,8 @@ if tool == "ショート動画変換" and uploaded_file is not None:
     
     # 動画情報を表示
     try:
+        from moviepy import VideoFileClip
+        
         clip = VideoFileClip(input_video_path)
         col1, col2, col3 = st.columns(3)
         
@@ -864,26 +205,35 @@ if tool == "ショート動画変換" and uploaded_file is not None:
         trim_video = st.checkbox("不要な部分を削除する")
         
         if trim_video:
+            from movie_converter.filmstrip import create_filmstrip, extract_frame
+
+            # 動画全体のサムネイル一覧（1回のデコードで作成し、同じ動画ではキャッシュを使用）
+            try:
+                filmstrip = create_filmstrip(input_video_path, count=10)
+                st.image(filmstrip['image_path'], use_container_width=True)
+                st.caption(" / ".join(f"{t:.1f}s" for t in filmstrip['times']))
+            except Exception as e:
+                st.warning(f"サムネイル一覧を作成できませんでした: {str(e)}")
+
+            start_time, end_time = st.slider(
+                "トリミング範囲（秒）",
+                min_value=0.0,
+                max_value=float(clip.duration),
+                value=(0.0, float(clip.duration)),
+                step=0.1,
+                help="この範囲だけを残します"
+            )
+
+            # 開始・終了位置のフレームを確認（レンダリングせずに1フレームだけ取り出す）
             col1, col2 = st.columns(2)
-            with col1:
-                start_time = st.number_input(
-                    "開始時間（秒）", 
-                    min_value=0, 
-                    max_value=int(clip.duration), 
-                    value=0, 
-                    step=1,
-                    help="この時間から動画を開始します"
-                )
-            with col2:
-                end_time = st.number_input(
-                    "終了時間（秒）", 
-                    min_value=start_time + 1, 
-                    max_value=int(clip.duration), 
-                    value=int(clip.duration), 
-                    step=1,
-                    help="この時間で動画を終了します"
-                )
-            
+            try:
+                with col1:
+                    st.image(extract_frame(input_video_path, start_time), caption=f"開始 {start_time:.1f}秒")
+                with col2:
+                    st.image(extract_frame(input_video_path, max(start_time, end_time - 0.1)), caption=f"終了 {end_time:.1f}秒")
+            except Exception as e:
+                st.warning(f"プレビューを表示できませんでした: {str(e)}")
+
             if end_time > start_time:
                 trimmed_duration = end_time - start_time
                 st.info(f"⏱️ トリミング後の長さ: {trimmed_duration:.1f}秒")
@@ -910,8 +260,14 @@ if tool == "ショート動画変換" and uploaded_file is not None:
                 st.info("📊 原寸大表示: 100% (元の動画のまま)")
             else:
                 st.info(f"📈 拡大表示: {scale_factor*100:.0f}% (ズームイン効果)")
+
+            reframe = st.checkbox(
+                "被写体を自動追跡して切り抜く（オートリフレーム）",
+                help="横長の動画で、顔や動きのある位置を追いかけて9:16に切り抜きます。解析結果はキャッシュされ、同じ動画の再変換では解析を省略します。"
+            )
         else:
             scale_factor = 1.0 # 元のサイズを維持する場合はスケールは1.0固定
+            reframe = False
         
         # テキストオーバーレイ設定
         add_text = st.checkbox("テキストを追加する")
@@ -1082,17 +438,65 @@ if tool == "ショート動画変換" and uploaded_file is not None:
                     st.session_state.voices = []
                     st.rerun()
         
+        # 音声の発話タイミングから字幕を自動生成
+        voice_subtitles = None
+        subtitle_position = "bottom"
+        if add_voice:
+            subtitle_options = {None: "作成しない", "phrase": "文ごとに表示", "karaoke": "話した部分まで順に表示"}
+            voice_subtitles = st.selectbox(
+                "音声の字幕を自動作成",
+                list(subtitle_options),
+                format_func=lambda mode: subtitle_options[mode],
+                help="音声合成で得られる発話タイミングからテロップを作成します（手動でのタイミング合わせは不要です）。"
+            )
+            if voice_subtitles:
+                subtitle_position = st.selectbox(
+                    "字幕の位置", ["bottom", "center", "top"],
+                    format_func=lambda position: {"bottom": "下", "center": "中央", "top": "上"}[position]
+                )
+        
         # BGM設定
         st.subheader("🎵 BGM設定")
         add_bgm = st.checkbox("BGMを追加する")
         
+        bgm_file = None
+        bgm_track = None
+        save_bgm = False
         if add_bgm:
-            bgm_file = st.file_uploader(
-                "BGMファイルをアップロード",
-                type=['mp3', 'wav', 'aac', 'm4a', 'ogg'],
-                help="MP3, WAV, AAC, M4A, OGG形式の音声ファイルをサポートしています"
+            tracks = bgm.list_tracks()
+            bgm_source = st.radio(
+                "BGMの指定方法",
+                ["library", "upload"],
+                index=0 if tracks else 1,
+                format_func=lambda source: {"library": "ライブラリから選ぶ", "upload": "ファイルをアップロード"}[source],
+                horizontal=True
             )
             
+            if bgm_source == "library":
+                if tracks:
+                    bgm_track = st.selectbox(
+                        "BGMトラック",
+                        [track['id'] for track in tracks],
+                        format_func=lambda track_id: next(
+                            f"{t['name']}（{t['duration']:.1f}秒・{t['loudness'] if t['loudness'] is not None else '-'} LUFS）"
+                            for t in tracks if t['id'] == track_id
+                        )
+                    )
+                    # 先頭30秒だけ試聴（保存済みのPCMをそのまま再生）
+                    preview = bgm.load_pcm(bgm_track)[:bgm.SAMPLE_RATE * 30]
+                    st.audio(preview.T / 32768, sample_rate=bgm.SAMPLE_RATE)
+                else:
+                    st.info("ライブラリにBGMがありません。ファイルをアップロードしてください。")
+            else:
+                bgm_file = st.file_uploader(
+                    "BGMファイルをアップロード",
+                    type=['mp3', 'wav', 'aac', 'm4a', 'ogg'],
+                    help="MP3, WAV, AAC, M4A, OGG形式の音声ファイルをサポートしています"
+                )
+                save_bgm = st.checkbox("ライブラリに保存する", help="次回からアップロードせずに選べます（音量は自動でそろえます）")
+                if bgm_file:
+                    st.audio(bgm_file)
+            
             col1, col2 = st.columns(2)
             with col1:
                 bgm_volume = st.slider("BGM音量", 0.0, 1.0, 0.3, 0.1)
@@ -1100,96 +504,85 @@ if tool == "ショート動画変換" and uploaded_file is not None:
                 original_volume = st.slider("元音声音量", 0.0, 1.0, 0.7, 0.1)
             
             loop_bgm = st.checkbox("BGMをループ再生", value=True)
-            
-            if bgm_file:
-                st.audio(bgm_file)
+        
+        # 追加の出力サイズ
+        renditions = st.multiselect(
+            "追加で出力するサイズ",
+            list(RENDITION_PRESETS),
+            help="完成した動画を1回だけデコードし、同時に複数のエンコーダーで出力します（720p: 720x1280、preview: 360x640の軽量版）。"
+        )
+        quality = st.selectbox(
+            "画質",
+            list(QUALITY_PRESETS),
+            index=list(QUALITY_PRESETS).index(DEFAULT_QUALITY),
+            format_func=lambda name: QUALITY_PRESETS[name]['label'],
+            help="動画の細かさと動きを解析し、この範囲の中でCRF・最大ビットレート・x264のチューニングを自動で決めます。"
+        )
+        covers = st.number_input(
+            "カバー画像の候補数", min_value=0, max_value=MAX_COVERS, value=TOP_K, step=1,
+            help="完成した動画から鮮明さ・明るさ・顔の有無で候補を選び、元の解像度の画像で書き出します（0で作成しない）。"
+        )
         
         # 変換ボタン
         if st.button("ショート動画に変換", type="primary"):
             progress_bar = st.progress(0)
             status_text = st.empty()
             
+            def update_progress(percent, message):
+                progress_bar.progress(percent)
+                status_text.text(message)
+            
             try:
                 # BGMファイルを一時保存
                 bgm_path = None
                 if add_bgm and bgm_file is not None:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_bgm:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(bgm_file.name)[1]) as tmp_bgm:
                         tmp_bgm.write(bgm_file.read())
                         bgm_path = tmp_bgm.name
+                    if save_bgm:
+                        track = bgm.add_track(bgm_path, name=os.path.splitext(bgm_file.name)[0])
+                        bgm_track = track['id']
+                        st.success(f"BGM「{track['name']}」をライブラリに保存しました")
                 
-                # Step 1: 動画をショート形式にリサイズ
-                status_text.text("動画をリサイズ中...")
-                progress_bar.progress(20)
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='_resized.mp4') as tmp_resized:
-                    resized_video_path = tmp_resized.name
-                
-                # トリミングパラメータを設定
-                trim_start = start_time if trim_video else None
-                trim_end = end_time if trim_video else None
-                
-                resize_video_to_shorts(input_video_path, resized_video_path, scale_factor, trim_start, trim_end, keep_original_size)
-                progress_bar.progress(40)
-                
-                # Step 2: テキストを追加（オプション）
-                current_video_path = resized_video_path
-                if add_text and st.session_state.telops:
-                    status_text.text("テキストを追加中...")
-                    progress_bar.progress(60)
-                    
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='_with_text.mp4') as tmp_text:
-                        text_video_path = tmp_text.name
-                    
-                    add_text_to_video(current_video_path, text_video_path, st.session_state.telops, font_size)
-                    os.unlink(current_video_path)
-                    current_video_path = text_video_path
+                with tempfile.NamedTemporaryFile(delete=False, suffix='_final.mp4') as tmp_final:
+                    final_video_path = tmp_final.name
                 
-                # Step 3: 音声合成を追加（オプション）
-                if add_voice and st.session_state.voices:
-                    status_text.text("雨晴はうの音声を生成・追加中...")
-                    progress_bar.progress(60)
-                    
-                    try:
-                        # 複数音声を動画に追加
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='_with_voices.mp4') as tmp_voice:
-                            voice_video_path = tmp_voice.name
-                        
-                        add_multiple_voices_to_video(
-                            current_video_path,
-                            voice_video_path,
-                            st.session_state.voices,
-                            1.0  # 元音声音量
-                        )
-                        
-                        os.unlink(current_video_path)
-                        current_video_path = voice_video_path
-                        
-                    except Exception as e:
-                        st.warning(f"⚠️ 音声合成をスキップしました: {str(e)}")
-                
-                # Step 4: BGMを追加（オプション）
-                if add_bgm and bgm_path:
-                    status_text.text("BGMを追加中...")
-                    progress_bar.progress(80)
-                    
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='_final.mp4') as tmp_final:
-                        final_video_path = tmp_final.name
-                    
-                    add_bgm_to_video(
-                        current_video_path, 
-                        final_video_path, 
-                        bgm_path, 
-                        bgm_volume, 
-                        original_volume, 
-                        loop_bgm
+                try:
+                    # リサイズ→テロップ→音声→BGMの順に処理
+                    options = dict(
+                        scale_factor=scale_factor,
+                        start_time=start_time if trim_video else None,
+                        end_time=end_time if trim_video else None,
+                        keep_original_size=keep_original_size,
+                        reframe=reframe,
+                        telops=st.session_state.telops if add_text else None,
+                        font_size=font_size if add_text else 60,
+                        voices=st.session_state.voices if add_voice else None,
+                        voice_subtitles=voice_subtitles,
+                        subtitle_position=subtitle_position,
+                        bgm_path=None if bgm_track else bgm_path,
+                        bgm_track=bgm_track,
+                        bgm_volume=bgm_volume if add_bgm else 0.3,
+                        original_volume=original_volume if add_bgm else 0.7,
+                        loop_bgm=loop_bgm if add_bgm else True,
+                        renditions=renditions,
+                        quality=quality,
+                        covers=int(covers),
                     )
-                    os.unlink(current_video_path)
-                    os.unlink(bgm_path)
-                else:
-                    final_video_path = current_video_path
-                
-                progress_bar.progress(100)
-                status_text.text("変換完了！")
+                    with supervised_run():
+                        if spool.get_spool_dir():
+                            # 共有スプールのワーカーに任せる
+                            spool.run_job({'tool': "shorts", 'input': input_video_path, 'output': final_video_path, **options},
+                                          progress=update_progress, on_warning=st.warning)
+                        else:
+                            # 最後のエンコード中は、書き出し済みの部分をプレビューとして表示する
+                            run_with_live_preview(
+                                lambda **kwargs: run_shorts_job(input_video_path, final_video_path, **options, **kwargs),
+                                update_progress, st.warning
+                            )
+                finally:
+                    if bgm_path:
+                        os.unlink(bgm_path)
                 
                 # プレビュー表示
                 st.subheader("📹 プレビュー")
@@ -1203,6 +596,36 @@ if tool == "ショート動画変換" and uploaded_file is not None:
                         file_name=f"shorts_{uploaded_file.name}",
                         mime="video/mp4"
                     )
+                for name in renditions:
+                    path = rendition_path(final_video_path, name)
+                    with open(path, 'rb') as file:
+                        st.download_button(
+                            label=f"📱 {name} 版をダウンロード",
+                            data=file.read(),
+                            file_name=f"shorts_{name}_{uploaded_file.name}",
+                            mime="video/mp4"
+                        )
+                    os.unlink(path)
+                
+                # カバー画像の候補（点数の高い順）
+                cover_paths = [cover_path(final_video_path, i) for i in range(1, int(covers) + 1)]
+                cover_paths = [path for path in cover_paths if os.path.exists(path)]
+                if cover_paths:
+                    st.subheader("🖼️ カバー画像の候補")
+                    cover_columns = st.columns(len(cover_paths))
+                    for i, (column, path) in enumerate(zip(cover_columns, cover_paths), start=1):
+                        with column:
+                            with open(path, 'rb') as file:
+                                image = file.read()
+                            st.image(image, caption=f"候補 {i}", use_container_width=True)
+                            st.download_button(
+                                label=f"🖼️ 候補 {i} をダウンロード",
+                                data=image,
+                                file_name=f"cover{i}_{os.path.splitext(uploaded_file.name)[0]}.jpg",
+                                mime="image/jpeg",
+                                key=f"cover_download_{i}"
+                            )
+                        os.unlink(path)
                 
                 # 一時ファイルをクリーンアップ
                 os.unlink(input_video_path)
@@ -1228,6 +651,8 @@ elif tool == "動画結合" and uploaded_files:
     else:
         st.success(f"✅ {len(uploaded_files)}個の動画ファイルが選択されました。")
         
+        from moviepy import VideoFileClip
+        
         # 動画情報を表示
         st.subheader("📹 選択された動画")
         total_duration = 0
@@ -1278,6 +703,25 @@ elif tool == "動画結合" and uploaded_files:
         
         st.info(f"📊 結合後の総時間: {total_duration:.1f}秒")
         
+        # トランジション設定（解像度・FPSが異なる動画は最大のサイズ・FPSにそろえて結合）
+        transition_options = {None: "なし（そのまま連結）", **TRANSITIONS}
+        transition = st.selectbox(
+            "クリップ間のトランジション",
+            list(transition_options),
+            format_func=lambda name: transition_options[name]
+        )
+        transition_duration = 0.5
+        if transition:
+            transition_duration = st.slider("トランジションの長さ（秒）", 0.2, 2.0, 0.5, step=0.1)
+            st.caption("トランジションの分だけ、結合後の動画は短くなります。")
+        quality = st.selectbox(
+            "画質",
+            list(QUALITY_PRESETS),
+            index=list(QUALITY_PRESETS).index(DEFAULT_QUALITY),
+            format_func=lambda name: QUALITY_PRESETS[name]['label'],
+            key="combine_quality"
+        )
+        
         # 結合ボタン
         if st.button("動画を結合", type="primary"):
             progress_bar = st.progress(0)
@@ -1318,15 +762,26 @@ elif tool == "動画結合" and uploaded_files:
                                 pass
                         raise
                 
-                progress_bar.progress(50)
-                
                 # 動画を結合
                 with tempfile.NamedTemporaryFile(delete=False, suffix='_combined.mp4') as tmp_output:
                     output_path = tmp_output.name
                 
-                combine_videos(temp_paths, output_path)
-                progress_bar.progress(100)
-                status_text.text("結合完了！")
+                def update_progress(percent, message):
+                    progress_bar.progress(percent)
+                    status_text.text(message)
+                
+                with supervised_run():
+                    if spool.get_spool_dir():
+                        spool.run_job({'tool': "combine", 'inputs': temp_paths, 'output': output_path,
+                                       'transition': transition, 'transition_duration': transition_duration,
+                                       'quality': quality}, progress=update_progress)
+                    else:
+                        run_with_live_preview(
+                            lambda **kwargs: run_combine_job(temp_paths, output_path, transition=transition,
+                                                             transition_duration=transition_duration, quality=quality,
+                                                             **kwargs),
+                            update_progress
+                        )
                 
                 # プレビュー表示
                 st.subheader("📹 結合された動画")
@@ -1359,14 +814,22 @@ elif tool == "動画結合" and uploaded_files:
 
 elif tool == "パワポナレーション動画" and uploaded_pptx is not None:
     try:
-        # PowerPointファイルからスライドとノートを抽出
+        # PowerPointファイルからスライドとノートを抽出（同じファイルは解析済みの結果を使用）
         with st.spinner("PowerPointファイルを解析中..."):
-            slides_data = extract_slides_and_notes(uploaded_pptx)
+            analysis = analyse_presentation(uploaded_pptx)
+        slides_data = analysis['slides']
         
         if not slides_data:
             st.error("❌ スライドが見つかりませんでした。")
         else:
             st.success(f"✅ {len(slides_data)}枚のスライドが見つかりました。")
+            details = f"スライドのサイズ: {analysis['slide_width']}×{analysis['slide_height']}"
+            if analysis['media']:
+                counts = {}
+                for item in analysis['media']:
+                    counts[item['kind']] = counts.get(item['kind'], 0) + 1
+                details += "　埋め込みメディア: " + "、".join(f"{kind} {count}件" for kind, count in counts.items())
+            st.caption(details)
             
             # スライド情報を表示
             st.subheader("📋 抽出されたスライド情報")
@@ -1415,90 +878,29 @@ elif tool == "パワポナレーション動画" and uploaded_pptx is not None:
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
+                def update_progress(percent, message):
+                    progress_bar.progress(percent)
+                    status_text.text(message)
+                
+                final_output_path = tempfile.mktemp(suffix='_presentation_video.mp4')
+                
                 try:
-                    # Step 1: PowerPointスライドを画像に変換
-                    status_text.text("スライドを画像に変換中...")
-                    progress_bar.progress(10)
-                    
-                    # PowerPointファイルから実際のスライド画像を抽出
-                    try:
-                        slide_image_paths, temp_conversion_dir = create_slide_images_from_pptx(uploaded_pptx)
-                        use_real_slides = True
-                        st.info(f"✅ {len(slide_image_paths)}枚のスライド画像を抽出しました")
-                    except Exception as e:
-                        st.warning(f"⚠️ スライド画像の抽出に失敗しました。テキストベースのスライドを使用します: {str(e)}")
-                        slide_image_paths = []
-                        use_real_slides = False
-                    
-                    slide_videos = []
-                    temp_files = []
-                    
-                    for i, slide in enumerate(slides_data):
-                        progress = 10 + (i / len(slides_data)) * 80
-                        progress_bar.progress(int(progress))
-                        status_text.text(f"スライド {i+1}/{len(slides_data)} を処理中...")
-                        
-                        # スライド画像を取得（実際のスライドまたはテキストベース）
-                        if use_real_slides and i < len(slide_image_paths):
-                            slide_image_path = slide_image_paths[i]
-                        else:
-                            # フォールバック: テキストベースのスライド生成
-                            slide_image_path = create_text_slide_image(
-                                slide['slide_text'], 
-                                f"スライド {slide['slide_number']}"
-                            )
-                            temp_files.append(slide_image_path)
-                        
-                        # ナレーション音声を生成（ノートがある場合）
-                        if slide['notes_text'].strip():
-                            try:
-                                voice_path = generate_voice_with_voicevox(slide['notes_text'])
-                                temp_files.append(voice_path)
-                                
-                                # 音声の長さを取得
-                                audio_clip = AudioFileClip(voice_path)
-                                duration = max(audio_clip.duration, 3)  # 最低3秒
-                                audio_clip.close()
-                                
-                            except Exception as e:
-                                st.warning(f"⚠️ スライド{i+1}の音声生成に失敗: {str(e)}")
-                                voice_path = None
-                                duration = slide_duration
-                        else:
-                            voice_path = None
-                            duration = slide_duration
-                        
-                        # スライド動画を作成
-                        slide_video_path = tempfile.mktemp(suffix=f'_slide_video_{i}.mp4')
-                        temp_files.append(slide_video_path)
-                        
-                        if voice_path:
-                            create_slide_video_with_narration(slide_image_path, voice_path, duration, slide_video_path)
+                    # スライド画像化→ナレーション生成→スライド動画作成→結合
+                    with supervised_run():
+                        if spool.get_spool_dir():
+                            spool.run_job({'tool': "pptx", 'input': uploaded_pptx, 'output': final_output_path,
+                                           'slide_duration': slide_duration},
+                                          progress=update_progress, on_warning=st.warning)
                         else:
-                            # 音声なしの場合
-                            from moviepy import ImageClip
-                            clip = ImageClip(slide_image_path, duration=duration)
-                            clip.write_videofile(
-                                slide_video_path,
-                                codec='libx264',
-                                fps=1,
-                                ffmpeg_params=['-crf', '18', '-preset', 'fast']
+                            run_pptx_job(
+                                uploaded_pptx,
+                                final_output_path,
+                                slide_duration=slide_duration,
+                                slides_data=slides_data,
+                                progress=update_progress,
+                                on_warning=st.warning,
+                                on_info=st.info,
                             )
-                            clip.close()
-                        
-                        slide_videos.append(slide_video_path)
-                    
-                    # Step 2: 全スライド動画を結合
-                    status_text.text("動画を結合中...")
-                    progress_bar.progress(90)
-                    
-                    final_output_path = tempfile.mktemp(suffix='_presentation_video.mp4')
-                    temp_files.append(final_output_path)
-                    
-                    combine_videos(slide_videos, final_output_path)
-                    
-                    progress_bar.progress(100)
-                    status_text.text("変換完了！")
                     
                     # プレビュー表示
                     st.subheader("📹 作成されたナレーション動画")
@@ -1519,24 +921,10 @@ elif tool == "パワポナレーション動画" and uploaded_pptx is not None:
                     st.error(f"❌ エラーが発生しました: {str(e)}")
                 finally:
                     # 一時ファイルをクリーンアップ
-                    for temp_file in temp_files:
-                        try:
-                            os.unlink(temp_file)
-                        except:
-                            pass
-                    
-                    # スライド画像の一時ファイルもクリーンアップ
-                    if use_real_slides:
-                        for slide_image in slide_image_paths:
-                            try:
-                                os.unlink(slide_image)
-                            except:
-                                pass
-                        try:
-                            import shutil
-                            shutil.rmtree(temp_conversion_dir, ignore_errors=True)
-                        except:
-                            pass
+                    try:
+                        os.unlink(final_output_path)
+                    except:
+                        pass
     
     except Exception as e:
         st.error(f"❌ PowerPointファイルの解析に失敗しました: {str(e)}")
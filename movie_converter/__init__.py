@@ -0,0 +1,61 @@
+"""動画編集ツールの処理ライブラリ（Streamlitに依存しない）
+
+ショート動画変換・動画結合・パワポナレーション動画の各処理を提供します。
+UI（app.py）、バッチCLI（python -m movie_converter）から共通で利用します。
+
+moviepy・OpenCV・Pillow・NumPy・python-pptx などの重いライブラリは、
+実際に処理を行う関数の中で読み込みます。パッケージ直下の関数も初回アクセス時に
+該当モジュールを読み込むため、ワーカーやCLIは必要なツールの分だけimportコストを払います。
+"""
+import importlib
+
+# 公開関数名 → 定義モジュール
+_EXPORTS = {
+    'resize_video_to_shorts': 'shorts',
+    'add_text_to_video': 'shorts',
+    'add_multiple_voices_to_video': 'shorts',
+    'add_bgm_to_video': 'shorts',
+    'create_renditions': 'shorts',
+    'rendition_path': 'shorts',
+    'combine_videos': 'combine',
+    'concat_videos_copy': 'combine',
+    'add_track': 'bgm',
+    'list_tracks': 'bgm',
+    'analyse_complexity': 'ratecontrol',
+    'plan_encoding': 'ratecontrol',
+    'encode_chunked': 'chunked',
+    'select_covers': 'cover',
+    'cover_path': 'cover',
+    'analyse_presentation': 'presentation',
+    'extract_slides_and_notes': 'presentation',
+    'create_slide_images_from_pptx': 'presentation',
+    'create_slide_video_with_narration': 'presentation',
+    'create_silent_slide_video': 'presentation',
+    'create_text_slide_image': 'presentation',
+    'get_slide_images': 'presentation',
+    'get_voicevox_url': 'voicevox',
+    'generate_voice_with_voicevox': 'voicevox',
+    'generate_voice_with_timings': 'voicevox',
+    'voice_subtitle_telops': 'subtitles',
+    'run_shorts_job': 'jobs',
+    'run_combine_job': 'jobs',
+    'run_pptx_job': 'jobs',
+    'run_job': 'jobs',
+    'compare_outputs': 'verify',
+    'assert_equivalent': 'verify',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
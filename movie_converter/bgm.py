@@ -0,0 +1,174 @@
+"""サーバー側のBGMライブラリ
+
+よく使うBGMを一度だけデコードして、共通形式のPCM（44.1kHz・ステレオ・16bit、ヘッダーなし）で保存し、
+EBU R128 のラウドネス（ffmpeg の ebur128 フィルター）と長さを同時に測って保存します。
+ジョブはBGMをトラックIDで指定し、保存済みのPCMをそのまま ffmpeg に渡して、
+測定済みのラウドネスから求めたゲインでミックスします（ジョブごとのアップロード・デコードが不要）。
+
+    <ライブラリ>/<トラックID>.pcm   s16le のPCM（numpy.memmap で読み込み可能）
+    <ライブラリ>/<トラックID>.json  {'id', 'name', 'duration', 'loudness', 'loudness_range', 'true_peak', ...}
+
+トラックIDは元ファイルの内容ハッシュから作るため、同じファイルを追加しても1つにまとまります。
+保存先は MOVIE_CONVERTER_BGM_DIR（既定: MOVIE_CONVERTER_CACHE_DIR/bgm）です。
+"""
+import json
+import math
+import os
+import re
+import time
+
+from . import supervisor
+from .cache import file_digest, get_cache_dir
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_BYTES = 2            # s16le
+TARGET_LOUDNESS = -23.0     # ミックス前にそろえるラウドネス（LUFS、EBU R128 の基準値）
+TRUE_PEAK_LIMIT = -1.0      # ゲインを掛けた後のトゥルーピークの上限（dBTP）
+MAX_GAIN_DB = 20.0          # 極端に小さい音源を持ち上げすぎない
+SILENCE_LOUDNESS = -70.0    # ebur128 が無音に対して返す値
+TRACK_ID_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+def get_library_dir():
+    path = os.getenv('MOVIE_CONVERTER_BGM_DIR')
+    if not path:
+        return get_cache_dir('bgm')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _track_path(track_id, ext):
+    # トラックIDはクライアントから指定されるため、形式を確認してからパスにする
+    if not isinstance(track_id, str) or not TRACK_ID_PATTERN.match(track_id):
+        raise ValueError(f"不正なBGMトラックIDです: {track_id}")
+    return os.path.join(get_library_dir(), f"{track_id}.{ext}")
+
+
+def _parse_summary(stderr):
+    """ebur128 の Summary からラウドネス・ラウドネスレンジ・トゥルーピークを取り出す"""
+    summary = stderr.rsplit('Summary:', 1)[-1]
+    values = {}
+    for name, pattern in (('loudness', r'I:\s+(-?[\d.]+|-inf) LUFS'),
+                          ('loudness_range', r'LRA:\s+(-?[\d.]+) LU\b'),
+                          ('true_peak', r'Peak:\s+(-?[\d.]+|-inf) dBFS')):
+        match = re.search(pattern, summary)
+        if match is None:
+            raise Exception(f"ラウドネスの測定結果を読み取れません: {summary[-500:]}")
+        value = float(match.group(1))
+        # 無音の場合は -inf になる（JSONに書けないため None にする）
+        values[name] = None if math.isinf(value) else value
+    return values
+
+
+def track_gain(track, target=TARGET_LOUDNESS):
+    """トラックを target（LUFS）にそろえるゲイン（dB）。トゥルーピークが上限を超えないよう抑える"""
+    if track['loudness'] is None or track['loudness'] <= SILENCE_LOUDNESS:
+        return 0.0
+    gain = min(target - track['loudness'], MAX_GAIN_DB)
+    if track['true_peak'] is not None:
+        gain = min(gain, TRUE_PEAK_LIMIT - track['true_peak'])
+    return round(gain, 2)
+
+
+def add_track(audio_path, name=None):
+    """音声ファイルをライブラリに追加してメタデータを返す（追加済みの場合はデコードしない）"""
+    track_id = file_digest(audio_path)[:16]
+    existing = get_track(track_id, missing_ok=True)
+    if existing is not None:
+        return existing
+
+    pcm_path = _track_path(track_id, 'pcm')
+    tmp_path = f"{pcm_path}.{os.getpid()}.tmp"
+    # デコード・形式の変換とラウドネスの測定を1回で行う
+    cmd = [
+        'ffmpeg', '-nostats', '-hide_banner', '-i', audio_path, '-vn',
+        '-af', 'ebur128=peak=true:framelog=quiet',
+        '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS), '-f', 's16le', '-y', tmp_path
+    ]
+    try:
+        result = supervisor.run(cmd, stage='audio', capture_output=True, text=True, errors='replace')
+        if result.returncode != 0:
+            raise Exception(f"BGMのデコードに失敗しました: {result.stderr[-1000:]}")
+        track = {
+            'id': track_id,
+            'name': name or os.path.splitext(os.path.basename(audio_path))[0],
+            'duration': round(os.path.getsize(tmp_path) / (SAMPLE_RATE * CHANNELS * SAMPLE_BYTES), 3),
+            **_parse_summary(result.stderr),
+            'sample_rate': SAMPLE_RATE,
+            'channels': CHANNELS,
+            'added_at': time.time(),
+        }
+        if track['duration'] <= 0:
+            raise Exception(f"BGMに音声がありません: {audio_path}")
+        os.replace(tmp_path, pcm_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    # メタデータは最後に書く（メタデータがあればPCMもそろっている）
+    meta_path = _track_path(track_id, 'json')
+    meta_tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(meta_tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(track, f, ensure_ascii=False)
+    os.replace(meta_tmp_path, meta_path)
+    return dict(track, gain=track_gain(track))
+
+
+def get_track(track_id, missing_ok=False):
+    """トラックのメタデータ（見つからない場合は例外、missing_ok=True なら None）"""
+    try:
+        with open(_track_path(track_id, 'json'), 'r', encoding='utf-8') as f:
+            track = json.load(f)
+    except FileNotFoundError:
+        if missing_ok:
+            return None
+        raise ValueError(f"BGMトラックが見つかりません: {track_id}")
+    track['gain'] = track_gain(track)
+    return track
+
+
+def list_tracks():
+    """ライブラリのトラック一覧（名前順）"""
+    tracks = []
+    for filename in os.listdir(get_library_dir()):
+        track_id, ext = os.path.splitext(filename)
+        if ext == '.json' and TRACK_ID_PATTERN.match(track_id):
+            track = get_track(track_id, missing_ok=True)
+            if track is not None:
+                tracks.append(track)
+    return sorted(tracks, key=lambda track: (track['name'], track['id']))
+
+
+def remove_track(track_id):
+    """トラックを削除（削除した場合 True）"""
+    removed = False
+    for ext in ('json', 'pcm'):
+        try:
+            os.unlink(_track_path(track_id, ext))
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def pcm_input_args(pcm_path):
+    """共通形式のPCMファイルを ffmpeg の入力にする引数"""
+    return ['-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS), '-i', pcm_path]
+
+
+def ffmpeg_input_args(track_id):
+    """保存済みのPCMを ffmpeg の入力にする引数（デコード不要）"""
+    pcm_path = _track_path(track_id, 'pcm')
+    if not os.path.exists(pcm_path):
+        raise ValueError(f"BGMトラックが見つかりません: {track_id}")
+    return pcm_input_args(pcm_path)
+
+
+def load_pcm(track_id):
+    """保存済みのPCMをメモリマップで読み込む（形状: (サンプル数, チャンネル数)、int16）"""
+    import numpy as np
+
+    pcm_path = _track_path(track_id, 'pcm')
+    if not os.path.exists(pcm_path):
+        raise ValueError(f"BGMトラックが見つかりません: {track_id}")
+    return np.memmap(pcm_path, dtype='<i2', mode='r').reshape(-1, CHANNELS)
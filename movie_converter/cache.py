@@ -0,0 +1,74 @@
+"""ファイル内容ハッシュとキャッシュディレクトリ
+
+解析結果などを入力ファイルの内容ハッシュで保存し、同じ入力の再処理を省きます。
+保存先は MOVIE_CONVERTER_CACHE_DIR 環境変数（既定: tmp/cache）です。
+"""
+import hashlib
+import json
+import os
+
+from . import metrics
+
+_digest_memo = {}
+
+
+def get_cache_dir(name):
+    """用途別のキャッシュディレクトリを返す（なければ作成）"""
+    root = os.getenv('MOVIE_CONVERTER_CACHE_DIR', os.path.join('tmp', 'cache'))
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_digest(path):
+    """ファイル内容のSHA-256（同じプロセス内では サイズ・更新時刻 が同じなら再計算しない）"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _digest_memo.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = _digest_memo[memo_key] = h.hexdigest()
+    return digest
+
+
+def stream_digest(fileobj):
+    """ファイルライクオブジェクト（アップロードされたファイルなど）の内容のSHA-256
+
+    読み込み後は先頭に戻します。
+    """
+    h = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+        h.update(chunk)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+
+def params_digest(params):
+    """パラメータ（JSON化できる値）のハッシュ"""
+    encoded = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def load_json(cache_name, key):
+    path = os.path.join(get_cache_dir(cache_name), f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        metrics.inc('cache_requests_total', cache=cache_name, result="miss")
+        return None
+    metrics.inc('cache_requests_total', cache=cache_name, result="hit")
+    return data
+
+
+def save_json(cache_name, key, data):
+    path = os.path.join(get_cache_dir(cache_name), f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,188 @@
+"""キーフレーム単位で分割した並列エンコード
+
+長い素材は libx264 の1プロセスでは全コアを使い切れないため、
+入力をキーフレームの位置で区間に分け、同じ設定の ffmpeg を区間ごとに並列で実行し、
+できた区間を再エンコードせずに連結（concat demuxer）します。
+
+- 区間の境界は入力のキーフレーム（多くのエンコーダーはシーンの切り替わりにも置く）から選ぶため、
+  各区間の読み出しは境界の直前から始まり、余分なデコードがありません
+- 区間の切り出しは trim の start_pts / end_pts（ストリームのタイムベースの整数）で行うため、
+  境界のフレームが重複・欠落しません。開始・終了時間はファイルの先頭時刻（MPEG-TS・編集リスト付きの
+  MP4 などでは 0 でない）からの相対として、音声や1プロセスでのエンコードと同じ位置で切り出します
+- 音声は区間に分けず、全体を1本でエンコードして最後に多重化します（境界で途切れない）
+
+並列数は MOVIE_CONVERTER_ENCODE_WORKERS（既定: CPUコア数、1 で無効）で指定します。
+"""
+import contextvars
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from . import metrics, supervisor
+from .media import FASTSTART_ARGS, probe_video
+from .ratecontrol import x264_args
+
+CHUNKED_MIN_SECONDS = 120   # これより短い素材は分割しない（区間ごとの起動・IDRフレームの分が割に合わない）
+CHUNK_MIN_SECONDS = 20      # 1区間の最短の長さ
+CHUNKS_PER_WORKER = 2       # 区間の長さのばらつきを吸収するため、並列数より多めに分ける
+READ_MARGIN_SECONDS = 2     # 区間の終わりより先まで読む長さ（表示順が後ろにずれる B フレームを含めるため）
+
+
+def encode_workers():
+    """並列にエンコードするプロセス数"""
+    return max(1, int(os.getenv('MOVIE_CONVERTER_ENCODE_WORKERS', str(os.cpu_count() or 1))))
+
+
+def _ffprobe_json(cmd):
+    try:
+        result = supervisor.run(cmd, stage='probe', check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"キーフレームの取得に失敗しました: {e.stderr}")
+    return json.loads(result.stdout)
+
+
+def keyframes(video_path, start_time=None, end_time=None):
+    """映像のキーフレームの表示時刻（タイムベースの整数）・タイムベース（秒）・ファイルの先頭時刻を返す
+
+    先頭時刻はファイルの start_time（全ストリームで最も早い時刻）をタイムベースの整数にしたもの。
+    ffmpeg の -ss・-t はこの時刻からの相対で、パケットの時刻は絶対値のため、
+    start_time / end_time（先頭からの秒）はこれを足して比べます。
+    パケットのフラグだけを読むため、デコードはしません。
+    """
+    header = _ffprobe_json(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                            '-show_entries', 'stream=time_base:format=start_time', '-of', 'json', video_path])
+    numerator, denominator = header['streams'][0]['time_base'].split('/')
+    time_base = int(numerator) / int(denominator)
+    origin = float(header.get('format', {}).get('start_time') or 0.0)
+
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts,flags', '-of', 'json']
+    if start_time is not None:
+        # read_intervals は絶対時刻
+        end = f"{origin + end_time:.6f}" if end_time is not None else ''
+        cmd.extend(['-read_intervals', f"{origin + start_time:.6f}%{end}"])
+    data = _ffprobe_json([*cmd, video_path])
+    points = sorted({packet['pts'] for packet in data.get('packets', [])
+                     if 'K' in packet.get('flags', '') and packet.get('pts') is not None})
+    return points, time_base, round(origin / time_base)
+
+
+def plan_chunks(points, time_base, start_pts, last_pts, end_pts, workers):
+    """区間の境界（タイムベースの整数）のリストを返す。[start_pts, ..., end_pts]
+
+    各区間がほぼ同じ長さになるよう、理想の位置に最も近いキーフレームを選びます。
+    last_pts: 範囲の終わりの目安（end_pts が None = 素材の終わりまでの場合は素材の長さから求めた値）
+    """
+    last = end_pts if end_pts is not None else last_pts
+    duration = (last - start_pts) * time_base
+    count = max(1, min(workers * CHUNKS_PER_WORKER, int(duration // CHUNK_MIN_SECONDS)))
+    candidates = [pts for pts in points if start_pts < pts < last]
+    boundaries = [start_pts]
+    for i in range(1, count):
+        ideal = start_pts + (last - start_pts) * i / count
+        nearest = min(candidates, key=lambda pts: abs(pts - ideal), default=None)
+        if nearest is not None and nearest > boundaries[-1] \
+                and (nearest - boundaries[-1]) * time_base >= CHUNK_MIN_SECONDS:
+            boundaries.append(nearest)
+    boundaries.append(end_pts)
+    return boundaries
+
+
+def _encode_chunk(video_path, chunk_path, start, end, time_base, origin, vf, encoding, threads, lead=0.0):
+    """1区間の映像だけをエンコード（入力のタイムスタンプのまま trim で切り出す）
+
+    start / end は絶対時刻（タイムベースの整数）。入力の -ss・-to はファイルの先頭時刻 origin からの相対。
+    lead: 先頭のフレームを複製して埋める秒数（映像が音声より遅れて始まる素材の最初の区間）
+    """
+    trim = f"trim=start_pts={start}" + (f":end_pts={end}" if end is not None else "")
+    filters = [trim, 'setpts=PTS-STARTPTS']
+    if lead > 0:
+        filters.append(f"tpad=start_duration={lead:.6f}:start_mode=clone")
+    filters += [vf] if vf else []
+    # 境界はキーフレームなので、シークはその位置に止まる（フレームの選別は trim に任せる）
+    cmd = ['ffmpeg', '-copyts', '-noaccurate_seek', '-ss', f"{max(0, start - origin) * time_base:.6f}"]
+    if end is not None:
+        cmd.extend(['-to', f"{(end - origin) * time_base + READ_MARGIN_SECONDS:.6f}"])
+    cmd.extend([
+        '-i', video_path, '-an', '-sn', '-vf', ','.join(filters),
+        *x264_args(encoding), '-threads', str(threads), '-y', chunk_path,
+    ])
+    seconds = (end - start) * time_base if end is not None else None
+    supervisor.run(cmd, stage='encode', duration=seconds, check=True, capture_output=True)
+    return chunk_path
+
+
+def encode_chunked(video_path, output_path, vf=None, encoding=None, start_time=None, end_time=None, workers=None):
+    """映像を区間に分けて並列にエンコードし、音声は1本でエンコードして output_path に書き出す
+
+    区間が1つにしかならない場合は None を返します（呼び出し元で通常どおりエンコードする）。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = workers or encode_workers()
+    info = probe_video(video_path)
+    points, time_base, origin = keyframes(video_path, start_time, end_time)
+    # 開始・終了時間は音声（出力側の -ss・-t）と同じくファイルの先頭時刻からの相対
+    start_pts = origin + math.ceil(start_time / time_base) if start_time is not None else (points[0] if points else origin)
+    end_pts = origin + math.ceil(end_time / time_base) if end_time is not None else None
+    last_pts = origin + math.floor(info['duration'] / time_base)
+    boundaries = plan_chunks(points, time_base, start_pts, last_pts, end_pts, workers)
+    if len(boundaries) <= 2:
+        return None
+
+    chunks = list(zip(boundaries[:-1], boundaries[1:]))
+    # 1プロセスでのエンコードと同じく、ファイルの先頭（音声の開始）から映像の最初のフレームまでは複製で埋める
+    lead = (start_pts - origin) * time_base if start_time is None else 0.0
+    work_dir = tempfile.mkdtemp(prefix='chunked_')
+    # 各 ffmpeg のスレッド数は全体でコア数に収まるよう分ける
+    threads = max(1, (os.cpu_count() or 1) // min(workers, len(chunks)))
+    media_seconds = (end_time - start_time) if end_time is not None and start_time is not None else info['duration']
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks)) + 1) as executor:
+            futures = []
+            for i, (start, end) in enumerate(chunks):
+                chunk_path = os.path.join(work_dir, f"chunk_{i:04d}.mp4")
+                # スレッドにも取り消しのトークンを引き継ぐ
+                futures.append(executor.submit(contextvars.copy_context().run, _encode_chunk,
+                                               video_path, chunk_path, start, end, time_base, origin, vf, encoding,
+                                               threads, lead if i == 0 else 0.0))
+            audio_path = None
+            if info['has_audio']:
+                audio_path = os.path.join(work_dir, 'audio.m4a')
+                audio_cmd = ['ffmpeg', '-i', video_path]
+                if start_time is not None:
+                    audio_cmd.extend(['-ss', str(start_time)])
+                if end_time is not None:
+                    audio_cmd.extend(['-t', str(end_time - (start_time or 0))])
+                audio_cmd.extend(['-vn', '-sn', '-c:a', 'aac', '-y', audio_path])
+                futures.append(executor.submit(contextvars.copy_context().run, supervisor.run, audio_cmd,
+                                               stage='audio', duration=media_seconds, check=True, capture_output=True))
+            try:
+                chunk_paths = [supervisor.wait_result(future) for future in futures[:len(chunks)]]
+                for future in futures[len(chunks):]:
+                    supervisor.wait_result(future)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        list_path = os.path.join(work_dir, 'concat.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for chunk_path in chunk_paths:
+                escaped = chunk_path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            cmd.extend(['-i', audio_path, '-map', '0:v', '-map', '1:a'])
+        cmd.extend(['-c', 'copy', *FASTSTART_ARGS, '-y', output_path])
+        supervisor.run(cmd, stage='copy', duration=media_seconds, check=True, capture_output=True)
+        metrics.record_encode('chunked', media_seconds, started)
+        return output_path
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"分割エンコードでエラーが発生しました: {e.stderr.decode(errors='replace')[-2000:]}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,459 @@
+"""コマンドラインインターフェース
+
+使用例:
+    python -m movie_converter batch jobs.json --concurrency 4
+    python -m movie_converter batch --input-dir ./videos --profile profile.yaml --output-dir ./out
+    python -m movie_converter serve --port 8000 --workers 2
+    python -m movie_converter serve --spool /mnt/spool        # ジョブは共有スプールのワーカーが処理
+    python -m movie_converter worker --spool /mnt/spool --concurrency 2
+    python -m movie_converter voicevox-stub --port 50021 --latency 0.2
+    python -m movie_converter compare baseline.mp4 candidate.mp4
+    python -m movie_converter bgm add ./bgm/*.mp3
+    python -m movie_converter importtime
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .jobs import TOOLS
+from .supervisor import PRIORITIES, set_process_priority
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+PPTX_EXTENSIONS = ('.pptx', '.ppt')
+
+# ジョブ仕様内でファイルパスとして扱うキー（マニフェストからの相対パスを解決する）
+PATH_KEYS = ('input', 'output', 'bgm_path', 'preview_dir')
+
+
+def load_manifest(path):
+    """JSON/YAMLのマニフェストまたはプロファイルを読み込む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise Exception("YAMLマニフェストの読み込みには PyYAML が必要です (pip install pyyaml)")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def _resolve_paths(spec, base_dir):
+    """ジョブ仕様内の相対パスを base_dir 基準の絶対パスに変換"""
+    spec = dict(spec)
+    for key in PATH_KEYS:
+        if spec.get(key):
+            spec[key] = os.path.join(base_dir, spec[key])
+    if spec.get('inputs'):
+        spec['inputs'] = [os.path.join(base_dir, p) for p in spec['inputs']]
+    return spec
+
+
+def _default_output_name(spec):
+    name = os.path.splitext(os.path.basename(spec.get('input') or 'combined'))[0]
+    prefix = {"shorts": "shorts", "combine": "combined", "pptx": "presentation"}[spec.get('tool', 'shorts')]
+    return f"{prefix}_{name}.mp4"
+
+
+def jobs_from_manifest(manifest, base_dir, output_dir=None):
+    """マニフェスト（{"defaults": {...}, "jobs": [...]}）からジョブ一覧を作成"""
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs', [])):
+        spec = _resolve_paths(dict(defaults, **job), base_dir)
+        if not spec.get('output'):
+            spec['output'] = os.path.join(output_dir or base_dir, _default_output_name(spec))
+        spec.setdefault('id', f"job-{i+1:04d}")
+        jobs.append(spec)
+    return jobs
+
+
+def jobs_from_directory(input_dir, profile, output_dir):
+    """ディレクトリ内の動画・PowerPointファイルから共通プロファイルのジョブを作成"""
+    jobs = []
+    for name in sorted(os.listdir(input_dir)):
+        ext = os.path.splitext(name)[1].lower()
+        if ext in VIDEO_EXTENSIONS:
+            tool = "shorts"
+        elif ext in PPTX_EXTENSIONS:
+            tool = "pptx"
+        else:
+            continue
+        spec = dict(profile, tool=tool, input=os.path.join(input_dir, name))
+        spec['output'] = os.path.join(output_dir, _default_output_name(spec))
+        spec['id'] = name
+        jobs.append(spec)
+    return jobs
+
+
+def _partial_path(output_path):
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.partial{ext or '.mp4'}"
+
+
+def execute_job(spec):
+    """1件のジョブを実行して結果サマリーを返す（プロセスプールのワーカーから呼ばれる）"""
+    from .cover import cover_path, normalize_cover_count
+    from .jobs import run_job
+    from .shorts import normalize_renditions, rendition_path
+
+    warnings = []
+    started = time.time()
+    output_path = spec['output']
+    # 中断時に不完全なファイルを完了扱いしないよう、一時名で書き出してからリネーム
+    partial_path = _partial_path(output_path)
+    result = {'id': spec.get('id'), 'tool': spec.get('tool', 'shorts'), 'output': output_path}
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        run_job(dict(spec, output=partial_path), on_warning=warnings.append)
+        os.replace(partial_path, output_path)
+        if result['tool'] == "shorts" and spec.get('renditions'):
+            result['renditions'] = {}
+            for rendition in normalize_renditions(spec['renditions']):
+                rendition_output = rendition_path(output_path, rendition['name'])
+                os.replace(rendition_path(partial_path, rendition['name']), rendition_output)
+                result['renditions'][rendition['name']] = rendition_output
+        if result['tool'] == "shorts" and spec.get('covers'):
+            result['covers'] = []
+            for index in range(1, normalize_cover_count(spec['covers']) + 1):
+                # 短い動画では候補が指定数より少ないことがある
+                if os.path.exists(cover_path(partial_path, index)):
+                    os.replace(cover_path(partial_path, index), cover_path(output_path, index))
+                    result['covers'].append(cover_path(output_path, index))
+        result['status'] = "done"
+    except Exception as e:
+        try:
+            os.unlink(partial_path)
+        except OSError:
+            pass
+        result['status'] = "failed"
+        result['error'] = str(e)
+    result['warnings'] = warnings
+    result['elapsed'] = round(time.time() - started, 3)
+    return result
+
+
+def run_batch(jobs, concurrency=1, overwrite=False, on_result=None, priority='batch'):
+    """ジョブ一覧をプロセスプールで実行し、ジョブごとの結果リストを返す
+
+    overwrite=False の場合、出力ファイルが既に存在するジョブはスキップします（再開用）。
+    priority: ワーカープロセスの優先度（supervisor.PRIORITIES の nice・ionice）
+    """
+    results = {}
+    pending = []
+    for spec in jobs:
+        if not overwrite and os.path.exists(spec['output']):
+            results[spec['id']] = {
+                'id': spec['id'], 'tool': spec.get('tool', 'shorts'), 'output': spec['output'],
+                'status': "skipped", 'warnings': [], 'elapsed': 0.0,
+            }
+            if on_result is not None:
+                on_result(results[spec['id']])
+        else:
+            pending.append(spec)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, concurrency),
+                                 initializer=set_process_priority, initargs=(priority,)) as executor:
+            futures = {executor.submit(execute_job, spec): spec for spec in pending}
+            for future in as_completed(futures):
+                spec = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が異常終了した場合
+                    result = {
+                        'id': spec['id'], 'tool': spec.get('tool', 'shorts'), 'output': spec['output'],
+                        'status': "failed", 'error': str(e), 'warnings': [], 'elapsed': 0.0,
+                    }
+                results[spec['id']] = result
+                if on_result is not None:
+                    on_result(result)
+
+    # 入力順に並べて返す
+    return [results[spec['id']] for spec in jobs]
+
+
+def _print_result(result):
+    icon = {"done": "✅", "skipped": "⏭️", "failed": "❌"}[result['status']]
+    line = f"{icon} [{result['id']}] {result['status']} ({result['elapsed']:.1f}秒) {result['output']}"
+    if result.get('error'):
+        line += f"\n    エラー: {result['error']}"
+    for warning in result.get('warnings', []):
+        line += f"\n    {warning}"
+    print(line, flush=True)
+
+
+def cmd_batch(args):
+    if args.manifest:
+        manifest = load_manifest(args.manifest)
+        base_dir = os.path.dirname(os.path.abspath(args.manifest))
+        jobs = jobs_from_manifest(manifest, base_dir, args.output_dir)
+    else:
+        if not args.input_dir or not args.output_dir:
+            print("❌ マニフェストを指定しない場合は --input-dir と --output-dir が必要です", file=sys.stderr)
+            return 2
+        profile = load_manifest(args.profile) if args.profile else {}
+        jobs = jobs_from_directory(args.input_dir, profile, args.output_dir)
+
+    ids = [spec['id'] for spec in jobs]
+    if len(set(ids)) != len(ids):
+        print("❌ ジョブIDが重複しています", file=sys.stderr)
+        return 2
+    for spec in jobs:
+        if spec.get('tool', 'shorts') not in TOOLS:
+            print(f"❌ [{spec['id']}] 不明なツールです: {spec.get('tool')}", file=sys.stderr)
+            return 2
+
+    print(f"🚀 {len(jobs)}件のジョブを開始します（並列数: {args.concurrency}）", flush=True)
+    started = time.time()
+    results = run_batch(jobs, args.concurrency, args.overwrite, on_result=_print_result, priority=args.priority)
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ("done", "skipped", "failed")}
+    summary = {
+        'total': len(results),
+        'counts': counts,
+        'elapsed': round(time.time() - started, 3),
+        'jobs': results,
+    }
+    summary_path = args.summary or os.path.join(args.output_dir or os.path.dirname(os.path.abspath(args.manifest)), "batch_summary.json")
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"📊 完了 {counts['done']} / スキップ {counts['skipped']} / 失敗 {counts['failed']}（サマリー: {summary_path}）")
+    return 1 if counts['failed'] else 0
+
+
+def cmd_serve(args):
+    from .server import make_server
+
+    server = make_server(args.host, args.port, args.data_dir, args.workers, args.max_queue, args.priority, args.spool)
+    if args.spool:
+        workers = f"共有スプール: {server.manager.spool_dir}"
+    else:
+        workers = f"ワーカー数: {args.workers}、データ: {server.manager.data_dir}"
+    print(f"🌐 ジョブAPIを起動しました: http://{args.host}:{args.port}（{workers}）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.manager.shutdown()
+    return 0
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _worker_process(spool_dir, exit_when_idle, priority):
+    """スプールのワーカープロセス（SIGTERM・Ctrl+C では処理中の ffmpeg を止め、ジョブを待機列に戻して終了）"""
+    from .spool import run_worker
+
+    signal.signal(signal.SIGTERM, _raise_exit)
+    set_process_priority(priority)
+    try:
+        run_worker(spool_dir, exit_when_idle=exit_when_idle)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+def cmd_worker(args):
+    import multiprocessing
+
+    if not args.spool:
+        print("❌ --spool または MOVIE_CONVERTER_SPOOL_DIR で共有スプールを指定してください", file=sys.stderr)
+        return 2
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(args.spool, args.exit_when_idle, args.priority))
+        for _ in range(max(1, args.concurrency))
+    ]
+    print(f"👷 ワーカーを起動しました（プロセス数: {len(processes)}、スプール: {os.path.abspath(args.spool)}）", flush=True)
+    signal.signal(signal.SIGTERM, _raise_exit)
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    return 0
+
+
+def cmd_voicevox_stub(args):
+    from .voicevox_stub import VoicevoxStub
+
+    stub = VoicevoxStub(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.seed)
+    print(f"🎤 VOICEVOXスタブを起動しました: {stub.url}（遅延 {args.latency}±{args.jitter}秒、失敗率 {args.failure_rate}）", flush=True)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+    return 0
+
+
+def cmd_compare(args):
+    from .verify import DEFAULT_TOLERANCES, compare_outputs, format_report, pair_files
+
+    tolerances = {key: getattr(args, key) for key in DEFAULT_TOLERANCES if getattr(args, key) is not None}
+    if os.path.isdir(args.reference):
+        if not os.path.isdir(args.candidate):
+            print("❌ 基準がディレクトリの場合は比較対象もディレクトリを指定してください", file=sys.stderr)
+            return 2
+        pairs = pair_files(args.reference, args.candidate)
+    else:
+        pairs = [(args.reference, args.candidate)]
+
+    reports = {}
+    failed = 0
+    for reference, candidate in pairs:
+        name = os.path.basename(reference)
+        if candidate is None:
+            reports[name] = {'passed': False, 'failures': ["比較対象のファイルがありません"]}
+        else:
+            try:
+                reports[name] = compare_outputs(reference, candidate, tolerances, args.sample_fps, args.width)
+            except Exception as e:
+                reports[name] = {'passed': False, 'failures': [str(e)]}
+        failed += not reports[name]['passed']
+        if not args.json:
+            if 'video' in reports[name]:
+                print(f"{name}: {format_report(reports[name])}", flush=True)
+            else:
+                print(f"{name}: ❌ " + " / ".join(reports[name]['failures']), flush=True)
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    elif len(pairs) > 1:
+        print(f"📊 一致 {len(pairs) - failed} / 不一致 {failed}")
+    return 1 if failed else 0
+
+
+def cmd_bgm(args):
+    from . import bgm
+
+    if args.action == "add":
+        if not args.files:
+            print("❌ 追加する音声ファイルを指定してください", file=sys.stderr)
+            return 2
+        failed = 0
+        for path in args.files:
+            try:
+                track = bgm.add_track(path, args.name if len(args.files) == 1 else None)
+            except Exception as e:
+                print(f"❌ {path}: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            print(f"✅ {track['id']}  {track['name']}（{track['duration']:.1f}秒、{track['loudness']} LUFS、"
+                  f"ゲイン {track['gain']:+.1f} dB）", flush=True)
+        return 1 if failed else 0
+    if args.action == "remove":
+        missing = [track_id for track_id in args.files if not bgm.remove_track(track_id)]
+        for track_id in missing:
+            print(f"❌ 見つかりません: {track_id}", file=sys.stderr)
+        return 1 if missing else 0
+
+    tracks = bgm.list_tracks()
+    if args.json:
+        print(json.dumps(tracks, ensure_ascii=False, indent=2))
+    else:
+        for track in tracks:
+            print(f"{track['id']}  {track['duration']:7.1f}秒  {track['loudness']} LUFS  "
+                  f"ゲイン {track['gain']:+5.1f} dB  {track['name']}")
+    return 0
+
+
+def cmd_importtime(args):
+    from .importtime import format_report, report
+
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = report(repeat=args.repeat, cwd=project_dir)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(results))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m movie_converter", description="動画編集ツール（ヘッドレス実行）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser("batch", help="マニフェストまたはディレクトリのジョブを一括実行")
+    batch.add_argument("manifest", nargs="?", help="ジョブマニフェスト（JSON/YAML）")
+    batch.add_argument("--input-dir", help="入力ディレクトリ（マニフェストを使わない場合）")
+    batch.add_argument("--profile", help="ディレクトリ入力時に全ジョブへ適用する設定（JSON/YAML）")
+    batch.add_argument("--output-dir", help="出力ディレクトリ（マニフェストで output 未指定のジョブにも使用）")
+    batch.add_argument("--concurrency", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="同時実行ジョブ数")
+    batch.add_argument("--overwrite", action="store_true", help="既存の出力があっても再生成する（指定しない場合はスキップして再開）")
+    batch.add_argument("--summary", help="ジョブ結果サマリーの出力先（JSON）")
+    batch.add_argument("--priority", choices=list(PRIORITIES), default="batch",
+                       help="ffmpeg などの優先度（batch: nice・ionice を下げてUIの処理を優先）")
+    batch.set_defaults(func=cmd_batch)
+
+    serve = subparsers.add_parser("serve", help="ジョブ投入用のHTTP APIを起動")
+    serve.add_argument("--host", default=os.getenv('API_HOST', "127.0.0.1"), help="待ち受けアドレス")
+    serve.add_argument("--port", type=int, default=int(os.getenv('API_PORT', "8000")), help="待ち受けポート")
+    serve.add_argument("--workers", type=int, default=int(os.getenv('API_WORKERS', "2")), help="同時実行ジョブ数（プロセス数）")
+    serve.add_argument("--max-queue", type=int, default=100, help="受け付ける未完了ジョブの上限（超過時は503）")
+    serve.add_argument("--data-dir", default=os.getenv('API_DATA_DIR', "tmp/api_jobs"), help="アップロード・出力の保存先")
+    serve.add_argument("--priority", choices=list(PRIORITIES), default="batch", help="ジョブを実行するワーカープロセスの優先度")
+    serve.add_argument("--spool", default=os.getenv('MOVIE_CONVERTER_SPOOL_DIR'),
+                       help="共有スプールに投入する（このプロセスでは実行せず、worker が処理）")
+    serve.set_defaults(func=cmd_serve)
+
+    worker = subparsers.add_parser("worker", help="共有スプールのジョブを処理するワーカーを起動")
+    worker.add_argument("--spool", default=os.getenv('MOVIE_CONVERTER_SPOOL_DIR'), help="共有スプールのディレクトリ")
+    worker.add_argument("--concurrency", type=int, default=int(os.getenv('API_WORKERS', "2")), help="同時実行ジョブ数（プロセス数）")
+    worker.add_argument("--priority", choices=list(PRIORITIES), default="batch", help="ワーカープロセスの優先度")
+    worker.add_argument("--exit-when-idle", action="store_true", help="待機中・処理中のジョブがなくなったら終了する")
+    worker.set_defaults(func=cmd_worker)
+
+    stub = subparsers.add_parser("voicevox-stub", help="VOICEVOXの代わりに応答するスタブサーバーを起動（テスト・負荷試験用）")
+    stub.add_argument("--host", default="127.0.0.1", help="待ち受けアドレス")
+    stub.add_argument("--port", type=int, default=50021, help="待ち受けポート")
+    stub.add_argument("--latency", type=float, default=0.0, help="応答までの遅延（秒）")
+    stub.add_argument("--jitter", type=float, default=0.0, help="遅延のばらつき（±秒）")
+    stub.add_argument("--failure-rate", type=float, default=0.0, help="HTTP 503 を返す割合（0〜1）")
+    stub.add_argument("--seed", type=int, default=0, help="遅延・失敗の乱数シード")
+    stub.set_defaults(func=cmd_voicevox_stub)
+
+    compare = subparsers.add_parser("compare", help="2つの出力動画（または同名ファイルを含むディレクトリ）が同等か確認")
+    compare.add_argument("reference", help="基準の動画またはディレクトリ")
+    compare.add_argument("candidate", help="比較する動画またはディレクトリ")
+    compare.add_argument("--sample-fps", type=float, default=2, help="比較するフレームの間隔（1秒あたりの枚数）")
+    compare.add_argument("--width", type=int, default=320, help="フレーム比較の解像度（幅）")
+    compare.add_argument("--psnr-min", dest="psnr_min", type=float, help="PSNRの下限（dB、既定: 35）")
+    compare.add_argument("--ssim-min", dest="ssim_min", type=float, help="SSIMの下限（既定: 0.97）")
+    compare.add_argument("--audio-offset-max", dest="audio_offset_max", type=float, help="音声のずれの上限（秒、既定: 0.02）")
+    compare.add_argument("--audio-correlation-min", dest="audio_correlation_min", type=float, help="音声の相関の下限（既定: 0.8）")
+    compare.add_argument("--duration-diff-max", dest="duration_diff_max", type=float, help="長さの差の上限（秒、既定: 0.1）")
+    compare.add_argument("--json", action="store_true", help="JSONで出力")
+    compare.set_defaults(func=cmd_compare)
+
+    library = subparsers.add_parser("bgm", help="BGMライブラリの管理（デコード済みPCMとラウドネスを保存）")
+    library.add_argument("action", choices=("list", "add", "remove"), help="list: 一覧 / add: 追加 / remove: 削除")
+    library.add_argument("files", nargs="*", help="add: 音声ファイル / remove: トラックID")
+    library.add_argument("--name", help="add: 曲名（ファイルを1つ指定した場合。既定: ファイル名）")
+    library.add_argument("--json", action="store_true", help="list: JSONで出力")
+    library.set_defaults(func=cmd_bgm)
+
+    importtime = subparsers.add_parser("importtime", help="ツールごとのimport時間を計測して表示")
+    importtime.add_argument("--repeat", type=int, default=3, help="計測回数（最短値を採用）")
+    importtime.add_argument("--json", action="store_true", help="JSONで出力")
+    importtime.set_defaults(func=cmd_importtime)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
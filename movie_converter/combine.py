@@ -0,0 +1,142 @@
+"""複数動画の結合処理"""
+import os
+import time
+
+from . import metrics, supervisor
+from .media import FASTSTART_ARGS
+from .preview import output_args
+from .ratecontrol import x264_args
+
+
+# xfade で使えるトランジションの例（名前 → 表示名）
+TRANSITIONS = {
+    'fade': "フェード",
+    'fadeblack': "黒を挟んでフェード",
+    'dissolve': "ディゾルブ",
+    'wipeleft': "ワイプ（左へ）",
+    'slideleft': "スライド（左へ）",
+    'circleopen': "円形に開く",
+}
+AUDIO_RATE = 48000
+MAX_FPS = 60
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def build_combine_filter(infos, width, height, fps, transition=None, transition_duration=0.5):
+    """各入力を共通のキャンバス・FPS・音声形式にそろえて連結する filter_complex を作成
+
+    infos: probe_video の結果のリスト（入力順）
+    transition: xfade のトランジション名（None の場合は単純に連結）
+    戻り値: (filter_complex, 出力の長さ)
+    """
+    filters = []
+    for i, info in enumerate(infos):
+        duration = info['duration']
+        # 映像: 縦横比を保って縮小 → 余白を黒で埋める → FPS・画素形式・時間軸をそろえる
+        filters.append(
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,setsar=1,fps={fps:.3f},format=yuv420p,"
+            f"trim=duration={duration:.3f},setpts=PTS-STARTPTS,settb=AVTB[v{i}]"
+        )
+        # 音声: ステレオ・同じサンプルレートにそろえ、映像と同じ長さにする（音声がなければ無音）
+        source = f"[{i}:a]" if info['has_audio'] else f"anullsrc=r={AUDIO_RATE}:cl=stereo,"
+        filters.append(
+            f"{source}aresample={AUDIO_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+            f"apad,atrim=duration={duration:.3f},asetpts=PTS-STARTPTS[a{i}]"
+        )
+
+    if not transition or len(infos) < 2:
+        inputs = ''.join(f"[v{i}][a{i}]" for i in range(len(infos)))
+        filters.append(f"{inputs}concat=n={len(infos)}:v=1:a=1[v][a]")
+        return ';'.join(filters), sum(info['duration'] for info in infos)
+
+    # トランジションは最も短いクリップの半分までにする
+    transition_duration = min(transition_duration, min(info['duration'] for info in infos) / 2)
+    video_label, audio_label = "[v0]", "[a0]"
+    elapsed = infos[0]['duration']
+    for i in range(1, len(infos)):
+        offset = elapsed - transition_duration
+        last = i == len(infos) - 1
+        next_video = "[v]" if last else f"[xv{i}]"
+        next_audio = "[a]" if last else f"[xa{i}]"
+        filters.append(
+            f"{video_label}[v{i}]xfade=transition={transition}:duration={transition_duration:.3f}:"
+            f"offset={offset:.3f}{next_video}"
+        )
+        filters.append(f"{audio_label}[a{i}]acrossfade=d={transition_duration:.3f}{next_audio}")
+        video_label, audio_label = next_video, next_audio
+        elapsed = offset + infos[i]['duration']
+    return ';'.join(filters), elapsed
+
+
+def combine_videos(video_paths, output_path, width=None, height=None, fps=None, transition=None, transition_duration=0.5,
+                   encoding=None):
+    """複数の動画を結合する（ffmpeg 1回のフィルターグラフで再エンコード）
+
+    解像度・FPS・音声形式が異なる動画も、共通のキャンバス（既定: 最大の幅・高さ）と
+    FPS（既定: 最大のFPS）にそろえて連結します。縦横比は保ち、余白は黒で埋めます。
+    transition を指定すると、クリップの間を xfade / acrossfade でつなぎます。
+    encoding: ratecontrol.plan_encoding のエンコード設定（None で ratecontrol.DEFAULT_ENCODING）
+    """
+    import subprocess
+
+    from .media import probe_video
+
+    for video_path in video_paths:
+        # ファイルの存在確認
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"ファイルが見つかりません: {video_path}")
+    if transition and transition not in TRANSITIONS:
+        raise ValueError(f"不明なトランジションです: {transition}（{', '.join(TRANSITIONS)} のいずれかを指定してください）")
+
+    infos = [probe_video(video_path) for video_path in video_paths]
+    width = _even(width or max(info['width'] for info in infos))
+    height = _even(height or max(info['height'] for info in infos))
+    fps = fps or min(MAX_FPS, max(info['fps'] for info in infos))
+    filter_complex, duration = build_combine_filter(infos, width, height, fps, transition, transition_duration)
+
+    cmd = ['ffmpeg']
+    for video_path in video_paths:
+        cmd.extend(['-i', video_path])
+    cmd.extend([
+        '-filter_complex', filter_complex,
+        '-map', '[v]', '-map', '[a]',
+        *x264_args(encoding),
+        '-c:a', 'aac', '-ar', str(AUDIO_RATE),
+        '-y', *output_args(output_path)
+    ])
+    started = time.monotonic()
+    try:
+        supervisor.run(cmd, stage='encode', duration=duration, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"動画の結合に失敗しました: {e.stderr.decode()}")
+    except FileNotFoundError:
+        raise Exception("FFmpegが見つかりません。システムにFFmpegがインストールされていることを確認してください。")
+    metrics.record_encode('combine', duration, started)
+    return output_path
+
+
+def concat_videos_copy(video_paths, output_path):
+    """同じ形式でエンコードされた動画を再エンコードせずに連結する（concat demuxer）"""
+    import subprocess
+    import tempfile
+
+    fd, list_path = tempfile.mkstemp(suffix='_concat.txt')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for video_path in video_paths:
+                escaped = os.path.abspath(video_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = [
+            'ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-c', 'copy', *FASTSTART_ARGS, '-y', output_path
+        ]
+        supervisor.run(cmd, stage='copy', check=True, capture_output=True)
+        return output_path
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"動画の連結に失敗しました: {e.stderr.decode()}")
+    finally:
+        os.unlink(list_path)
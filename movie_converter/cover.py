@@ -0,0 +1,214 @@
+"""カバー画像（サムネイル）候補の自動選択
+
+1. 間引き・縮小したフレームを1回のデコードで読み出し、数フレームずつまとめて
+   NumPy/OpenCV で採点する（鮮明さ・露出・顔・場面転換の途中でないこと）
+2. フレームごとの指標（数値）だけを残し、時刻が近すぎる候補を除いて上位を選ぶ
+3. 選んだ時刻のフレームを入力シークで元の解像度のまま書き出す
+
+フレーム自体は採点中のまとまり（BATCH_FRAMES 枚）しか保持しないため、数時間の動画でもメモリは一定です。
+指標は入力ファイルの内容ハッシュと解析条件ごとにキャッシュし、同じ動画では再解析しません。
+"""
+import os
+import subprocess
+
+from . import supervisor
+from .cache import file_digest, load_json, params_digest, save_json
+
+ANALYSIS_WIDTH = 320      # 解析用に縮小する幅（ピクセル）
+SAMPLE_INTERVAL = 0.5     # 解析するフレームの間隔（秒）
+MAX_SAMPLES = 3600        # 長い動画はこの枚数に収まるよう間隔を広げる
+BATCH_FRAMES = 16         # まとめて採点するフレーム数
+TOP_K = 3                 # 既定の候補数
+MAX_COVERS = 10           # 候補数の上限
+ANALYSIS_VERSION = 1      # 解析方法を変えたらキャッシュを無効にするために上げる
+
+# 点数の重み（合計 1）。場面転換の途中のフレームは重み付きの合計を下げる
+SHARPNESS_WEIGHT = 0.4
+EXPOSURE_WEIGHT = 0.3
+FACE_WEIGHT = 0.3
+
+TARGET_BRIGHTNESS = 0.45  # 露出の目標（平均輝度 0〜1）
+CLIP_LEVELS = (16, 239)   # これ以下・以上の画素を黒つぶれ・白飛びとみなす
+FACE_AREA = 0.03          # 顔がフレームのこの割合以上あれば満点
+STABLE_DIFF = 0.04        # 前後のフレームとの差（平均輝度差 0〜1）がこれ以下なら減点しない
+TRANSITION_DIFF = 0.12    # 前後どちらのフレームともこの差があれば転換の途中とみなし、点数を 0 にする
+
+
+def normalize_cover_count(covers):
+    """候補数を検証して整数で返す（0 = 作成しない）"""
+    if covers in (None, False):
+        return 0
+    if isinstance(covers, bool) or not isinstance(covers, int) or not 0 <= covers <= MAX_COVERS:
+        raise ValueError(f"カバー画像の候補数は 0〜{MAX_COVERS} の整数で指定してください: {covers!r}")
+    return covers
+
+
+def cover_path(output_path, index):
+    """index 番目（1始まり）のカバー画像の出力先（例: out.mp4 → out_cover1.jpg）"""
+    base, _ = os.path.splitext(output_path)
+    return f"{base}_cover{index}.jpg"
+
+
+def frame_metrics(frames, previous=None):
+    """(N, H, W) の輝度フレームをまとめて採点する
+
+    戻り値: {'sharpness': ラプラシアンの分散, 'exposure': 露出の点数（0〜1）,
+             'change': 1つ前のフレームとの平均輝度差（0〜1、previous がない先頭は NaN）}
+    """
+    import numpy as np
+
+    x = frames.astype(np.float32)
+    count = len(x)
+    # 4近傍ラプラシアンをずらした配列の和で全フレーム同時に計算する
+    laplacian = (x[:, :-2, 1:-1] + x[:, 2:, 1:-1] + x[:, 1:-1, :-2] + x[:, 1:-1, 2:]
+                 - 4 * x[:, 1:-1, 1:-1])
+    sharpness = laplacian.reshape(count, -1).var(axis=1)
+
+    brightness = x.reshape(count, -1).mean(axis=1) / 255
+    clipped = ((frames <= CLIP_LEVELS[0]) | (frames >= CLIP_LEVELS[1])).reshape(count, -1).mean(axis=1)
+    exposure = np.clip(1 - np.abs(brightness - TARGET_BRIGHTNESS) / TARGET_BRIGHTNESS, 0, 1) * (1 - clipped)
+
+    if previous is not None:
+        x = np.concatenate([previous[np.newaxis].astype(np.float32), x])
+    change = np.abs(np.diff(x, axis=0)).reshape(len(x) - 1, -1).mean(axis=1) / 255
+    if previous is None:
+        change = np.concatenate([[np.nan], change])
+    return {'sharpness': sharpness, 'exposure': exposure, 'change': change}
+
+
+def analyse_frames(video_path, start_time=None, end_time=None, sample_interval=None, analysis_width=ANALYSIS_WIDTH):
+    """一定間隔のフレームの指標を1回のデコードで求める
+
+    戻り値: {'times': [...], 'sharpness': [...], 'exposure': [...], 'face': [...], 'change': [...]}
+    times は元動画の時刻（秒）、face は最も大きい顔の面積の割合から求めた点数（0〜1）。
+    """
+    import cv2
+    import numpy as np
+
+    from .media import iter_frames, probe_video
+
+    info = probe_video(video_path)
+    start = start_time or 0.0
+    end = end_time if end_time is not None else info['duration']
+    if end <= start:
+        raise Exception("カバー画像の解析範囲が不正です（終了時間が開始時間以前です）")
+    interval = sample_interval or max(SAMPLE_INTERVAL, (end - start) / MAX_SAMPLES)
+    analysis_height = max(2, int(round(analysis_width * info['height'] / info['width'] / 2)) * 2)
+    cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    min_face = max(12, analysis_height // 12)
+    frame_area = analysis_width * analysis_height
+
+    result = {'times': [], 'sharpness': [], 'exposure': [], 'face': [], 'change': []}
+    batch = []
+    previous = None
+
+    def flush():
+        nonlocal previous
+        metrics = frame_metrics(np.stack(batch), previous)
+        for name, values in metrics.items():
+            result[name].extend(round(float(v), 4) for v in values)
+        previous = batch[-1]
+        batch.clear()
+
+    frames = iter_frames(video_path, analysis_width, analysis_height, 1 / interval, start_time, end - start)
+    for i, frame in enumerate(frames):
+        result['times'].append(round(start + i * interval, 3))
+        # 顔検出だけはフレームごと（カスケード分類器はまとめて処理できない）
+        faces = cascade.detectMultiScale(frame, scaleFactor=1.2, minNeighbors=5, minSize=(min_face, min_face))
+        largest = max((w * h for (_, _, w, h) in faces), default=0)
+        result['face'].append(round(min(1.0, largest / frame_area / FACE_AREA), 4))
+        batch.append(frame)
+        if len(batch) == BATCH_FRAMES:
+            flush()
+    if batch:
+        flush()
+    # JSON に NaN を書かないよう、先頭の差分は None にする
+    result['change'] = [None if v != v else v for v in result['change']]
+    result['interval'] = interval
+    return result
+
+
+def get_frame_metrics(video_path, start_time=None, end_time=None, sample_interval=None):
+    """フレームの指標を取得（入力内容と解析条件が同じならキャッシュを使用）"""
+    key = params_digest({
+        'video': file_digest(video_path),
+        'start_time': start_time,
+        'end_time': end_time,
+        'sample_interval': sample_interval,
+        'analysis_width': ANALYSIS_WIDTH,
+        'version': ANALYSIS_VERSION,
+    })
+    metrics = load_json('cover', key)
+    if metrics is None:
+        metrics = analyse_frames(video_path, start_time, end_time, sample_interval)
+        save_json('cover', key, metrics)
+    return metrics
+
+
+def score_frames(metrics):
+    """指標からフレームごとの点数（0〜1）を NumPy 配列で返す"""
+    import numpy as np
+
+    if not metrics['times']:
+        return np.zeros(0)
+    # 鮮明さは動画ごとに大きく異なるため、その動画の上位（95パーセンタイル）を満点とする
+    sharpness = np.log1p(np.asarray(metrics['sharpness'], dtype=float))
+    reference = np.percentile(sharpness, 95)
+    sharpness = np.clip(sharpness / reference, 0, 1) if reference > 0 else np.zeros_like(sharpness)
+
+    # 前後どちらのフレームとも大きく違う = ディゾルブ・フェード・速い動きの途中（先頭・末尾は片側しかないので減点しない）
+    change = np.asarray([0.0 if v is None else v for v in metrics['change']], dtype=float)
+    following = np.append(change[1:], 0.0)
+    transition = np.minimum(change, following)
+    stability = 1 - np.clip((transition - STABLE_DIFF) / (TRANSITION_DIFF - STABLE_DIFF), 0, 1)
+
+    return stability * (SHARPNESS_WEIGHT * sharpness
+                        + EXPOSURE_WEIGHT * np.asarray(metrics['exposure'], dtype=float)
+                        + FACE_WEIGHT * np.asarray(metrics['face'], dtype=float))
+
+
+def pick_covers(times, scores, count=TOP_K, min_gap=0.0):
+    """点数の高い順に、互いに min_gap 秒以上離れたフレームを count 件まで選ぶ（インデックスのリスト）"""
+    import numpy as np
+
+    picked = []
+    for index in np.argsort(-np.asarray(scores), kind='stable'):
+        if len(picked) >= count:
+            break
+        if all(abs(times[index] - times[other]) >= min_gap for other in picked):
+            picked.append(int(index))
+    return picked
+
+
+def _extract_still(video_path, time, output_path):
+    """指定時刻のフレームを元の解像度でJPEGに書き出す（入力シークでその位置からデコードする）"""
+    cmd = ['ffmpeg', '-v', 'error', '-ss', f"{max(0.0, time):.3f}", '-i', video_path,
+           '-an', '-sn', '-frames:v', '1', '-q:v', '2', '-y', output_path]
+    try:
+        supervisor.run(cmd, stage='probe', check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"カバー画像の書き出しに失敗しました: {e.stderr.decode(errors='replace')}")
+    return output_path
+
+
+def select_covers(video_path, count=TOP_K, output_path=None, start_time=None, end_time=None, sample_interval=None):
+    """カバー画像の候補を選び、cover_path(output_path, 順位) に元の解像度で書き出す
+
+    output_path を省略した場合は video_path の隣に書き出します。
+    短い動画で離れた候補が足りない場合は count 件より少なくなります。
+    戻り値: [{'time': 時刻（秒）, 'score': 点数, 'path': 画像パス}, ...]（点数の高い順）
+    """
+    count = normalize_cover_count(count)
+    if not count:
+        return []
+    metrics = get_frame_metrics(video_path, start_time, end_time, sample_interval)
+    times = metrics['times']
+    scores = score_frames(metrics)
+    # 似た場面ばかりにならないよう、範囲を候補数の4倍に分けた長さ以上離す
+    span = times[-1] - times[0] if times else 0.0
+    min_gap = max(metrics['interval'], span / (count * 4))
+    covers = []
+    for rank, index in enumerate(pick_covers(times, scores, count, min_gap), start=1):
+        path = _extract_still(video_path, times[index], cover_path(output_path or video_path, rank))
+        covers.append({'time': times[index], 'score': round(float(scores[index]), 4), 'path': path})
+    return covers
@@ -0,0 +1,87 @@
+"""トリミング用のサムネイル一覧（フィルムストリップ）
+
+ffmpeg 1回のデコードで等間隔のフレームを選び、横一列に並べた1枚の画像にします。
+画像は入力ファイルの内容ハッシュと設定ごとにキャッシュし、同じ動画では再生成しません。
+"""
+import os
+import subprocess
+
+from . import supervisor
+from .cache import file_digest, get_cache_dir, load_json, params_digest, save_json
+from .media import probe_video
+
+THUMB_WIDTH = 192   # サムネイル1枚の幅（ピクセル）
+PADDING = 2         # サムネイル間の余白（ピクセル）
+
+
+def create_filmstrip(video_path, count=10, thumb_width=THUMB_WIDTH, start_time=None, end_time=None, keyframes=False):
+    """フィルムストリップ画像を作成（キャッシュがあればそれを返す）
+
+    keyframes=True の場合はキーフレームだけをデコードします（長い動画で高速。位置はキーフレーム単位）。
+    戻り値: {'image_path': 画像パス, 'times': [各サムネイルの時刻（秒）], 'thumb_width': 幅, 'thumb_height': 高さ}
+    """
+    info = probe_video(video_path)
+    start = start_time or 0.0
+    end = end_time if end_time is not None else info['duration']
+    if end <= start:
+        raise Exception("フィルムストリップの範囲が不正です（終了時間が開始時間以前です）")
+
+    count = max(1, int(count))
+    thumb_height = max(2, int(round(thumb_width * info['height'] / info['width'] / 2)) * 2)
+    key = params_digest({
+        'video': file_digest(video_path),
+        'count': count,
+        'thumb_width': thumb_width,
+        'start': start,
+        'end': end,
+        'keyframes': keyframes,
+    })
+    cache_dir = get_cache_dir('filmstrip')
+    image_path = os.path.join(cache_dir, f"{key}.jpg")
+    meta = load_json('filmstrip', key)
+    if meta is not None and os.path.exists(image_path):
+        return dict(meta, image_path=image_path)
+
+    interval = (end - start) / count
+    cmd = ['ffmpeg', '-v', 'error']
+    if keyframes:
+        cmd.extend(['-skip_frame', 'nokey'])
+    if start:
+        cmd.extend(['-ss', str(start)])  # 入力シーク（範囲の先頭までデコードしない）
+    cmd.extend(['-i', video_path, '-t', str(end - start), '-an', '-sn'])
+    # 各区間の先頭以降で最初のフレームを select で1枚ずつ選び、縮小して横一列に並べる
+    vf = (
+        f"select='gte(t\\,selected_n*{interval:.6f})',"
+        f"scale={thumb_width}:{thumb_height},"
+        f"tile={count}x1:padding={PADDING}:color=black"
+    )
+    tmp_path = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp.jpg")
+    cmd.extend(['-vf', vf, '-frames:v', '1', '-q:v', '3', '-y', tmp_path])
+    try:
+        supervisor.run(cmd, stage='analyse', duration=end - start, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"フィルムストリップの作成に失敗しました: {e.stderr.decode()}")
+    except FileNotFoundError:
+        raise Exception("FFmpegが見つかりません。システムにFFmpegがインストールされていることを確認してください。")
+    os.replace(tmp_path, image_path)
+
+    meta = {
+        'times': [round(start + i * interval, 3) for i in range(count)],
+        'thumb_width': thumb_width,
+        'thumb_height': thumb_height,
+    }
+    save_json('filmstrip', key, meta)
+    return dict(meta, image_path=image_path)
+
+
+def extract_frame(video_path, time, width=THUMB_WIDTH * 2):
+    """指定時刻の1フレームをJPEGのバイト列で取得（入力シークで高速に取り出す）"""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-ss', str(max(0.0, time)), '-i', video_path,
+        '-frames:v', '1', '-vf', f'scale={width}:-2', '-f', 'image2', '-c:v', 'mjpeg', '-q:v', '3', '-'
+    ]
+    try:
+        result = supervisor.run(cmd, stage='probe', check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"フレームの取得に失敗しました: {e.stderr.decode()}")
+    return result.stdout
@@ -0,0 +1,89 @@
+"""import時間の計測
+
+ツールごとに実際に読み込まれるモジュールを新しいPythonプロセスでimportし、
+所要時間と重いパッケージの内訳（python -X importtime）を報告します。
+
+    python -m movie_converter importtime
+"""
+import json
+import subprocess
+import sys
+
+# 計測対象: 名前 → そのツールの処理で読み込まれるモジュール
+PROFILES = {
+    'library': ['movie_converter', 'movie_converter.jobs', 'movie_converter.cli'],
+    'shorts': ['movie_converter.jobs', 'moviepy', 'numpy', 'PIL.ImageFont', 'requests'],
+    'combine': ['movie_converter.jobs', 'moviepy'],
+    'pptx': ['movie_converter.jobs', 'pptx', 'moviepy', 'PIL.ImageFont', 'requests'],
+    # 分割前の app.py が起動時に一括importしていたもの（比較用）
+    'eager (旧app.py)': ['streamlit', 'moviepy', 'PIL.ImageFont', 'numpy', 'cv2', 'pptx'],
+}
+
+_CHILD_CODE = """
+import importlib, json, sys, time
+preloaded = sorted({name.split('.')[0] for name in sys.modules})
+started = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+print(json.dumps({'seconds': time.perf_counter() - started, 'preloaded': preloaded}))
+"""
+
+
+def _parse_importtime(stderr, preloaded=(), top=5):
+    """-X importtime の出力からトップレベルパッケージの累積時間（秒）を集計
+
+    インタプリタ起動時に読み込み済みのパッケージ（preloaded）は除外します。
+    """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  ') or not cumulative.strip().isdigit():
+            # ネストしたimportは親パッケージの累積時間に含まれる
+            continue
+        package = name.strip().split('.')[0]
+        if package in preloaded:
+            continue
+        totals[package] = totals.get(package, 0) + int(cumulative) / 1e6
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(modules, repeat=3, cwd=None):
+    """新しいプロセスで modules をimportし、最短所要時間と内訳を返す"""
+    best = None
+    breakdown = []
+    for _ in range(max(1, repeat)):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', _CHILD_CODE, *modules],
+            capture_output=True, text=True, cwd=cwd,
+        )
+        if result.returncode != 0:
+            raise Exception(f"importに失敗しました ({', '.join(modules)}): {result.stderr.strip().splitlines()[-1]}")
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or measured['seconds'] < best:
+            best = measured['seconds']
+            breakdown = _parse_importtime(result.stderr, set(measured['preloaded']))
+    return {'seconds': best, 'breakdown': breakdown}
+
+
+def report(profiles=None, repeat=3, cwd=None):
+    """各プロファイルのimport時間を計測して {名前: 結果} を返す"""
+    results = {}
+    for name, modules in (profiles or PROFILES).items():
+        try:
+            results[name] = measure(modules, repeat, cwd)
+        except Exception as e:
+            results[name] = {'error': str(e)}
+    return results
+
+
+def format_report(results):
+    lines = ["⏱️ import時間（新規プロセス、最短値）"]
+    for name, result in results.items():
+        if 'error' in result:
+            lines.append(f"  {name:<16} 計測失敗: {result['error']}")
+            continue
+        detail = ", ".join(f"{package} {seconds*1000:.0f}ms" for package, seconds in result['breakdown'])
+        lines.append(f"  {name:<16} {result['seconds']*1000:8.1f} ms  ({detail})")
+    return "\n".join(lines)
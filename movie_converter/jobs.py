@@ -0,0 +1,485 @@
+"""ツールごとの処理チェーン（UI・CLI共通）
+
+Streamlit UI とバッチCLIが同じ手順で動画を生成できるよう、
+各ツールの処理順序をここにまとめています。
+進捗は progress(percent, message)、警告は on_warning(message) で通知します。
+"""
+import os
+import shutil
+import tempfile
+
+from . import metrics
+from .bgm import get_track
+from .cache import file_digest, params_digest
+from .combine import MAX_FPS, combine_videos, concat_videos_copy
+from .cover import normalize_cover_count, select_covers
+from .media import probe_video
+from .pipeline import run_pipeline
+from .preview import HlsPreview, live_hls, playlist_segments, write_hls
+from .presentation import (
+    SEGMENT_PROFILE,
+    create_silent_slide_video,
+    create_slide_video_with_narration,
+    create_text_slide_image,
+    extract_slides_and_notes,
+    get_slide_images,
+)
+from .ratecontrol import DEFAULT_QUALITY, bitrate_report, plan_encoding
+from .shorts import (
+    add_bgm_to_video,
+    add_multiple_voices_to_video,
+    add_text_to_video,
+    create_renditions,
+    normalize_renditions,
+    resize_video_to_shorts,
+    shorts_picture_size,
+)
+from .store import artifact_key, fetch, put, run_stages, store_budget
+from .subtitles import SUBTITLE_MODES, remove_voice_files, voice_subtitle_telops
+from .voicevox import generate_voice_with_voicevox
+
+TOOLS = ("shorts", "combine", "pptx")
+
+# パワポのナレーションに使う話者ID（雨晴はう）
+NARRATION_SPEAKER_ID = 10
+
+
+def _notify(callback, *args):
+    if callback is not None:
+        callback(*args)
+
+
+def _temp_path(suffix):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        return tmp.name
+
+
+def _encoding_params(encoding):
+    """成果物ストアのキーに含めるエンコード設定（予測値や解析結果は含めない）"""
+    return {name: encoding[name] for name in ('crf', 'preset', 'tune', 'maxrate', 'bufsize')}
+
+
+def _preview_last_stage(stages, preview_dir):
+    """最後の段階のエンコード中から、プレビュー用のHLSを書き出す（preview.live_hls）"""
+    run = stages[-1]['run']
+
+    def run_with_preview(src, dst, warn):
+        with live_hls(dst, preview_dir):
+            run(src, dst, warn)
+
+    stages[-1] = dict(stages[-1], run=run_with_preview)
+
+
+def _finish_preview(output_path, preview_dir):
+    """エンコード中にHLSを書き出せなかった場合（成果物ストアの結果・MoviePyでの書き出し）は完成した動画を分割"""
+    if not playlist_segments(preview_dir)[1]:
+        write_hls(output_path, preview_dir)
+
+
+def _finish_message(message, encoding, output_path):
+    """完了メッセージに予測と実際のビットレートを添える（メトリクスにも比を記録）"""
+    report = bitrate_report(encoding, output_path)
+    if report is None:
+        return message
+    if report['ratio'] is not None:
+        metrics.observe('bitrate_prediction_ratio', report['ratio'])
+    return (f"{message}（CRF {report['crf']}・{report['tune']}、"
+            f"予測 {report['predicted_kbps']} kbps / 実際 {report['actual_kbps']} kbps）")
+
+
+@metrics.track_job("shorts")
+def run_shorts_job(input_path, output_path, scale_factor=1.0, start_time=None, end_time=None,
+                   keep_original_size=False, telops=None, font_size=60, voices=None,
+                   bgm_path=None, bgm_volume=0.3, original_volume=0.7, loop_bgm=True, bgm_track=None,
+                   reframe=False, renditions=None, voice_subtitles=None, subtitle_position="bottom",
+                   preview_dir=None, quality=DEFAULT_QUALITY, covers=0, progress=None, on_warning=None):
+    """ショート動画変換（リサイズ→テロップ→音声→BGM）を実行
+
+    各段階の出力は成果物ストアに保存され、同じ入力・設定の段階は再計算しません。
+    voice_subtitles: "phrase" / "karaoke" を指定すると、音声の発話区間から字幕テロップを自動で追加する
+                     （subtitles.SUBTITLE_MODES。字幕のために合成した音声は音声の追加にそのまま使う）
+    renditions: 追加の出力サイズ（プリセット名または dict のリスト）。完成した動画を1回デコードし、
+                split で各エンコーダーに分けて rendition_path(output_path, 名前) に出力する
+    preview_dir: 指定した場合、プレビュー用のHLSを書き出す（最後のエンコード中から再生できる）
+    bgm_track: BGMライブラリのトラックID（bgm_path の代わり。保存済みのPCMと測定済みのラウドネスを使う）
+    quality: 画質の範囲（ratecontrol.QUALITY_PRESETS の名前）。入力の複雑さからCRF・最大ビットレート・tune を決める。
+             None の場合は解析せず固定の設定（ratecontrol.DEFAULT_ENCODING）を使う
+    covers: カバー画像の候補数。完成した動画から選び、cover_path(output_path, 順位) に元の解像度で書き出す
+    """
+    renditions = normalize_renditions(renditions)
+    covers = normalize_cover_count(covers)
+    track = get_track(bgm_track) if bgm_track else None
+    if quality is not None:
+        _notify(progress, 2, "動画の複雑さを解析中...")
+    info = probe_video(input_path)
+    picture_width, picture_height = shorts_picture_size(
+        info['width'], info['height'], scale_factor, keep_original_size, reframe
+    )
+    trim = start_time is not None and end_time is not None
+    encoding = plan_encoding(input_path, picture_width * picture_height, info['fps'], quality,
+                             start_time if trim else None, end_time if trim else None)
+    encoding_params = _encoding_params(encoding)
+    subtitles = bool(voices and voice_subtitles)
+    if subtitles and voice_subtitles not in SUBTITLE_MODES:
+        raise ValueError(f"不明な字幕モードです: {voice_subtitles}（{', '.join(SUBTITLE_MODES)} のいずれかを指定してください）")
+    # 字幕のために合成した音声（テロップの段階で作り、音声の段階で使う）。
+    # 字幕・音声の合成は段階の中で行うため、成果物ストアに結果があればVOICEVOXを呼ばない
+    voice_paths = {}
+    # Step 1: 動画をショート形式にリサイズ
+    stages = [{
+        'name': "resize",
+        'params': {
+            'scale_factor': float(scale_factor),
+            'start_time': start_time, 'end_time': end_time,
+            'keep_original_size': bool(keep_original_size), 'reframe': bool(reframe),
+            'encoding': encoding_params,
+        },
+        'run': lambda src, dst, warn: resize_video_to_shorts(
+            src, dst, scale_factor, start_time, end_time, keep_original_size, reframe, encoding=encoding
+        ),
+        'percent': 20,
+        'message': "被写体を解析してリサイズ中..." if reframe else "動画をリサイズ中...",
+    }]
+
+    # Step 2: テキスト・字幕を追加（オプション）
+    if telops or subtitles:
+        def add_telops(src, dst, warn):
+            all_telops = list(telops or [])
+            if subtitles:
+                subtitle_telops, paths = voice_subtitle_telops(voices, voice_subtitles, subtitle_position, on_warning=warn)
+                voice_paths.update(paths)
+                all_telops += subtitle_telops
+            if all_telops:
+                add_text_to_video(src, dst, all_telops, font_size, encoding=encoding)
+            else:
+                shutil.copyfile(src, dst)
+
+        stages.append({
+            'name': "telop",
+            'params': {
+                'telops': telops or [],
+                # 字幕は音声のテキストと開始時間から決まる
+                'subtitles': {
+                    'mode': voice_subtitles, 'position': subtitle_position,
+                    'voices': [[voice['text'], voice.get('start_time', 0.0)] for voice in voices],
+                } if subtitles else None,
+                'font_size': font_size, 'encoding': encoding_params,
+            },
+            'run': add_telops,
+            'percent': 60,
+            'message': "音声の発話区間から字幕を作成し、テキストを追加中..." if subtitles else "テキストを追加中...",
+        })
+
+    # Step 3: 音声合成を追加（オプション）
+    if voices:
+        def add_voices(src, dst, warn):
+            try:
+                # 字幕の作成時に合成した音声があれば使う
+                add_multiple_voices_to_video(src, dst, voices, 1.0, on_warning=warn, voice_paths=voice_paths)
+            except Exception as e:
+                warn(f"⚠️ 音声合成をスキップしました: {str(e)}")
+                shutil.copyfile(src, dst)
+
+        stages.append({
+            'name': "voice",
+            'params': {'voices': voices},
+            'run': add_voices,
+            'percent': 60,
+            'message': "雨晴はうの音声を生成・追加中...",
+        })
+
+    # Step 4: BGMを追加（オプション）
+    if track is not None:
+        # トラックIDは元ファイルの内容ハッシュから作るため、ファイルのハッシュの代わりに使える
+        bgm_key = {'track': track['id'], 'gain': track['gain']}
+    elif bgm_path:
+        bgm_key = file_digest(bgm_path)
+    if track is not None or bgm_path:
+        stages.append({
+            'name': "bgm",
+            'params': {
+                'bgm': bgm_key, 'bgm_volume': float(bgm_volume),
+                'original_volume': float(original_volume), 'loop_bgm': bool(loop_bgm),
+                'encoding': encoding_params,
+            },
+            'run': lambda src, dst, warn: add_bgm_to_video(
+                src, dst, None if track else bgm_path, bgm_volume, original_volume, loop_bgm,
+                encoding=encoding, bgm_track=bgm_track
+            ),
+            'percent': 80,
+            'message': "BGMを追加中...",
+        })
+
+    if preview_dir:
+        _preview_last_stage(stages, preview_dir)
+    try:
+        run_stages(file_digest(input_path), input_path, stages, output_path, progress, on_warning)
+    finally:
+        remove_voice_files(voice_paths)
+    if preview_dir:
+        _finish_preview(output_path, preview_dir)
+    if renditions:
+        _notify(progress, 90, f"追加サイズを出力中（{', '.join(r['name'] for r in renditions)}）...")
+        create_renditions(output_path, output_path, renditions)
+    if covers:
+        _notify(progress, 95, "カバー画像の候補を選んでいます...")
+        select_covers(output_path, covers)
+    _notify(progress, 100, _finish_message("変換完了！", encoding, output_path))
+    return output_path
+
+
+@metrics.track_job("combine")
+def run_combine_job(video_paths, output_path, transition=None, transition_duration=0.5,
+                    preview_dir=None, quality=DEFAULT_QUALITY, progress=None, on_warning=None):
+    """複数動画を結合（同じ動画の組み合わせは成果物ストアの結果を使用）
+
+    transition: クリップ間のトランジション（combine.TRANSITIONS の名前、None で単純連結）
+    quality: 画質の範囲（run_shorts_job と同じ）。全動画の解析結果を長さで重み付けして決める
+    preview_dir: 指定した場合、プレビュー用のHLSを書き出す（結合のエンコード中から再生できる）
+    """
+    if quality is not None:
+        _notify(progress, 2, "動画の複雑さを解析中...")
+    infos = [probe_video(path) for path in video_paths]
+    # combine_videos と同じキャンバス・FPS。予測には各動画がキャンバスに映る画素数の平均を使う
+    width = max(info['width'] for info in infos)
+    height = max(info['height'] for info in infos)
+    pixels = sum(
+        info['width'] * info['height'] * min(width / info['width'], height / info['height']) ** 2 for info in infos
+    ) / len(infos)
+    fps = min(MAX_FPS, max(info['fps'] for info in infos))
+    encoding = plan_encoding(video_paths, pixels, fps, quality)
+    stages = [{
+        'name': "combine",
+        'params': {
+            'engine': "filtergraph",
+            'transition': transition,
+            'transition_duration': float(transition_duration) if transition else None,
+            'encoding': _encoding_params(encoding),
+        },
+        'run': lambda src, dst, warn: combine_videos(
+            video_paths, dst, transition=transition, transition_duration=transition_duration, encoding=encoding
+        ),
+        'percent': 50,
+        'message': "動画を結合中...",
+    }]
+    if preview_dir:
+        _preview_last_stage(stages, preview_dir)
+    source_key = params_digest([file_digest(path) for path in video_paths])
+    run_stages(source_key, None, stages, output_path, progress, on_warning)
+    if preview_dir:
+        _finish_preview(output_path, preview_dir)
+    _notify(progress, 100, _finish_message("結合完了！", encoding, output_path))
+    return output_path
+
+
+@metrics.track_job("pptx")
+def run_pptx_job(pptx_file, output_path, slide_duration=10, slides_data=None, preview_dir=None,
+                 progress=None, on_warning=None, on_info=None):
+    """PowerPointのノートを読み上げるナレーション動画を作成
+
+    pptx_file: ファイルパスまたはファイルライクオブジェクト
+    slides_data: extract_slides_and_notes の結果（UIで解析済みの場合に再利用）
+    preview_dir: 指定した場合、先頭から順にできあがったスライドをHLSプレビューに追加する
+    """
+    if isinstance(pptx_file, (str, os.PathLike)):
+        with open(pptx_file, 'rb') as f:
+            # デコレーターを通さずに呼ぶ（ジョブ数を二重に数えない）
+            return run_pptx_job.__wrapped__(f, output_path, slide_duration, slides_data, preview_dir, progress, on_warning, on_info)
+
+    if slides_data is None:
+        slides_data = extract_slides_and_notes(pptx_file)
+    if not slides_data:
+        raise Exception("スライドが見つかりませんでした。")
+
+    # Step 1: PowerPointスライドを画像に変換（見た目が同じデッキは保存済みの画像を使用）
+    _notify(progress, 10, "スライドを画像に変換中...")
+    try:
+        slide_image_paths = get_slide_images(pptx_file)
+        use_real_slides = True
+        _notify(on_info, f"✅ {len(slide_image_paths)}枚のスライド画像を抽出しました")
+    except Exception as e:
+        _notify(on_warning, f"⚠️ スライド画像の抽出に失敗しました。テキストベースのスライドを使用します: {str(e)}")
+        slide_image_paths = []
+        use_real_slides = False
+
+    # スライドごとのセグメント動画は (画像・ノート・話者・エンコード設定) をキーに成果物ストアへ保存し、
+    # 変更のないスライドは再生成しない。同じ内容のスライドはデッキ内でも1つのセグメントを共有する
+    use_store = store_budget() > 0
+    first_index = {}   # セグメントキー → 最初に出現したスライドの番号
+    temp_files = []
+
+    # Step 2: 画像準備 → ナレーション合成 → エンコード を段階ごとに並列に処理
+    # （VOICEVOXの応答待ちの間に前のスライドをエンコードする）
+    def prepare(job):
+        i, slide = job['index'], job['slide']
+        # スライド画像を取得（実際のスライドまたはテキストベース）
+        if use_real_slides and i < len(slide_image_paths):
+            job['image'] = slide_image_paths[i]
+        else:
+            # フォールバック: テキストベースのスライド生成
+            job['image'] = create_text_slide_image(
+                slide['slide_text'],
+                f"スライド {slide['slide_number']}"
+            )
+            temp_files.append(job['image'])
+
+        job['notes'] = slide['notes_text'].strip()
+        job['key'] = artifact_key('slide_segment', [file_digest(job['image'])], {
+            'notes': job['notes'],
+            'speaker_id': NARRATION_SPEAKER_ID,
+            'duration': None if job['notes'] else slide_duration,
+            'profile': SEGMENT_PROFILE,
+        })
+        # prepare は1スレッドで順に実行されるため、先に出現した同じスライドを参照できる
+        if job['key'] in first_index:
+            job['same_as'] = first_index[job['key']]
+            return job
+        first_index[job['key']] = i
+
+        job['video'] = _temp_path(f'_slide_video_{i}.mp4')
+        temp_files.append(job['video'])
+        if use_store and fetch(job['key'], job['video']):
+            job['reused'] = True
+        return job
+
+    def synthesize(job):
+        # ナレーション音声を生成（ノートがある場合）
+        job['duration'] = slide_duration
+        if 'same_as' in job or job.get('reused') or not job['notes']:
+            return job
+        try:
+            import wave
+
+            job['voice'] = generate_voice_with_voicevox(job['slide']['notes_text'], NARRATION_SPEAKER_ID)
+            temp_files.append(job['voice'])
+
+            # 音声の長さを取得
+            with wave.open(job['voice'], 'rb') as audio:
+                job['duration'] = max(audio.getnframes() / audio.getframerate(), 3)  # 最低3秒
+        except Exception as e:
+            job['warning'] = f"⚠️ スライド{job['index']+1}の音声生成に失敗: {str(e)}"
+            job['voice'] = None
+            job['duration'] = slide_duration
+        return job
+
+    def encode(job):
+        if 'same_as' in job or job.get('reused'):
+            return job
+        # スライド動画を作成
+        if job.get('voice'):
+            create_slide_video_with_narration(job['image'], job['voice'], job['duration'], job['video'])
+        else:
+            create_silent_slide_video(job['image'], job['duration'], job['video'])
+        # 音声生成に失敗したセグメントは保存しない（次回に再試行する）
+        if use_store and 'warning' not in job:
+            put(job['key'], job['video'])
+        return job
+
+    done = {}
+    preview = HlsPreview(preview_dir) if preview_dir else None
+
+    def on_result(index, job):
+        nonlocal preview
+        done[index] = job
+        if 'warning' in job:
+            _notify(on_warning, job['warning'])
+        _notify(progress, int(10 + (len(done) / len(slides_data)) * 80), f"スライド {len(done)}/{len(slides_data)} を処理しました")
+        # 先頭から途切れずにそろったスライドをプレビューに追加
+        while preview is not None and len(preview.segments) in done:
+            ready = done[len(preview.segments)]
+            try:
+                preview.add(done[ready['same_as']]['video'] if 'same_as' in ready else ready['video'])
+            except Exception as e:
+                # プレビューは補助的なものなので、失敗しても本体の処理は続ける
+                _notify(on_warning, f"⚠️ プレビューの作成を中止しました: {str(e)}")
+                preview = None
+
+    stages = [
+        ("prepare", prepare, 1),
+        ("tts", synthesize, int(os.getenv('PPTX_TTS_WORKERS', '2'))),
+        ("encode", encode, int(os.getenv('PPTX_ENCODE_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))),
+    ]
+    try:
+        _notify(progress, 10, f"スライド 0/{len(slides_data)} を処理中...")
+        jobs = run_pipeline(
+            [{'index': i, 'slide': slide} for i, slide in enumerate(slides_data)], stages, on_result
+        )
+        slide_videos = [jobs[job['same_as']]['video'] if 'same_as' in job else job['video'] for job in jobs]
+
+        reused = sum(1 for job in jobs if 'same_as' in job or job.get('reused'))
+        if reused:
+            _notify(on_info, f"♻️ {reused}/{len(slides_data)}枚のスライドは保存済みの動画を再利用しました")
+
+        # Step 3: 全スライド動画を再エンコードせずに連結
+        _notify(progress, 90, "動画を結合中...")
+        concat_videos_copy(slide_videos, output_path)
+        if preview is not None:
+            preview.finish()
+    finally:
+        # 一時ファイルをクリーンアップ
+        for temp_file in temp_files + slide_image_paths:
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
+
+    _notify(progress, 100, "変換完了！")
+    return output_path
+
+
+def run_job(spec, progress=None, on_warning=None):
+    """ジョブ仕様（dict）に従って処理を実行し、出力パスを返す
+
+    spec['tool'] は "shorts" / "combine" / "pptx" のいずれか。
+    それ以外のキーは各 run_*_job の引数名に対応します。
+    """
+    tool = spec.get('tool', 'shorts')
+    output_path = spec['output']
+
+    if tool == "shorts":
+        telops = [
+            dict(telop, color=tuple(telop.get('color', (255, 255, 255))))
+            for telop in spec.get('telops') or []
+        ]
+        return run_shorts_job(
+            spec['input'],
+            output_path,
+            scale_factor=spec.get('scale_factor', 1.0),
+            start_time=spec.get('start_time'),
+            end_time=spec.get('end_time'),
+            keep_original_size=spec.get('keep_original_size', False),
+            telops=telops,
+            font_size=spec.get('font_size', 60),
+            voices=spec.get('voices'),
+            bgm_path=spec.get('bgm_path'),
+            bgm_track=spec.get('bgm_track'),
+            bgm_volume=spec.get('bgm_volume', 0.3),
+            original_volume=spec.get('original_volume', 0.7),
+            loop_bgm=spec.get('loop_bgm', True),
+            reframe=spec.get('reframe', False),
+            renditions=spec.get('renditions'),
+            voice_subtitles=spec.get('voice_subtitles'),
+            subtitle_position=spec.get('subtitle_position', "bottom"),
+            preview_dir=spec.get('preview_dir'),
+            quality=spec.get('quality', DEFAULT_QUALITY),
+            covers=spec.get('covers', 0),
+            progress=progress,
+            on_warning=on_warning,
+        )
+    if tool == "combine":
+        return run_combine_job(spec['inputs'], output_path,
+                               transition=spec.get('transition'),
+                               transition_duration=spec.get('transition_duration', 0.5),
+                               preview_dir=spec.get('preview_dir'),
+                               quality=spec.get('quality', DEFAULT_QUALITY),
+                               progress=progress, on_warning=on_warning)
+    if tool == "pptx":
+        return run_pptx_job(
+            spec['input'],
+            output_path,
+            slide_duration=spec.get('slide_duration', 10),
+            preview_dir=spec.get('preview_dir'),
+            progress=progress,
+            on_warning=on_warning,
+        )
+    raise ValueError(f"不明なツールです: {tool}（{', '.join(TOOLS)} のいずれかを指定してください）")
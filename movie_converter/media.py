@@ -0,0 +1,74 @@
+"""ffprobe / ffmpeg を使った動画情報の取得とフレーム読み出し"""
+import json
+import subprocess
+
+from . import supervisor
+
+# moov atom をファイル先頭に置く（ダウンロード完了前にブラウザで再生を始められる）
+FASTSTART_ARGS = ['-movflags', '+faststart']
+
+
+def probe_video(video_path):
+    """動画の情報（幅・高さ・FPS・長さ・音声の有無）を取得"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'stream=codec_type,width,height,avg_frame_rate,r_frame_rate:format=duration',
+        '-of', 'json', video_path
+    ]
+    try:
+        result = supervisor.run(cmd, stage='probe', check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"動画情報の取得に失敗しました: {e.stderr}")
+    except FileNotFoundError:
+        raise Exception("ffprobeが見つかりません。システムにFFmpegがインストールされていることを確認してください。")
+
+    data = json.loads(result.stdout)
+    video = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+    if video is None:
+        raise Exception(f"映像ストリームが見つかりません: {video_path}")
+
+    def parse_rate(rate):
+        num, _, den = (rate or '0/1').partition('/')
+        return float(num) / float(den or 1) if float(den or 1) else 0.0
+
+    fps = parse_rate(video.get('avg_frame_rate')) or parse_rate(video.get('r_frame_rate')) or 30.0
+    return {
+        'width': int(video['width']),
+        'height': int(video['height']),
+        'fps': fps,
+        'duration': float(data.get('format', {}).get('duration') or 0.0),
+        'has_audio': any(s.get('codec_type') == 'audio' for s in data.get('streams', [])),
+    }
+
+
+def iter_frames(video_path, width, height, sample_fps=None, start_time=None, duration=None, pix_fmt='gray'):
+    """ffmpegで縮小・間引きしたフレームを1回のデコードで順に読み出す（NumPy配列）
+
+    width × height に縮小したフレームを生成します。メモリには1フレーム分しか保持しません。
+    """
+    import numpy as np
+
+    channels = {'gray': 1, 'rgb24': 3}[pix_fmt]
+    filters = []
+    if sample_fps:
+        filters.append(f'fps={sample_fps}')
+    filters.append(f'scale={width}:{height}')
+
+    cmd = ['ffmpeg', '-v', 'error']
+    if start_time:
+        cmd.extend(['-ss', str(start_time)])  # 入力シーク（高速）
+    cmd.extend(['-i', video_path])
+    if duration:
+        cmd.extend(['-t', str(duration)])
+    cmd.extend(['-an', '-vf', ','.join(filters), '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-'])
+
+    frame_size = width * height * channels
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    # 途中で読むのをやめた場合も、with を抜けたところで ffmpeg を停止する
+    with supervisor.popen(cmd, stage='analyse', duration=duration,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(shape)
@@ -0,0 +1,311 @@
+"""処理状況のメトリクス（Prometheusのテキスト形式で公開）
+
+標準ライブラリのみで動作します。記録はロック1回と辞書の更新だけなので、処理の途中から気軽に呼べます。
+
+- inc / observe / set_gauge: カウンター・ヒストグラム・ゲージを記録
+- register_collector: 取得時に値を計算するゲージ（キューの長さ・一時ファイルの容量など）
+- start_metrics_server: 別ポートで GET /metrics を公開（Streamlitと同じプロセスで起動）
+- flush / render(snapshot_dir): ワーカープロセスの値をファイル経由で集計（ジョブAPI）
+
+ポートは MOVIE_CONVERTER_METRICS_PORT（既定: 9108、0で無効）で指定します。
+"""
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_PORT = 9108
+PREFIX = "movie_converter_"
+
+_DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+_SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+_RATIO_BUCKETS = (0.25, 0.5, 0.75, 0.9, 1.1, 1.5, 2, 4)
+
+# メトリクス名 → (種類, 説明, ヒストグラムの区切り)
+METRICS = {
+    'jobs_started_total': ('counter', "開始したジョブ数", None),
+    'jobs_completed_total': ('counter', "完了したジョブ数", None),
+    'jobs_failed_total': ('counter', "失敗したジョブ数", None),
+    'jobs_in_progress': ('gauge', "実行中のジョブ数", None),
+    'job_duration_seconds': ('histogram', "ジョブ全体の処理時間（秒）", _DURATION_BUCKETS),
+    'stage_duration_seconds': ('histogram', "処理段階ごとの処理時間（秒）", _DURATION_BUCKETS),
+    'ffmpeg_encode_speed': ('histogram', "エンコード速度（動画の長さ / 処理時間、1.0 = 実時間）", _SPEED_BUCKETS),
+    'bitrate_prediction_ratio': ('histogram', "実際のビットレート / 予測ビットレート", _RATIO_BUCKETS),
+    'subprocess_terminations_total': ('counter', "停止させた子プロセス数（reason: cancelled / timeout）", None),
+    'voicevox_request_duration_seconds': ('histogram', "VOICEVOXへのリクエストの応答時間（秒）", _LATENCY_BUCKETS),
+    'voicevox_errors_total': ('counter', "VOICEVOXへのリクエストの失敗数", None),
+    'cache_requests_total': ('counter', "キャッシュの参照数（result: hit / miss）", None),
+    'queue_depth': ('gauge', "待機中の要素数", None),
+    'temp_disk_bytes': ('gauge', "一時ファイル・キャッシュの使用容量（バイト）", None),
+    'disk_free_bytes': ('gauge', "一時ファイル用ディスクの空き容量（バイト）", None),
+}
+
+_lock = threading.Lock()
+_values = {}       # (名前, ラベル) → 値（カウンター・ゲージ）
+_histograms = {}   # (名前, ラベル) → [各区切りの件数..., 合計, 件数]
+_collectors = []
+_server = None
+
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError(f"未定義のメトリクスです: {name}")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """カウンター（またはゲージ）を増やす"""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name, value, **labels):
+    """ヒストグラムに値を記録"""
+    key = _key(name, labels)
+    buckets = METRICS[name][2]
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                entry[i] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+
+class timed:
+    """with ブロックの処理時間をヒストグラムに記録"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.monotonic() - self.started, **self.labels)
+        return False
+
+
+def record_encode(encoder, media_seconds, started):
+    """エンコード速度（動画の長さ / 経過時間）を記録。started は time.monotonic() の値"""
+    elapsed = time.monotonic() - started
+    if media_seconds and elapsed > 0:
+        observe('ffmpeg_encode_speed', media_seconds / elapsed, encoder=encoder)
+
+
+def track_job(tool):
+    """ジョブ関数の開始・完了・失敗と処理時間を記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            inc('jobs_started_total', tool=tool)
+            inc('jobs_in_progress', tool=tool)
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                inc('jobs_failed_total', tool=tool)
+                raise
+            finally:
+                inc('jobs_in_progress', -1, tool=tool)
+            inc('jobs_completed_total', tool=tool)
+            observe('job_duration_seconds', time.monotonic() - started, tool=tool)
+            return result
+
+        return wrapper
+    return decorator
+
+
+def register_collector(func):
+    """取得時に呼ばれる関数を登録（func() は [(名前, ラベルの dict, 値), ...] を返す）"""
+    with _lock:
+        if func not in _collectors:
+            _collectors.append(func)
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _collect_disk():
+    """一時ディレクトリ直下のファイルとキャッシュディレクトリの容量"""
+    from .cache import get_cache_dir
+
+    temp_dir = tempfile.gettempdir()
+    temp_bytes = 0
+    try:
+        with os.scandir(temp_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        temp_bytes += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    cache_dir = get_cache_dir('')
+    return [
+        ('temp_disk_bytes', {'location': "tmp"}, temp_bytes),
+        ('temp_disk_bytes', {'location': "cache"}, _directory_size(cache_dir)),
+        ('disk_free_bytes', {'location': "tmp"}, shutil.disk_usage(temp_dir).free),
+    ]
+
+
+register_collector(_collect_disk)
+
+
+def snapshot():
+    """このプロセスの値を JSON にできる形で返す"""
+    with _lock:
+        return {
+            'values': [[name, dict(labels), value] for (name, labels), value in _values.items()],
+            'histograms': [[name, dict(labels), list(entry)] for (name, labels), entry in _histograms.items()],
+        }
+
+
+def flush(snapshot_dir, name=None):
+    """このプロセスの値を snapshot_dir/<name または pid>.json に書き出す（累積値なので上書きでよい）"""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f"{name or os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _merge(values, histograms, data):
+    for name, labels, value in data['values']:
+        if name in METRICS:
+            key = _key(name, labels)
+            values[key] = values.get(key, 0) + value
+    for name, labels, entry in data['histograms']:
+        if name in METRICS and len(entry) == len(METRICS[name][2]) + 2:
+            key = _key(name, labels)
+            current = histograms.setdefault(key, [0] * len(entry))
+            for i, count in enumerate(entry):
+                current[i] += count
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(snapshot_dir=None):
+    """Prometheus のテキスト形式で出力（snapshot_dir があれば他プロセスの値も合算）"""
+    data = snapshot()
+    values, histograms = {}, {}
+    _merge(values, histograms, data)
+    if snapshot_dir and os.path.isdir(snapshot_dir):
+        for name in os.listdir(snapshot_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(snapshot_dir, name), 'r', encoding='utf-8') as f:
+                    _merge(values, histograms, json.load(f))
+            except (OSError, ValueError):
+                continue
+    with _lock:
+        collectors = list(_collectors)
+    for collector in collectors:
+        try:
+            for name, labels, value in collector():
+                values[_key(name, labels)] = value
+        except Exception:
+            continue
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, v) for (n, labels), v in (histograms if kind == 'histogram' else values).items() if n == name)
+        if not series:
+            continue
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-2] + [value[-1]]):
+                lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_number(value[-2])}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_port():
+    """公開ポート（0 の場合は公開しない）"""
+    return int(os.getenv('MOVIE_CONVERTER_METRICS_PORT', str(DEFAULT_PORT)))
+
+
+def start_metrics_server(port=None, host='0.0.0.0'):
+    """GET /metrics を返すHTTPサーバーをバックグラウンドで起動（プロセスごとに1回だけ）
+
+    Streamlit はスクリプトを何度も再実行するため、2回目以降の呼び出しは何もしません。
+    ポートが使用中の場合は起動せず None を返します。
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    port = metrics_port() if port is None else port
+    with _lock:
+        if _server is not None or port <= 0:
+            return _server
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            print(f"メトリクスサーバーを起動できませんでした (ポート {port}): {e}", flush=True)
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
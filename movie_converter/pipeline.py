@@ -0,0 +1,126 @@
+"""段階ごとに並列数を決めたストリーミング処理（サイズ上限付きキューで連結）
+
+各段階はスレッドで動き、前の段階のキューから要素を受け取って次の段階のキューへ渡します。
+キューのサイズに上限があるため、遅い段階の手前で自然に待ちが発生します（バックプレッシャー）。
+最後の段階の結果は呼び出し元のスレッドで受け取るため、on_result から
+Streamlit の表示関数（st.warning など）を呼び出せます。
+"""
+import contextvars
+import queue
+import threading
+
+from . import metrics
+
+_END = object()       # 段階の入力の終わり
+_POLL_SECONDS = 0.1   # 停止要求を確認する間隔
+
+
+def _put(q, value, stop):
+    """キューに空きができるまで待って入れる（停止要求があれば諦める）"""
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(items, stages, on_result=None, queue_size=None):
+    """要素のリストを段階の列に流し、入力と同じ順序の結果リストを返す
+
+    stages: [(段階名, func(要素) -> 要素, 並列数), ...]
+    on_result(index, result): 要素が最後の段階を終えるたびに（完了順で）呼ばれる
+    queue_size: 段階間のキューの上限（既定: 次の段階の並列数の2倍）
+    いずれかの段階で例外が発生した場合は残りの処理を止め、最初の例外を送出します。
+    """
+    items = list(items)
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size or max(1, workers) * 2) for _, _, workers in stages]
+    results_queue = queue.Queue()
+    queues.append(results_queue)
+    threads = []
+
+    def feed():
+        for index, item in enumerate(items):
+            if not _put(queues[0], (index, item), stop):
+                return
+        for _ in range(max(1, stages[0][2])):
+            _put(queues[0], _END, stop)
+
+    def make_worker(stage_index, func, counter):
+        name = stages[stage_index][0]
+        in_queue = queues[stage_index]
+        out_queue = queues[stage_index + 1]
+        next_workers = max(1, stages[stage_index + 1][2]) if stage_index + 1 < len(stages) else 1
+
+        def worker():
+            while True:
+                entry = _get(in_queue, stop)
+                if entry is _END:
+                    break
+                index, item = entry
+                metrics.set_gauge('queue_depth', in_queue.qsize(), queue=f"pipeline_{name}")
+                try:
+                    with metrics.timed('stage_duration_seconds', stage=name):
+                        item = func(item)
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+                    break
+                if not _put(out_queue, (index, item), stop):
+                    break
+            # この段階の最後のワーカーが次の段階に終わりを伝える
+            with counter['lock']:
+                counter['remaining'] -= 1
+                last = counter['remaining'] == 0
+            if last:
+                metrics.set_gauge('queue_depth', 0, queue=f"pipeline_{name}")
+                for _ in range(next_workers):
+                    _put(out_queue, _END, stop)
+
+        return worker
+
+    threads.append(threading.Thread(target=feed, name="pipeline-feed", daemon=True))
+    for stage_index, (name, func, workers) in enumerate(stages):
+        workers = max(1, workers)
+        counter = {'remaining': workers, 'lock': threading.Lock()}
+        for n in range(workers):
+            # 呼び出し元の contextvars（取り消し・優先度の設定）を各スレッドに引き継ぐ
+            threads.append(threading.Thread(
+                target=contextvars.copy_context().run, args=(make_worker(stage_index, func, counter),),
+                name=f"pipeline-{name}-{n}", daemon=True
+            ))
+    for thread in threads:
+        thread.start()
+
+    results = [None] * len(items)
+    try:
+        while True:
+            entry = _get(results_queue, stop)
+            if entry is _END:
+                break
+            index, result = entry
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,367 @@
+"""パワポナレーション動画の処理（スライド抽出・画像化・スライド動画生成）
+
+python-pptx・moviepy・Pillow は各関数の中で読み込みます（モジュールのimportを軽量に保つため）。
+"""
+import os
+import tempfile
+
+
+ANALYSIS_VERSION = 1   # 解析結果の形式を変えたら上げる（保存済みの結果を使わなくなる）
+EMU_PER_PIXEL = 9525   # 96dpi
+MEDIA_RELATIONSHIPS = ('image', 'video', 'audio', 'media')
+
+ANALYSIS_MEMO_SIZE = 32   # プロセス内に保持する解析結果の数
+
+_analysis_memo = {}   # 内容ハッシュ → 解析結果（同じプロセス内の再実行用、古いものから削除）
+
+
+def _slide_media(slide):
+    """スライドに埋め込まれた画像・動画・音声の一覧"""
+    media = []
+    seen = set()
+    for rel in slide.part.rels.values():
+        kind = rel.reltype.rsplit('/', 1)[-1]
+        if kind not in MEDIA_RELATIONSHIPS or rel.is_external:
+            continue
+        part = rel.target_part
+        if part.partname in seen:
+            continue
+        seen.add(part.partname)
+        media.append({
+            'kind': kind,
+            'name': os.path.basename(str(part.partname)),
+            'content_type': part.content_type,
+            'size': len(part.blob),
+        })
+    return media
+
+
+def _analyse_presentation(pptx_file):
+    from pptx import Presentation
+
+    presentation = Presentation(pptx_file)
+    slides_data = []
+    media = []
+
+    for i, slide in enumerate(presentation.slides):
+        # スライドのテキスト内容を取得
+        slide_text = ""
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                slide_text += shape.text + " "
+
+        # スピーカーノートを取得（ノートのないスライドで notes_slide を参照すると作成されるため確認してから）
+        notes_text = ""
+        if slide.has_notes_slide:
+            notes_text_frame = slide.notes_slide.notes_text_frame
+            if notes_text_frame:
+                notes_text = notes_text_frame.text
+
+        slides_data.append({
+            'slide_number': i + 1,
+            'slide_text': slide_text.strip(),
+            'notes_text': notes_text.strip(),
+            'slide_image_path': None  # スライド画像は get_slide_images で取得
+        })
+        media.extend(dict(item, slide_number=i + 1) for item in _slide_media(slide))
+
+    return {
+        'slides': slides_data,
+        'slide_count': len(slides_data),
+        'slide_width': int(round((presentation.slide_width or 0) / EMU_PER_PIXEL)),
+        'slide_height': int(round((presentation.slide_height or 0) / EMU_PER_PIXEL)),
+        'media': media,
+    }
+
+
+def analyse_presentation(pptx_file):
+    """PowerPointファイルを解析（ファイル内容のハッシュでキャッシュ）
+
+    pptx_file: ファイルパスまたはファイルライクオブジェクト
+    戻り値: {'slides': extract_slides_and_notes の結果, 'slide_count': 枚数,
+             'slide_width' / 'slide_height': スライドのサイズ（ピクセル、96dpi）,
+             'media': [{'slide_number', 'kind', 'name', 'content_type', 'size'}, ...]}
+    """
+    from .cache import file_digest, load_json, params_digest, save_json, stream_digest
+
+    if isinstance(pptx_file, (str, os.PathLike)):
+        digest = file_digest(pptx_file)
+    else:
+        digest = stream_digest(pptx_file)
+    key = params_digest({'pptx': digest, 'version': ANALYSIS_VERSION})
+    analysis = _analysis_memo.get(key)
+    if analysis is None:
+        analysis = load_json('pptx_analysis', key)
+    if analysis is None:
+        analysis = _analyse_presentation(pptx_file)
+        if not isinstance(pptx_file, (str, os.PathLike)):
+            pptx_file.seek(0)
+        save_json('pptx_analysis', key, analysis)
+    _analysis_memo.pop(key, None)
+    _analysis_memo[key] = analysis
+    while len(_analysis_memo) > ANALYSIS_MEMO_SIZE:
+        del _analysis_memo[next(iter(_analysis_memo))]
+    # 呼び出し側で書き換えても保存済みの結果に影響しないようにコピーを返す
+    return dict(analysis, slides=[dict(slide) for slide in analysis['slides']], media=list(analysis['media']))
+
+
+def extract_slides_and_notes(pptx_file):
+    """PowerPointファイルからスライドと speaker notes を抽出（analyse_presentation の結果を使用）"""
+    return analyse_presentation(pptx_file)['slides']
+
+
+def create_slide_images_from_pptx(pptx_file):
+    """PowerPointスライドを画像ファイルに変換する（LibreOfficeを使用）"""
+    import shutil
+
+    from . import supervisor
+    
+    # 一時ディレクトリを作成
+    temp_dir = tempfile.mkdtemp()
+    pptx_path = os.path.join(temp_dir, "presentation.pptx")
+    
+    # アップロードファイルを保存
+    with open(pptx_path, 'wb') as f:
+        pptx_file.seek(0)
+        f.write(pptx_file.read())
+    
+    try:
+        # LibreOfficeでPDFに変換
+        cmd = [
+            'libreoffice', 
+            '--headless', 
+            '--convert-to', 'pdf',
+            '--outdir', temp_dir,
+            pptx_path
+        ]
+        result = supervisor.run(cmd, stage='convert', capture_output=True, text=True)
+        
+        if result.returncode != 0:
+            raise Exception(f"LibreOffice変換エラー: {result.stderr}")
+        
+        # PDFをPNG画像に変換（pdftoppmを使用 - より安定）
+        pdf_path = os.path.join(temp_dir, "presentation.pdf")
+        if not os.path.exists(pdf_path):
+            raise Exception("PDF変換に失敗しました")
+        
+        # pdftoppmでPDFの各ページをPNGに変換
+        cmd = [
+            'pdftoppm',
+            '-png',
+            '-r', '150',  # 解像度150dpi
+            pdf_path,
+            os.path.join(temp_dir, 'slide')
+        ]
+        result = supervisor.run(cmd, stage='convert', capture_output=True, text=True)
+        
+        if result.returncode != 0:
+            # pdftoppmが失敗した場合はImageMagickを試行
+            cmd = [
+                'convert',
+                '-density', '150',
+                '-background', 'white',
+                '-alpha', 'remove',
+                '-quality', '90',
+                pdf_path,
+                os.path.join(temp_dir, 'slide-%03d.png')
+            ]
+            result = supervisor.run(cmd, stage='convert', capture_output=True, text=True)
+            
+            if result.returncode != 0:
+                raise Exception(f"画像変換エラー: {result.stderr}")
+        
+        # 生成された画像ファイルパスを取得
+        slide_images = []
+        
+        # pdftoppmの出力形式に対応
+        for file in sorted(os.listdir(temp_dir)):
+            if file.startswith('slide') and file.endswith('.png'):
+                image_path = os.path.join(temp_dir, file)
+                if os.path.exists(image_path):
+                    # 永続的な場所にコピー
+                    slide_num = len(slide_images)
+                    permanent_path = tempfile.mktemp(suffix=f'_slide_{slide_num}.png')
+                    shutil.copy(image_path, permanent_path)
+                    slide_images.append(permanent_path)
+        
+        if not slide_images:
+            raise Exception("スライド画像の生成に失敗しました")
+        
+        return slide_images, temp_dir
+        
+    except BaseException:
+        # 一時ディレクトリをクリーンアップ（タイムアウト・取り消しの場合も）
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+# スライド動画（セグメント）の共通エンコード設定
+# 全セグメントを同じ形式にそろえ、最後はストリームコピーで連結します。
+SEGMENT_PROFILE = {
+    'width': 1920,
+    'height': 1080,
+    'fps': 5,           # スライドなので低いFPSで十分（音声の長さに合わせる丸め誤差は0.2秒以内）
+    'crf': 18,
+    'preset': 'fast',
+    'audio_rate': 44100,
+    'audio_channels': 2,
+}
+
+
+def _encode_slide_segment(slide_image_path, narration_audio_path, duration, output_path):
+    """スライド画像（と音声）から共通形式のセグメント動画を作成（無音の場合も無音トラックを入れる）"""
+    import math
+    import subprocess
+    import time
+
+    from . import metrics, supervisor
+
+    profile = SEGMENT_PROFILE
+    fps = profile['fps']
+    # 映像はフレーム単位の長さになるため、音声も同じ長さにそろえる
+    duration = math.ceil(duration * fps) / fps
+
+    cmd = ['ffmpeg', '-loop', '1', '-framerate', str(fps), '-i', slide_image_path]
+    if narration_audio_path:
+        cmd.extend(['-i', narration_audio_path])
+    else:
+        cmd.extend(['-f', 'lavfi', '-i', f"anullsrc=r={profile['audio_rate']}:cl=stereo"])
+    cmd.extend([
+        '-filter_complex',
+        f"[0:v]scale={profile['width']}:{profile['height']}:force_original_aspect_ratio=decrease,"
+        f"pad={profile['width']}:{profile['height']}:(ow-iw)/2:(oh-ih)/2:white,setsar=1,format=yuv420p[v];"
+        f"[1:a]aresample={profile['audio_rate']},apad[a]",
+        '-map', '[v]', '-map', '[a]',
+        '-t', f"{duration:.3f}",
+        '-c:v', 'libx264', '-tune', 'stillimage',
+        '-crf', str(profile['crf']), '-preset', profile['preset'],
+        '-c:a', 'aac', '-ar', str(profile['audio_rate']), '-ac', str(profile['audio_channels']),
+        '-y', output_path
+    ])
+    started = time.monotonic()
+    try:
+        supervisor.run(cmd, stage='encode', duration=duration, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"スライド動画の作成に失敗しました: {e.stderr.decode()}")
+    metrics.record_encode('slide_segment', duration, started)
+    return output_path
+
+
+def create_slide_video_with_narration(slide_image_path, narration_audio_path, duration, output_path):
+    """スライド画像とナレーション音声から動画を作成"""
+    return _encode_slide_segment(slide_image_path, narration_audio_path, duration, output_path)
+
+
+def create_silent_slide_video(slide_image_path, duration, output_path):
+    """スライド画像のみから無音の動画を作成（ノートがないスライド用）"""
+    return _encode_slide_segment(slide_image_path, None, duration, output_path)
+
+
+def slide_render_digest(pptx_file):
+    """スライドの見た目に関わる部分だけのハッシュ（ノート・文書プロパティの変更では変わらない）
+
+    ZIP内の各ファイルのCRCから計算するため、展開は不要です。
+    """
+    import hashlib
+    import zipfile
+
+    pptx_file.seek(0)
+    h = hashlib.sha256()
+    with zipfile.ZipFile(pptx_file) as archive:
+        for info in sorted(archive.infolist(), key=lambda x: x.filename):
+            if info.filename.startswith(('ppt/notesSlides/', 'docProps/')):
+                continue
+            h.update(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode('utf-8'))
+    pptx_file.seek(0)
+    return h.hexdigest()
+
+
+def _fetch_slide_images(keys):
+    """保存済みのスライド画像を作業用の一時ファイルに取り出す（1枚でも欠けていれば None）"""
+    import tempfile
+
+    from .store import fetch
+
+    paths = []
+    for i, key in enumerate(keys):
+        fd, path = tempfile.mkstemp(suffix=f'_slide_{i + 1}.png')
+        os.close(fd)
+        paths.append(path)
+        if not fetch(key, path, '.png'):
+            for path in paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+            return None
+    return paths
+
+
+def get_slide_images(pptx_file):
+    """スライド画像のリストを取得（見た目が同じデッキは成果物ストアから再利用）
+
+    戻り値: 画像パスのリスト。ストアから再利用した場合も作業用の一時ファイル
+    （ストアの削除の影響を受けない）のため、使い終わったら削除してください。
+    """
+    import shutil
+
+    from .cache import load_json, save_json
+    from .store import artifact_key, put, store_budget
+
+    digest = slide_render_digest(pptx_file)
+    keys = load_json('slides', digest)
+    if keys:
+        paths = _fetch_slide_images(keys)
+        if paths is not None:
+            return paths
+
+    slide_images, temp_dir = create_slide_images_from_pptx(pptx_file)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    if store_budget() <= 0:
+        return slide_images
+
+    keys = [artifact_key('slide_image', [digest], {'index': i}) for i in range(len(slide_images))]
+    if all([put(key, path, '.png') for key, path in zip(keys, slide_images)]):
+        save_json('slides', digest, keys)
+    return slide_images
+
+SLIDE_FONTS = ("NotoSansCJK-Regular.ttc",)
+
+
+def layout_text_slide(text, title, width=1920, height=1080):
+    """テキストスライドのレイアウトを計算
+
+    [(x, y, 文字列, フォント), ...] を返します（タイトル → 本文の順）。
+    """
+    from .textlayout import line_width, load_font, wrap_text
+
+    title_font = load_font(72, SLIDE_FONTS)
+    text_font = load_font(48, SLIDE_FONTS)
+
+    # タイトルは中央揃え
+    items = [((width - int(line_width(title, title_font))) // 2, 100, title, title_font)]
+
+    # 本文は左右マージン100pxで折り返して中央揃え（日本語は禁則処理付きで文字単位に折り返す）
+    y_offset = 250
+    line_height = 60
+    for line in wrap_text(text, text_font, width - 200):
+        text_x = (width - int(line_width(line, text_font))) // 2
+        items.append((text_x, y_offset, line, text_font))
+        y_offset += line_height
+
+    return items
+
+
+def create_text_slide_image(text, title, width=1920, height=1080):
+    """テキストからスライド画像を生成"""
+    from PIL import Image, ImageDraw
+
+    # 空の画像を作成
+    img = Image.new('RGB', (width, height), color='white')
+    draw = ImageDraw.Draw(img)
+
+    for x, y, line, font in layout_text_slide(text, title, width, height):
+        draw.text((x, y), line, fill='black', font=font)
+
+    # 画像を保存
+    output_path = tempfile.mktemp(suffix='.png')
+    img.save(output_path)
+
+    return output_path
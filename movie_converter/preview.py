@@ -0,0 +1,159 @@
+"""プレビュー再生用のHLS出力
+
+ダウンロード用の出力はこれまでどおり通常のMP4（faststart）で、プレビューには別途
+HLS（index.m3u8 + MPEG-TSセグメント）を書き出します。
+
+- HlsPreview: 処理中にできあがった部分動画を順にセグメントとして追加する（EVENTプレイリスト）
+  パワポナレーション動画ではスライドごとに追加するため、最初のスライドができた時点から再生できます
+- live_hls: ショート動画・結合の最後のエンコードの出力を tee で分け、エンコード中からHLS（fMP4セグメント）を書き出す
+  ffmpeg 以外（MoviePy）で書き出す段階や成果物ストアの結果を使った場合は、完成後に write_hls で分割します
+- write_hls: 完成した動画を再エンコードせずにHLSに分割する
+"""
+import contextlib
+import contextvars
+import math
+import os
+import subprocess
+
+from . import supervisor
+from .media import FASTSTART_ARGS, probe_video
+
+PLAYLIST_NAME = "index.m3u8"
+LIVE_INIT_NAME = "init.mp4"
+LIVE_SEGMENT_SECONDS = 2
+# tee の出力指定で区切り・エスケープに使われる文字（含むパスでは tee を使わない）
+TEE_SPECIAL_CHARS = set("\\'[]|:=")
+
+_live_target = contextvars.ContextVar('movie_converter_live_preview', default=None)
+
+
+class HlsPreview:
+    """部分動画を追加していくHLSプレイリスト"""
+
+    def __init__(self, preview_dir):
+        self.preview_dir = preview_dir
+        self.segments = []   # [(ファイル名, 長さ)]
+        self.offset = 0.0
+        os.makedirs(preview_dir, exist_ok=True)
+        self._write_playlist(finished=False)
+
+    def _write_playlist(self, finished):
+        target = max([math.ceil(duration) for _, duration in self.segments] or [1])
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for name, duration in self.segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(name)
+        if finished:
+            lines.append("#EXT-X-ENDLIST")
+        path = os.path.join(self.preview_dir, PLAYLIST_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def add(self, video_path):
+        """部分動画を再エンコードせずにセグメントとして追加（タイムスタンプは前のセグメントから続ける）"""
+        duration = probe_video(video_path)['duration']
+        name = f"seg_{len(self.segments):05d}.ts"
+        segment_path = os.path.join(self.preview_dir, name)
+        cmd = [
+            'ffmpeg', '-v', 'error', '-i', video_path, '-c', 'copy',
+            '-output_ts_offset', f"{self.offset:.3f}", '-f', 'mpegts', '-y', f"{segment_path}.tmp"
+        ]
+        try:
+            supervisor.run(cmd, stage='copy', duration=duration, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"プレビューの作成に失敗しました: {e.stderr.decode()}")
+        os.replace(f"{segment_path}.tmp", segment_path)
+        self.segments.append((name, duration))
+        self.offset += duration
+        self._write_playlist(finished=False)
+
+    def finish(self):
+        self._write_playlist(finished=True)
+
+
+@contextlib.contextmanager
+def live_hls(output_path, preview_dir):
+    """この中で output_path に書き出す ffmpeg のエンコードから、同時にプレビュー用のHLSも書き出す
+
+    出力を tee で分けるため、エンコードは1回のままです。対象は output_args() で出力を指定したコマンドだけです。
+    """
+    os.makedirs(preview_dir, exist_ok=True)
+    token = _live_target.set((os.path.abspath(output_path), os.path.abspath(preview_dir)))
+    try:
+        yield
+    finally:
+        _live_target.reset(token)
+
+
+def output_args(output_path):
+    """ffmpeg の出力指定（faststart のMP4。live_hls の対象なら tee でHLSにも書き出す）
+
+    tee の出力にはストリームを -map で明示する必要があります。
+    プレビューのセグメント長（LIVE_SEGMENT_SECONDS）ごとにキーフレームを入れるため、完成した動画のキーフレームも増えます。
+    """
+    target = _live_target.get()
+    if target is None or target[0] != os.path.abspath(output_path) \
+            or TEE_SPECIAL_CHARS & set(target[0] + target[1]):
+        return [*FASTSTART_ARGS, output_path]
+    preview_dir = target[1]
+    hls_options = ':'.join([
+        'f=hls', f'hls_time={LIVE_SEGMENT_SECONDS}', 'hls_playlist_type=event',
+        'hls_segment_type=fmp4', f'hls_fmp4_init_filename={LIVE_INIT_NAME}',
+        f"hls_segment_filename={os.path.join(preview_dir, 'seg_%05d.m4s')}",
+    ])
+    # セグメントはキーフレームでしか区切れないため、エンコードする場合はその間隔でキーフレームを入れる
+    keyframes = ['-force_key_frames', f"expr:gte(t,n_forced*{LIVE_SEGMENT_SECONDS})"]
+    return [*keyframes, '-f', 'tee', f"[f=mp4:movflags=+faststart]{output_path}|[{hls_options}]{os.path.join(preview_dir, PLAYLIST_NAME)}"]
+
+
+def playlist_segments(preview_dir):
+    """プレイリストに載っている（書き終わった）セグメントのファイル名と、プレイリストが完結しているか"""
+    try:
+        with open(os.path.join(preview_dir, PLAYLIST_NAME), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return [], False
+    segments = [line for line in lines if line and not line.startswith('#')]
+    return segments, "#EXT-X-ENDLIST" in lines
+
+
+def join_live_segments(preview_dir, output_path):
+    """live_hls のfMP4セグメントを書き終わった分だけつなぎ、ブラウザで再生できるMP4にする
+
+    再エンコードもffmpegも使わず、初期化セグメントの後ろにセグメントを連結するだけです。
+    戻り値: つないだセグメント数（まだない場合は 0）
+    """
+    segments = [name for name in playlist_segments(preview_dir)[0] if name.endswith('.m4s')]
+    init_path = os.path.join(preview_dir, LIVE_INIT_NAME)
+    if not segments or not os.path.exists(init_path):
+        return 0
+    with open(f"{output_path}.tmp", 'wb') as out:
+        for name in [LIVE_INIT_NAME, *segments]:
+            with open(os.path.join(preview_dir, name), 'rb') as f:
+                out.write(f.read())
+    os.replace(f"{output_path}.tmp", output_path)
+    return len(segments)
+
+
+def write_hls(video_path, preview_dir, segment_seconds=2):
+    """完成した動画をHLSに分割（キーフレーム位置で区切るため、セグメント長は目安）"""
+    os.makedirs(preview_dir, exist_ok=True)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', video_path, '-c', 'copy',
+        '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(preview_dir, 'seg_%05d.ts'),
+        '-y', os.path.join(preview_dir, PLAYLIST_NAME)
+    ]
+    try:
+        supervisor.run(cmd, stage='copy', duration=probe_video(video_path)['duration'], check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"プレビューの作成に失敗しました: {e.stderr.decode()}")
+    return os.path.join(preview_dir, PLAYLIST_NAME)
@@ -0,0 +1,304 @@
+"""内容に合わせたエンコード設定（CRF・最大ビットレート・x264のチューニング）
+
+入力動画の一部を縮小して1回だけデコードし、フレームの統計（細かさ・フレーム間の差・シーンチェンジの頻度）と
+x264 の試しエンコードのビット数を同時に測ってから、ユーザーが選んだ画質の範囲（CRFの下限・上限）の中で設定を決めます。
+
+- 動きが少なく単純な動画（スライド・トーク）: CRFを上限寄りにしてファイルを小さく
+- 動きが多く細かい動画（ゲーム・スポーツ・ノイズの多い映像）: CRFを下限寄りにし、最大ビットレートにも余裕を持たせる
+- tune: 静止画が続く動画は stillimage、平坦な塗りと輪郭の多い動画は animation、それ以外は film
+
+予測ビットレートは試しエンコードを出力サイズ・CRFに換算した目安です（合成した映像で実際の 0.2〜3.5 倍）。
+ジョブの完了時に予測と実際の値を表示し、比をメトリクス bitrate_prediction_ratio に記録します。
+解析結果は入力ファイルの内容ハッシュをキーにキャッシュします（MOVIE_CONVERTER_CACHE_DIR/complexity）。
+"""
+import os
+import subprocess
+
+from . import supervisor
+from .cache import file_digest, load_json, params_digest, save_json
+from .media import probe_video
+
+# 画質の範囲（CRFの下限・上限。小さいほど高画質）と x264 のプリセット
+QUALITY_PRESETS = {
+    'high': {'label': "高画質", 'crf_min': 16, 'crf_max': 20, 'preset': 'slow'},
+    'standard': {'label': "標準", 'crf_min': 19, 'crf_max': 24, 'preset': 'medium'},
+    'small': {'label': "容量優先", 'crf_min': 23, 'crf_max': 28, 'preset': 'medium'},
+}
+DEFAULT_QUALITY = 'high'
+
+ANALYSIS_WIDTH = 320        # 解析用に縮小する幅
+ANALYSIS_FPS = 4            # 統計用に間引いたフレームレート
+ANALYSIS_SECONDS = 20       # 解析する長さの上限（長い動画は等間隔の区間から合計この長さ）
+ANALYSIS_SEGMENTS = 5
+SCENE_CHANGE_DIFF = 30.0    # フレーム間の平均差がこれを超えたらシーンチェンジとみなす（0〜255）
+STATIC_DIFF = 1.0           # フレーム間の平均差がこれ未満なら静止とみなす
+FLAT_GRADIENT = 2.0         # 勾配がこれ未満の画素を平坦とみなす
+PROBE_CRF = 23              # 試しエンコードのCRF
+PROBE_PRESET = 'superfast'
+
+# 予測ビットレートのモデル
+# 試しエンコード（ANALYSIS_WIDTH・PROBE_CRF）の1画素あたりのビット数を出力サイズ・CRFに換算する。
+# 解像度が上がるほど1画素あたりのビット数は下がる（画素数の比の BPP_SCALE_EXPONENT 乗）
+BPP_SCALE_EXPONENT = -0.1
+CRF_DOUBLING = 6.0          # CRFを6下げるとビットレートがおよそ2倍
+MAXRATE_HEADROOM = 2.5      # 最大ビットレート = 予測 × この倍率（複雑な動画ほど +1 まで余裕を持たせる）
+MIN_MAXRATE_KBPS = 1000
+
+# 解析しない場合（quality=None）の設定。従来の固定設定から、CRFと矛盾する -b:v を除いたもの
+DEFAULT_ENCODING = {'crf': 18, 'preset': 'slow', 'tune': None, 'maxrate': None, 'bufsize': None}
+
+
+def _analyse_range(video_path, width, height, start_time, duration, probe_path):
+    """区間を1回デコードし、統計用の縮小フレームと試しエンコードを同時に作る
+
+    戻り値: (各フレームの平均勾配, 平坦な画素の割合, フレーム間の平均差)
+    """
+    import numpy as np
+
+    # 出力が2つあるので -t は入力側に付ける（出力側だと最初の出力にしか効かない）
+    cmd = ['ffmpeg', '-v', 'error']
+    if start_time:
+        cmd.extend(['-ss', str(start_time)])
+    cmd.extend(['-t', str(duration), '-i', video_path, '-an', '-sn',
+                '-filter_complex', f"[0:v]scale={width}:{height},format=yuv420p,split[probe][s];"
+                                   f"[s]fps={ANALYSIS_FPS},format=gray[stats]",
+                '-map', '[stats]', '-f', 'rawvideo', 'pipe:1',
+                '-map', '[probe]', '-c:v', 'libx264', '-preset', PROBE_PRESET, '-crf', str(PROBE_CRF),
+                '-x264-params', 'log-level=error', '-f', 'h264', '-y', probe_path])
+    frame_size = width * height
+    spatial, flat, diffs = [], [], []
+    previous = None
+    with supervisor.popen(cmd, stage='analyse', duration=duration,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width).astype(np.float32)
+            gradient = np.abs(np.diff(frame, axis=1))[:-1, :] + np.abs(np.diff(frame, axis=0))[:, :-1]
+            spatial.append(float(gradient.mean()))
+            flat.append(float((gradient < FLAT_GRADIENT).mean()))
+            if previous is not None:
+                diffs.append(float(np.abs(frame - previous).mean()))
+            previous = frame
+        stderr = process.stderr.read()
+        process.wait()
+    if process.returncode != 0:
+        raise Exception(f"動画の解析に失敗しました: {stderr.decode(errors='replace')}")
+    return spatial, flat, diffs
+
+
+def analyse_complexity(video_path, start_time=None, end_time=None):
+    """動画の複雑さを解析（結果はキャッシュ）
+
+    縮小した区間を1回デコードし、フレームの統計と試しエンコード（x264 superfast・CRF 23）の
+    ビット数を同時に求めます。
+    戻り値: {'spatial': 平均勾配, 'temporal': フレーム間の平均差, 'scene_changes': 1分あたりのシーンチェンジ数,
+             'static_ratio': 静止しているフレームの割合, 'flat_ratio': 平坦な画素の割合,
+             'probe_bpp': 試しエンコードの1画素あたりのビット数, 'probe_pixels': 試しエンコードの画素数（1フレーム）,
+             'source_pixels': 入力の画素数（1フレーム）, 'frames': 統計に使ったフレーム数}
+    """
+    import tempfile
+
+    import numpy as np
+
+    key = params_digest({
+        'video': file_digest(video_path),
+        'start': start_time, 'end': end_time,
+        'width': ANALYSIS_WIDTH, 'fps': ANALYSIS_FPS, 'seconds': ANALYSIS_SECONDS,
+        'probe': [PROBE_PRESET, PROBE_CRF],
+    })
+    cached = load_json('complexity', key)
+    if cached is not None:
+        return cached
+
+    info = probe_video(video_path)
+    start = start_time or 0.0
+    end = end_time if end_time is not None else info['duration']
+    width = min(ANALYSIS_WIDTH, info['width'] // 2 * 2)
+    height = max(2, int(round(width * info['height'] / info['width'] / 2)) * 2)
+    # 長い動画は等間隔の区間だけを読む（入力シークなので先頭からデコードしない）
+    if end - start > ANALYSIS_SECONDS:
+        length = ANALYSIS_SECONDS / ANALYSIS_SEGMENTS
+        step = (end - start - length) / (ANALYSIS_SEGMENTS - 1)
+        ranges = [(start + i * step, length) for i in range(ANALYSIS_SEGMENTS)]
+    else:
+        ranges = [(start, max(end - start, 1.0 / ANALYSIS_FPS))]
+
+    spatial, flat, diffs = [], [], []
+    probe_bits = 0
+    fd, probe_path = tempfile.mkstemp(suffix='_probe.h264')
+    os.close(fd)
+    try:
+        for range_start, length in ranges:
+            range_spatial, range_flat, range_diffs = _analyse_range(
+                video_path, width, height, range_start, length, probe_path
+            )
+            spatial.extend(range_spatial)
+            flat.extend(range_flat)
+            diffs.extend(range_diffs)
+            probe_bits += os.path.getsize(probe_path) * 8
+    finally:
+        os.unlink(probe_path)
+    if not spatial:
+        raise Exception(f"動画の解析に失敗しました（フレームを読み出せません）: {video_path}")
+
+    analysed_seconds = sum(length for _, length in ranges)
+    probe_frames = max(1.0, analysed_seconds * (info['fps'] or 30.0))
+    diffs = np.array(diffs or [0.0])
+    result = {
+        'spatial': round(float(np.mean(spatial)), 3),
+        'temporal': round(float(np.mean(diffs)), 3),
+        'scene_changes': round(float((diffs > SCENE_CHANGE_DIFF).sum()) * 60.0 / analysed_seconds, 2),
+        'static_ratio': round(float((diffs < STATIC_DIFF).mean()), 3),
+        'flat_ratio': round(float(np.mean(flat)), 3),
+        'probe_bpp': round(probe_bits / (width * height * probe_frames), 5),
+        'probe_pixels': width * height,
+        'source_pixels': info['width'] * info['height'],
+        'frames': len(spatial),
+    }
+    save_json('complexity', key, result)
+    return result
+
+
+def merge_complexity(items):
+    """複数の動画の解析結果を長さで重み付けして平均（動画結合用）
+
+    items: [(解析結果, 長さ（秒）), ...]
+    """
+    total = sum(max(duration, 0.0) for _, duration in items) or 1.0
+    merged = {
+        name: round(sum(result[name] * max(duration, 0.0) for result, duration in items) / total, 5)
+        for name in ('spatial', 'temporal', 'scene_changes', 'static_ratio', 'flat_ratio', 'probe_bpp')
+    }
+    merged['probe_pixels'] = min(result['probe_pixels'] for result, _ in items)
+    merged['source_pixels'] = min(result['source_pixels'] for result, _ in items)
+    merged['frames'] = sum(result['frames'] for result, _ in items)
+    return merged
+
+
+def _score(complexity):
+    """複雑さを 0（静止・単純）〜 1（動きが多く細かい）にまとめる
+
+    試しエンコードのビット数（0.02 bpp → 0、2 bpp → 1 の対数）を主に、シーンチェンジの多さを加える
+    """
+    import math
+
+    bits = math.log(max(complexity['probe_bpp'], 0.02) / 0.02) / math.log(100)
+    cuts = complexity['scene_changes'] / 60.0
+    return round(min(1.0, 0.85 * min(1.0, bits) + 0.15 * min(1.0, cuts)), 3)
+
+
+def choose_tune(complexity):
+    if complexity['static_ratio'] >= 0.8:
+        return 'stillimage'
+    if complexity['flat_ratio'] >= 0.6 and complexity['spatial'] >= 8.0:
+        return 'animation'
+    return 'film'
+
+
+def predict_bitrate(complexity, crf, pixels, fps):
+    """予測ビットレート（kbps、映像のみ）
+
+    pixels: 1フレームのうち実際に映像が映っている画素数（余白の黒帯はほとんどビットを使わないため除く）
+    """
+    # 拡大しても細部は増えないため、入力より大きい分は数えない
+    pixels = min(pixels, complexity['source_pixels'])
+    bpp = complexity['probe_bpp'] * (pixels / complexity['probe_pixels']) ** BPP_SCALE_EXPONENT
+    bits = bpp * pixels * fps * 2 ** ((PROBE_CRF - crf) / CRF_DOUBLING)
+    return int(round(bits / 1000))
+
+
+def choose_encoding(complexity, pixels, fps, quality=DEFAULT_QUALITY):
+    """解析結果と出力の画素数（predict_bitrate と同じ）からエンコード設定を決める
+
+    戻り値: {'crf', 'preset', 'tune', 'maxrate', 'bufsize', 'predicted_kbps', 'quality', 'score'}
+    """
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"不明な画質です: {quality}（{', '.join(QUALITY_PRESETS)} のいずれかを指定してください）")
+    bounds = QUALITY_PRESETS[quality]
+    score = _score(complexity)
+    crf = round(bounds['crf_max'] - (bounds['crf_max'] - bounds['crf_min']) * score)
+    predicted = predict_bitrate(complexity, crf, pixels, fps)
+    maxrate = max(MIN_MAXRATE_KBPS, int(predicted * (MAXRATE_HEADROOM + score)))
+    return {
+        'crf': crf,
+        'preset': bounds['preset'],
+        'tune': choose_tune(complexity),
+        'maxrate': f"{maxrate}k",
+        'bufsize': f"{maxrate * 2}k",
+        'predicted_kbps': predicted,
+        'quality': quality,
+        'score': score,
+    }
+
+
+def plan_encoding(video_paths, pixels, fps, quality=DEFAULT_QUALITY, start_time=None, end_time=None):
+    """入力動画を解析してエンコード設定を決める（quality が None なら DEFAULT_ENCODING）
+
+    video_paths: 動画のパス（動画結合ではリスト）。start_time / end_time は1本の場合のみ使用
+    """
+    if quality is None:
+        return dict(DEFAULT_ENCODING)
+    if isinstance(video_paths, (str, os.PathLike)):
+        complexity = analyse_complexity(video_paths, start_time, end_time)
+    else:
+        complexity = merge_complexity([
+            (analyse_complexity(path), probe_video(path)['duration']) for path in video_paths
+        ])
+    return dict(choose_encoding(complexity, pixels, fps, quality), complexity=complexity)
+
+
+def x264_args(encoding=None):
+    """libx264 のエンコード引数（-c:v から -pix_fmt まで）"""
+    encoding = encoding or DEFAULT_ENCODING
+    args = ['-c:v', 'libx264', '-preset', encoding['preset'], '-crf', str(encoding['crf'])]
+    if encoding.get('tune'):
+        args.extend(['-tune', encoding['tune']])
+    if encoding.get('maxrate'):
+        args.extend(['-maxrate', encoding['maxrate'], '-bufsize', encoding['bufsize']])
+    args.extend(['-pix_fmt', 'yuv420p'])
+    return args
+
+
+def moviepy_params(encoding=None):
+    """MoviePy の write_videofile に渡す ffmpeg_params（codec='libx264' と併用）
+
+    -c:v と -pix_fmt は MoviePy が付けるため除く（-preset は ffmpeg_params のほうが後ろに付き優先される）
+    """
+    return x264_args(encoding)[2:-2]
+
+
+def measure_bitrate(video_path):
+    """映像ストリームの実際のビットレート（kbps）"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=bit_rate:format=duration,size', '-of', 'default=noprint_wrappers=1', video_path
+    ]
+    try:
+        result = supervisor.run(cmd, stage='probe', check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"ビットレートの取得に失敗しました: {e.stderr}")
+    values = dict(line.split('=', 1) for line in result.stdout.splitlines() if '=' in line)
+    try:
+        return int(round(int(values['bit_rate']) / 1000))
+    except (KeyError, ValueError):
+        # ストリームのビットレートがない場合はファイル全体から計算
+        duration = float(values.get('duration') or 0)
+        return int(round(int(values.get('size') or 0) * 8 / 1000 / duration)) if duration else 0
+
+
+def bitrate_report(encoding, output_path):
+    """予測と実際のビットレートを比べる（encoding に予測がない場合は None）"""
+    if not encoding or 'predicted_kbps' not in encoding:
+        return None
+    actual = measure_bitrate(output_path)
+    predicted = encoding['predicted_kbps']
+    return {
+        'predicted_kbps': predicted,
+        'actual_kbps': actual,
+        'ratio': round(actual / predicted, 3) if predicted else None,
+        'crf': encoding['crf'],
+        'tune': encoding['tune'],
+        'maxrate': encoding['maxrate'],
+    }
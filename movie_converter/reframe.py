@@ -0,0 +1,203 @@
+"""被写体追跡によるオートリフレーム（横長動画 → 9:16）
+
+1. 間引き・縮小したフレームを1回のデコードで読み出し、OpenCVで
+   顔・動き・エッジ量（簡易サリエンシー）から注目位置を求める
+2. 注目位置の時系列を平滑化してクロップ窓の軌跡を作る
+3. 軌跡を ffmpeg の sendcmd スクリプトに変換し、crop フィルターの x/y を時間変化させる
+
+軌跡は入力ファイルの内容ハッシュと解析条件ごとにキャッシュし、再レンダリング時は解析を省きます。
+"""
+import os
+
+from .cache import file_digest, load_json, params_digest, save_json
+
+ANALYSIS_WIDTH = 320      # 解析用に縮小する幅（ピクセル）
+SAMPLE_FPS = 4            # 解析するフレームレート
+SMOOTHING_SECONDS = 1.0   # 軌跡の平滑化の強さ（ガウス窓の標準偏差）
+ANALYSIS_VERSION = 1      # 解析方法を変えたらキャッシュを無効にするために上げる
+
+# 注目位置の重み（顔が見つからない区間で使用）
+MOTION_WEIGHT = 0.6
+SALIENCY_WEIGHT = 0.4
+
+
+def _window_center(profile, window):
+    """列ごとの重み profile に対し、幅 window の窓内の合計が最大になる窓の中心（0〜1）"""
+    import numpy as np
+
+    total = profile.sum()
+    if total <= 0 or window >= len(profile):
+        return None
+    sums = np.convolve(profile, np.ones(window), mode='valid')
+    # 同じ値が続く場合は中央寄りの位置を選ぶ
+    best = np.flatnonzero(sums >= sums.max() * 0.999)
+    start = best[len(best) // 2]
+    return (start + window / 2) / len(profile)
+
+
+def _normalise(profile):
+    peak = profile.max()
+    return profile / peak if peak > 0 else profile
+
+
+def _smooth(values, sigma):
+    """NaN を補間してから、端を延長したガウス平滑化（位相ずれなし）"""
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.full_like(values, 0.5)
+    index = np.arange(len(values))
+    values = np.interp(index, index[valid], values[valid])
+    if sigma <= 0 or len(values) < 3:
+        return values
+    # 外れ値（顔の誤検出など）を抑えるため、先に移動中央値をかける
+    pad = 2
+    padded = np.pad(values, pad, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * pad + 1)
+    values = np.median(windows, axis=1)
+    radius = int(3 * sigma)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    return np.convolve(np.pad(values, radius, mode='edge'), kernel, mode='valid')
+
+
+def analyse_subject_path(video_path, start_time=None, end_time=None, crop_ratio=9 / 16,
+                         sample_fps=SAMPLE_FPS, analysis_width=ANALYSIS_WIDTH):
+    """注目位置の軌跡を解析する
+
+    戻り値: {'times': [...], 'x': [...], 'y': [...]}
+    times は元動画の時刻（秒）、x/y はクロップ窓中心の相対位置（0〜1）。
+    """
+    import cv2
+    import numpy as np
+
+    from .media import iter_frames, probe_video
+
+    info = probe_video(video_path)
+    analysis_height = max(2, int(round(analysis_width * info['height'] / info['width'] / 2)) * 2)
+    # 出力アスペクト比のクロップ窓の幅（解析解像度上）
+    window = max(1, int(round(analysis_height * crop_ratio)))
+
+    start = start_time or 0.0
+    duration = (end_time - start) if end_time is not None else None
+    cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    min_face = max(12, analysis_height // 12)
+
+    times, xs, ys = [], [], []
+    previous = None
+    for i, frame in enumerate(iter_frames(video_path, analysis_width, analysis_height, sample_fps, start_time, duration)):
+        times.append(start + i / sample_fps)
+        x = y = np.nan
+
+        faces = cascade.detectMultiScale(frame, scaleFactor=1.2, minNeighbors=5, minSize=(min_face, min_face))
+        if len(faces):
+            faces = np.asarray(faces, dtype=float)
+            areas = faces[:, 2] * faces[:, 3]
+            x = float(np.average(faces[:, 0] + faces[:, 2] / 2, weights=areas)) / analysis_width
+            y = float(np.average(faces[:, 1] + faces[:, 3] / 2, weights=areas)) / analysis_height
+        else:
+            # 顔がない区間: 動き（フレーム差分）とエッジ量の列プロファイルで窓位置を決める
+            gray = frame.astype(np.float32)
+            gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+            gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+            profile = SALIENCY_WEIGHT * _normalise(np.abs(gx).sum(axis=0) + np.abs(gy).sum(axis=0))
+            if previous is not None:
+                motion = cv2.absdiff(frame, previous)
+                motion[motion < 16] = 0
+                profile = profile + MOTION_WEIGHT * _normalise(motion.sum(axis=0, dtype=np.float64))
+            center = _window_center(profile, window)
+            if center is not None:
+                x = center
+        previous = frame
+        xs.append(x)
+        ys.append(y)
+
+    sigma = SMOOTHING_SECONDS * sample_fps
+    return {
+        'times': times,
+        'x': [round(float(v), 4) for v in _smooth(xs, sigma)] if times else [],
+        'y': [round(float(v), 4) for v in _smooth(ys, sigma)] if times else [],
+    }
+
+
+def get_subject_path(video_path, start_time=None, end_time=None, crop_ratio=9 / 16):
+    """注目位置の軌跡を取得（入力内容と解析条件が同じならキャッシュを使用）"""
+    key = params_digest({
+        'video': file_digest(video_path),
+        'start_time': start_time,
+        'end_time': end_time,
+        'crop_ratio': round(crop_ratio, 4),
+        'sample_fps': SAMPLE_FPS,
+        'analysis_width': ANALYSIS_WIDTH,
+        'version': ANALYSIS_VERSION,
+    })
+    path = load_json('reframe', key)
+    if path is None:
+        path = analyse_subject_path(video_path, start_time, end_time, crop_ratio)
+        save_json('reframe', key, path)
+    return path
+
+
+def write_crop_commands(path, command_path, source_width, source_height, crop_width, crop_height,
+                        fps, start_time=None, end_time=None):
+    """クロップ窓の軌跡を sendcmd スクリプトに書き出す（フレームごとに線形補間）
+
+    戻り値: crop フィルターの初期 (x, y)
+    """
+    import numpy as np
+
+    times = np.asarray(path['times'], dtype=float)
+    start = start_time or 0.0
+    end = end_time if end_time is not None else (times[-1] + 1.0 / SAMPLE_FPS if len(times) else start)
+    frame_times = np.arange(start, max(end, start + 1.0 / fps), 1.0 / fps)
+
+    if len(times):
+        centers_x = np.interp(frame_times, times, path['x'])
+        centers_y = np.interp(frame_times, times, path['y'])
+    else:
+        centers_x = centers_y = np.full(len(frame_times), 0.5)
+
+    max_x = source_width - crop_width
+    max_y = source_height - crop_height
+    xs = np.clip(np.round(centers_x * source_width - crop_width / 2), 0, max_x).astype(int)
+    ys = np.clip(np.round(centers_y * source_height - crop_height / 2), 0, max_y).astype(int)
+
+    with open(command_path, 'w') as f:
+        last = None
+        for t, x, y in zip(frame_times, xs, ys):
+            if (x, y) == last:
+                continue
+            f.write(f"{t:.4f} crop x {x}, crop y {y};\n")
+            last = (x, y)
+    return int(xs[0]), int(ys[0])
+
+
+def build_reframe_filter(video_path, command_path, target_width=1080, target_height=1920,
+                         scale_factor=1.0, start_time=None, end_time=None):
+    """オートリフレーム用のビデオフィルター文字列を作成
+
+    元動画が出力より縦長の場合は None を返します（通常のリサイズで十分なため）。
+    scale_factor > 1.0 の場合はクロップ窓を小さくしてズームインします。
+    """
+    from .media import probe_video
+
+    info = probe_video(video_path)
+    width, height = info['width'], info['height']
+    target_ratio = target_width / target_height
+    if width / height <= target_ratio:
+        return None
+
+    zoom = max(1.0, scale_factor)
+    crop_height = int(height / zoom) // 2 * 2
+    crop_width = int(crop_height * target_ratio) // 2 * 2
+
+    path = get_subject_path(video_path, start_time, end_time, target_ratio)
+    x, y = write_crop_commands(path, command_path, width, height, crop_width, crop_height,
+                               info['fps'], start_time, end_time)
+    return (
+        f"sendcmd=f='{command_path}',"
+        f"crop=w={crop_width}:h={crop_height}:x={x}:y={y},"
+        f"scale={target_width}:{target_height},setsar=1"
+    )
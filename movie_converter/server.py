@@ -0,0 +1,626 @@
+"""プログラムからジョブを投入するためのローカルHTTP API
+
+標準ライブラリのみで動作します。ジョブはプロセスプール（上限付き）で実行され、
+状態はジョブディレクトリの status.json に保存されます。
+
+    POST   /jobs              multipart/form-data でジョブを投入 → {"id": ...}
+                              - spec:   ジョブ仕様（JSON文字列、tool と各種パラメータ）
+                              - input:  入力ファイル（shorts / pptx）
+                              - inputs: 入力ファイル（combine、複数指定・指定順に結合）
+                              - bgm:    BGMファイル（shorts、任意。ライブラリの曲は spec の bgm_track にIDを指定）
+    GET    /jobs              ジョブ一覧
+    GET    /jobs/<id>         状態・進捗
+    GET    /jobs/<id>/result  出力動画をストリーミング
+    GET    /jobs/<id>/result/<name>
+                              追加サイズの出力（shorts で spec に "renditions" を指定した場合）
+    GET    /jobs/<id>/cover/<n>
+                              カバー画像の候補（shorts で spec に "covers": 候補数 を指定した場合、1 が最高点）
+    GET    /jobs/<id>/preview/index.m3u8
+                              プレビュー用HLS（spec で "preview": true を指定した場合）
+                              ショート動画・結合は最後のエンコード中から、パワポナレーション動画は
+                              できあがったスライドから順に再生できます
+    POST   /jobs/<id>/cancel  ジョブを取り消す（実行中の ffmpeg などの子プロセスもすぐに停止）
+    DELETE /jobs/<id>         ジョブと出力を削除
+    GET    /bgm               BGMライブラリの曲一覧（ID・名前・長さ・ラウドネス）
+    POST   /bgm               multipart/form-data の file（と任意の name）をライブラリに追加
+    DELETE /bgm/<id>          ライブラリから曲を削除
+    GET    /health            ヘルスチェック
+    GET    /metrics           メトリクス（Prometheusのテキスト形式、ワーカープロセスの値も合算）
+
+ワーカープロセスは優先度 'batch'（supervisor.PRIORITIES、既定: nice 10・ionice best-effort 7）で動くため、
+同じマシンのUIの処理が優先されます。
+
+VOICEVOXの接続先は VOICEVOX_URL 環境変数で指定できるため、
+負荷試験時はスタブサーバーを指定して実行できます。
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import bgm, metrics, supervisor
+from .cover import normalize_cover_count
+from .jobs import TOOLS
+
+CHUNK_SIZE = 1024 * 1024
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+# クライアントから指定させないキー（サーバー上の任意ファイルを読み書きさせないため）
+PATH_KEYS = ('input', 'inputs', 'output', 'bgm_path', 'preview_dir')
+PREVIEW_FILE_PATTERN = re.compile(r'^(index\.m3u8|init\.mp4|seg_\d{5}\.(ts|m4s))$')
+RENDITION_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+COVER_INDEX_PATTERN = re.compile(r'^[1-9][0-9]?$')
+FINISHED_STATES = ("done", "failed", "cancelled")
+CANCEL_FLAG = 'cancel'   # ジョブディレクトリにこのファイルがあれば取り消す（ワーカープロセスが確認する）
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return data
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _safe_filename(filename, default):
+    name = os.path.basename(filename or '').strip()
+    name = re.sub(r'[^\w.\-]', '_', name)
+    return name or default
+
+
+def _update_status(job_dir, **fields):
+    status_path = os.path.join(job_dir, 'status.json')
+    status = _read_json(status_path)
+    status.update(fields)
+    _write_json_atomic(status_path, status)
+    return status
+
+
+def write_job(job_dir, job_id, spec):
+    """ジョブの spec.json と待機中の status.json を書き出す"""
+    _write_json_atomic(os.path.join(job_dir, 'spec.json'), spec)
+    return _write_json_atomic(os.path.join(job_dir, 'status.json'), {
+        'id': job_id, 'tool': spec['tool'], 'state': "queued", 'progress': 0,
+        'message': "待機中", 'warnings': [], 'created': time.time(),
+    })
+
+
+def _resolve_spec(spec, job_dir):
+    """spec のパス（ジョブディレクトリからの相対パス）を絶対パスにする
+
+    共有スプールではノードごとにマウント先が異なるため、spec.json には相対パスで保存します。
+    """
+    spec = dict(spec)
+    for key in PATH_KEYS:
+        if key == 'inputs' and spec.get(key):
+            spec[key] = [os.path.join(job_dir, path) for path in spec[key]]
+        elif spec.get(key):
+            spec[key] = os.path.join(job_dir, spec[key])
+    return spec
+
+
+def run_job_in_dir(job_dir, metrics_dir=None, is_owner=None):
+    """ジョブディレクトリの spec.json を実行し、進捗を status.json に書き出す（ワーカープロセス内）
+
+    metrics_dir: 指定した場合、終了後にこのプロセスのメトリクスを書き出す（/metrics で合算）
+    is_owner: 共有スプールのワーカーが渡す。False を返したら（リースを失った）処理を取り消し、
+              以降の状態は書き込まない（戻り値は None）
+    """
+    from .jobs import run_job
+
+    spec = _resolve_spec(_read_json(os.path.join(job_dir, 'spec.json')), job_dir)
+    warnings = []
+    token = supervisor.CancelToken(flag_path=os.path.join(job_dir, CANCEL_FLAG), is_alive=is_owner)
+
+    def update(**fields):
+        if is_owner is None or is_owner():
+            return _update_status(job_dir, **fields)
+        return None
+
+    if token.cancelled:
+        # 待機中に取り消された
+        return update(state="cancelled", finished=time.time(), message="取り消されました")
+    update(state="running", started=time.time(), progress=0, message="処理を開始しました")
+
+    def progress(percent, message):
+        update(progress=percent, message=message)
+
+    def on_warning(message):
+        warnings.append(message)
+        update(warnings=warnings)
+
+    try:
+        with supervisor.supervise(token):
+            run_job(spec, progress=progress, on_warning=on_warning)
+    except supervisor.Cancelled:
+        return update(state="cancelled", finished=time.time(), message="取り消されました")
+    except Exception as e:
+        return update(state="failed", finished=time.time(), error=str(e))
+    finally:
+        if metrics_dir:
+            metrics.flush(metrics_dir)
+    return update(state="done", finished=time.time(), progress=100, message="完了")
+
+
+def _iter_multipart(rfile, content_length, boundary, open_sink):
+    """multipart/form-data をストリーミングで解析する
+
+    大きな動画をメモリに載せないよう、各パートは open_sink(name, filename) が返す
+    書き込み先へ逐次書き出します。(name, filename, sink) を順に返します。
+    """
+    remaining = content_length
+    buf = b''
+
+    def fill():
+        nonlocal remaining, buf
+        if remaining <= 0:
+            raise ValueError("multipartデータが途中で終了しています")
+        chunk = rfile.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ValueError("multipartデータが途中で終了しています")
+        remaining -= len(chunk)
+        buf += chunk
+
+    first = b'--' + boundary + b'\r\n'
+    while first not in buf:
+        fill()
+    buf = buf[buf.index(first) + len(first):]
+
+    delimiter = b'\r\n--' + boundary
+    keep = len(delimiter) + 4
+    while True:
+        while b'\r\n\r\n' not in buf:
+            fill()
+        header_block, buf = buf.split(b'\r\n\r\n', 1)
+        headers = {}
+        for line in header_block.decode('utf-8', 'replace').split('\r\n'):
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        disposition = headers.get('content-disposition', '')
+        name_match = re.search(r'\bname="([^"]*)"', disposition)
+        filename_match = re.search(r'\bfilename="([^"]*)"', disposition)
+        name = name_match.group(1) if name_match else ''
+        filename = filename_match.group(1) if filename_match else None
+
+        sink = open_sink(name, filename)
+        while True:
+            index = buf.find(delimiter)
+            if index >= 0:
+                sink.write(buf[:index])
+                buf = buf[index + len(delimiter):]
+                break
+            if len(buf) > keep:
+                sink.write(buf[:-keep])
+                buf = buf[-keep:]
+            fill()
+        yield name, filename, sink
+
+        # 区切りの直後が "--" なら終端、それ以外は行末までが区切り行
+        while len(buf) < 2:
+            fill()
+        if buf.startswith(b'--'):
+            return
+        while b'\r\n' not in buf:
+            fill()
+        buf = buf[buf.index(b'\r\n') + 2:]
+
+
+class JobManager:
+    """ジョブディレクトリの作成とプロセスプールへの投入を管理
+
+    spool_dir を指定した場合はジョブを共有スプールに投入し、このプロセスでは実行しません
+    （別のノードの `python -m movie_converter worker` が処理します）。
+    """
+
+    def __init__(self, data_dir, workers=2, max_queue=100, priority='batch', spool_dir=None):
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.active = 0
+        self.spool_dir = spool_dir and os.path.abspath(spool_dir)
+        if self.spool_dir:
+            from . import spool
+
+            spool.init(self.spool_dir)
+            self.data_dir = os.path.join(self.spool_dir, spool.JOBS_DIR)
+            self.metrics_dir = os.path.join(self.spool_dir, spool.METRICS_DIR)
+            self.executor = None
+            metrics.register_collector(self._collect_metrics)
+            return
+        self.data_dir = os.path.abspath(data_dir)
+        # ワーカープロセス全体の優先度を下げる（MoviePy が起動する ffmpeg にも効く）
+        self.executor = ProcessPoolExecutor(
+            max_workers=max(1, workers), initializer=supervisor.set_process_priority, initargs=(priority,)
+        )
+        # ワーカープロセスのメトリクス（前回起動時の値は使わない）
+        self.metrics_dir = os.path.join(self.data_dir, 'metrics')
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._recover()
+        metrics.register_collector(self._collect_metrics)
+
+    def _queued(self):
+        if self.spool_dir:
+            from . import spool
+
+            return spool.queue_length(self.spool_dir)
+        return self.active
+
+    def _collect_metrics(self):
+        return [('queue_depth', {'queue': "spool" if self.spool_dir else "api"}, self._queued())]
+
+    def _recover(self):
+        """前回のサーバー停止で中断されたジョブを失敗扱いにする"""
+        for job_id in os.listdir(self.data_dir):
+            job_dir = os.path.join(self.data_dir, job_id)
+            status_path = os.path.join(job_dir, 'status.json')
+            if not os.path.exists(status_path):
+                continue
+            if _read_json(status_path).get('state') not in FINISHED_STATES:
+                _update_status(job_dir, state="failed", finished=time.time(), error="サーバーの再起動により中断されました")
+
+    def job_dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        job_dir = os.path.join(self.data_dir, job_id)
+        return job_dir if os.path.isdir(job_dir) else None
+
+    def status(self, job_id):
+        job_dir = self.job_dir(job_id)
+        status_path = os.path.join(job_dir, 'status.json') if job_dir else None
+        if status_path is None or not os.path.exists(status_path):
+            # 存在しないジョブ、またはアップロード受信中
+            return None
+        return _read_json(status_path)
+
+    def list(self):
+        statuses = []
+        for job_id in os.listdir(self.data_dir):
+            status = self.status(job_id)
+            if status is not None:
+                statuses.append(status)
+        return sorted(statuses, key=lambda s: s['created'])
+
+    def create(self):
+        """新しいジョブディレクトリを作成し (job_id, job_dir) を返す"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.data_dir, job_id)
+        os.makedirs(os.path.join(job_dir, 'inputs'))
+        return job_id, job_dir
+
+    def submit(self, job_id, job_dir, spec):
+        if self.spool_dir:
+            from . import spool
+
+            if self._queued() >= self.max_queue:
+                return False
+            write_job(job_dir, job_id, spec)
+            spool.enqueue(self.spool_dir, job_id)
+            return True
+        with self.lock:
+            if self.active >= self.max_queue:
+                return False
+            self.active += 1
+        write_job(job_dir, job_id, spec)
+        future = self.executor.submit(run_job_in_dir, job_dir, self.metrics_dir)
+        future.add_done_callback(lambda f: self._finished(job_dir, f))
+        return True
+
+    def _finished(self, job_dir, future):
+        with self.lock:
+            self.active -= 1
+        try:
+            future.result()
+        except Exception as e:
+            # ワーカープロセス自体が異常終了した場合
+            _update_status(job_dir, state="failed", finished=time.time(), error=str(e))
+
+    def cancel(self, job_id):
+        """取り消しを要求する（存在しなければ None、終了済みなら False）"""
+        status = self.status(job_id)
+        if status is None:
+            return None
+        if status['state'] in FINISHED_STATES:
+            return False
+        supervisor.CancelToken(flag_path=os.path.join(self.data_dir, job_id, CANCEL_FLAG)).cancel()
+        return True
+
+    def delete(self, job_id):
+        status = self.status(job_id)
+        if status is None:
+            return None
+        if status['state'] not in FINISHED_STATES:
+            return False
+        shutil.rmtree(os.path.join(self.data_dir, job_id), ignore_errors=True)
+        return True
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    manager = None  # make_server で設定
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_json(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def _route(self):
+        parts = [p for p in self.path.split('?', 1)[0].split('/') if p]
+        return parts
+
+    def do_GET(self):
+        parts = self._route()
+        if parts == ['health']:
+            return self._send_json(HTTPStatus.OK, {'status': "ok"})
+        if parts == ['jobs']:
+            return self._send_json(HTTPStatus.OK, {'jobs': self.manager.list()})
+        if parts == ['bgm']:
+            return self._send_json(HTTPStatus.OK, {'tracks': bgm.list_tracks()})
+        if parts == ['metrics']:
+            return self._send_metrics()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            status = self.manager.status(parts[1])
+            if status is None:
+                return self._send_error_json(HTTPStatus.NOT_FOUND, "ジョブが見つかりません")
+            return self._send_json(HTTPStatus.OK, status)
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+            return self._send_result(parts[1])
+        if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'result':
+            return self._send_result(parts[1], parts[3])
+        if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'preview':
+            return self._send_preview(parts[1], parts[3])
+        if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'cover':
+            return self._send_cover(parts[1], parts[3])
+        return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+
+    def _send_metrics(self):
+        body = metrics.render(self.manager.metrics_dir).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_result(self, job_id, rendition=None):
+        status = self.manager.status(job_id)
+        if status is None:
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "ジョブが見つかりません")
+        if status['state'] != "done":
+            return self._send_error_json(HTTPStatus.CONFLICT, f"ジョブは完了していません（状態: {status['state']}）")
+        name = 'result.mp4'
+        filename = f"{status['tool']}_{job_id}.mp4"
+        if rendition is not None:
+            if not RENDITION_NAME_PATTERN.match(rendition):
+                return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+            name = f"result_{rendition}.mp4"
+            filename = f"{status['tool']}_{job_id}_{rendition}.mp4"
+        result_path = os.path.join(self.manager.job_dir(job_id), name)
+        if not os.path.isfile(result_path):
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "出力が見つかりません")
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(os.path.getsize(result_path)))
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.end_headers()
+        with open(result_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _send_cover(self, job_id, index):
+        status = self.manager.status(job_id)
+        if status is None or not COVER_INDEX_PATTERN.match(index):
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+        if status['state'] != "done":
+            return self._send_error_json(HTTPStatus.CONFLICT, f"ジョブは完了していません（状態: {status['state']}）")
+        path = os.path.join(self.manager.job_dir(job_id), f"result_cover{index}.jpg")
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "カバー画像が見つかりません")
+        with f:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Content-Disposition', f'attachment; filename="{status["tool"]}_{job_id}_cover{index}.jpg"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _send_preview(self, job_id, name):
+        job_dir = self.manager.job_dir(job_id)
+        if job_dir is None or not PREVIEW_FILE_PATTERN.match(name):
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+        path = os.path.join(job_dir, 'preview', name)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "プレビューはまだありません")
+        with f:
+            self.send_response(HTTPStatus.OK)
+            if name.endswith('.m3u8'):
+                self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+                # 処理中はプレイリストが更新されるためキャッシュさせない
+                self.send_header('Cache-Control', 'no-cache')
+            elif name.endswith('.ts'):
+                self.send_header('Content-Type', 'video/mp2t')
+            else:
+                # ショート動画・結合のエンコード中に書き出すfMP4セグメント
+                self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def do_DELETE(self):
+        parts = self._route()
+        if len(parts) == 2 and parts[0] == 'bgm':
+            try:
+                removed = bgm.remove_track(parts[1])
+            except ValueError:
+                removed = False
+            if not removed:
+                return self._send_error_json(HTTPStatus.NOT_FOUND, "BGMが見つかりません")
+            return self._send_json(HTTPStatus.OK, {'id': parts[1], 'deleted': True})
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+        deleted = self.manager.delete(parts[1])
+        if deleted is None:
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "ジョブが見つかりません")
+        if not deleted:
+            return self._send_error_json(HTTPStatus.CONFLICT, "実行中のジョブは削除できません（先に取り消してください）")
+        return self._send_json(HTTPStatus.OK, {'id': parts[1], 'deleted': True})
+
+    def do_POST(self):
+        route = self._route()
+        if len(route) == 3 and route[0] == 'jobs' and route[2] == 'cancel':
+            return self._cancel_job(route[1])
+        if route not in (['jobs'], ['bgm']):
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "見つかりません")
+        content_type = self.headers.get('Content-Type', '')
+        boundary_match = re.search(r'boundary="?([^";]+)"?', content_type)
+        if not content_type.startswith('multipart/form-data') or not boundary_match:
+            return self._send_error_json(HTTPStatus.BAD_REQUEST, "multipart/form-data で送信してください")
+        if route == ['bgm']:
+            return self._add_bgm(boundary_match.group(1).encode('latin-1'))
+
+        job_id, job_dir = self.manager.create()
+        try:
+            spec, files = self._read_upload(job_dir, boundary_match.group(1).encode('latin-1'))
+            spec = self._build_spec(spec, files, job_dir)
+        except ValueError as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return self._send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+
+        if not self.manager.submit(job_id, job_dir, spec):
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return self._send_error_json(HTTPStatus.SERVICE_UNAVAILABLE, "ジョブキューが満杯です。しばらくしてから再送してください")
+        response = {'id': job_id, 'status_url': f"/jobs/{job_id}", 'result_url': f"/jobs/{job_id}/result"}
+        if spec.get('preview_dir'):
+            response['preview_url'] = f"/jobs/{job_id}/preview/index.m3u8"
+        if spec.get('covers'):
+            response['cover_urls'] = [f"/jobs/{job_id}/cover/{i}" for i in range(1, spec['covers'] + 1)]
+        return self._send_json(HTTPStatus.ACCEPTED, response)
+
+    def _cancel_job(self, job_id):
+        cancelled = self.manager.cancel(job_id)
+        if cancelled is None:
+            return self._send_error_json(HTTPStatus.NOT_FOUND, "ジョブが見つかりません")
+        if not cancelled:
+            return self._send_error_json(HTTPStatus.CONFLICT, "ジョブは終了しています")
+        return self._send_json(HTTPStatus.ACCEPTED, {'id': job_id, 'cancel_requested': True})
+
+    def _add_bgm(self, boundary):
+        import tempfile
+
+        upload_dir = tempfile.mkdtemp(prefix='bgm_upload_', dir=self.manager.data_dir)
+        os.makedirs(os.path.join(upload_dir, 'inputs'))
+        try:
+            fields, files = self._read_upload(upload_dir, boundary, field_names=('name',))
+            if len(files.get('file', [])) != 1:
+                return self._send_error_json(HTTPStatus.BAD_REQUEST, "file を1つ指定してください")
+            try:
+                track = bgm.add_track(files['file'][0], fields.get('name') or None)
+            except Exception as e:
+                return self._send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return self._send_json(HTTPStatus.CREATED, track)
+        except ValueError as e:
+            return self._send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def _read_upload(self, job_dir, boundary, field_names=()):
+        """multipart を読み、ファイルは job_dir/inputs に保存する
+
+        field_names を指定した場合は spec の代わりに、それらのテキスト項目を dict で返す
+        """
+        import io
+
+        content_length = int(self.headers.get('Content-Length') or 0)
+        spec_buffer = io.BytesIO()
+        field_buffers = {name: io.BytesIO() for name in field_names}
+        files = {}
+
+        def open_sink(name, filename):
+            if filename is None:
+                if name in field_buffers:
+                    return field_buffers[name]
+                return spec_buffer if name == 'spec' else io.BytesIO()
+            index = sum(len(paths) for paths in files.values())
+            path = os.path.join(job_dir, 'inputs', f"{index:03d}_{_safe_filename(filename, name)}")
+            files.setdefault(name, []).append(path)
+            return open(path, 'wb')
+
+        for name, filename, sink in _iter_multipart(self.rfile, content_length, boundary, open_sink):
+            if filename is not None:
+                sink.close()
+
+        if field_names:
+            return {name: buffer.getvalue().decode('utf-8') for name, buffer in field_buffers.items()}, files
+        try:
+            spec = json.loads(spec_buffer.getvalue().decode('utf-8') or '{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f"spec がJSONとして解析できません: {e}")
+        if not isinstance(spec, dict):
+            raise ValueError("spec はJSONオブジェクトで指定してください")
+        return spec, files
+
+    def _build_spec(self, spec, files, job_dir):
+        """クライアントの spec にファイルのパス（ジョブディレクトリからの相対パス）を設定する"""
+        files = {name: [os.path.relpath(path, job_dir) for path in paths] for name, paths in files.items()}
+        spec = {k: v for k, v in spec.items() if k not in PATH_KEYS}
+        tool = spec.setdefault('tool', 'shorts')
+        if tool not in TOOLS:
+            raise ValueError(f"不明なツールです: {tool}（{', '.join(TOOLS)} のいずれかを指定してください）")
+        if tool == "combine":
+            if len(files.get('inputs', [])) < 2:
+                raise ValueError("combine には inputs を2つ以上指定してください")
+            spec['inputs'] = files['inputs']
+        else:
+            if len(files.get('input', [])) != 1:
+                raise ValueError("input ファイルを1つ指定してください")
+            spec['input'] = files['input'][0]
+        voices = spec.get('voices') or []
+        if not isinstance(voices, list) or not all(isinstance(voice, dict) for voice in voices):
+            raise ValueError("voices はオブジェクトのリストで指定してください")
+        if any('path' in voice for voice in voices):
+            raise ValueError("voices にファイルのパスは指定できません（text・start_time・volume を指定してください）")
+        if tool == "shorts" and files.get('bgm'):
+            spec['bgm_path'] = files['bgm'][0]
+        if spec.get('bgm_track'):
+            bgm.get_track(spec['bgm_track'])   # 不正なID・存在しない曲は ValueError（400）
+        if spec.get('covers'):
+            normalize_cover_count(spec['covers'])   # 候補数が不正なら ValueError（400）
+        spec['output'] = 'result.mp4'
+        if spec.pop('preview', False):
+            spec['preview_dir'] = 'preview'
+        return spec
+
+    def log_message(self, format, *args):
+        print(f"API: {self.address_string()} {format % args}", flush=True)
+
+
+def make_server(host, port, data_dir, workers=2, max_queue=100, priority='batch', spool_dir=None):
+    """HTTPサーバーを作成（serve_forever() で起動）
+
+    spool_dir: 共有スプールに投入する（ジョブは `python -m movie_converter worker` が処理）
+    """
+    manager = JobManager(data_dir, workers, max_queue, priority, spool_dir)
+    handler = type('BoundJobRequestHandler', (JobRequestHandler,), {'manager': manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.manager = manager
+    return server
@@ -0,0 +1,644 @@
+"""ショート動画変換の処理（リサイズ・テロップ・音声・BGM）
+
+moviepy・Pillow・NumPy は各関数の中で読み込みます（モジュールのimportを軽量に保つため）。
+"""
+import os
+import time
+
+from . import chunked, metrics, supervisor
+from .media import FASTSTART_ARGS, probe_video
+from .preview import output_args
+from .ratecontrol import moviepy_params, x264_args
+from .voicevox import generate_voice_with_voicevox
+
+# テロップの左右の余白（ピクセル）
+TELOP_MARGIN = 40
+
+# YouTubeショートの推奨解像度: 1080x1920 (9:16)
+SHORTS_WIDTH = 1080
+SHORTS_HEIGHT = 1920
+
+# BGMのループで保持する最大サンプル数（aloop の size の上限。実際は曲の長さ分だけ使う）
+LOOP_MAX_SAMPLES = 2**31 - 1
+
+# 追加の出力サイズ（レンディション）のプリセット
+# 各項目: width, height, codec, crf, maxrate（上限ビットレート）, preset, audio_bitrate
+RENDITION_PRESETS = {
+    '720p': {'width': 720, 'height': 1280, 'crf': 23, 'maxrate': '3000k'},
+    'preview': {'width': 360, 'height': 640, 'crf': 28, 'maxrate': '800k', 'preset': 'veryfast', 'audio_bitrate': '64k'},
+}
+RENDITION_DEFAULTS = {'codec': 'libx264', 'crf': 23, 'maxrate': None, 'preset': 'medium', 'audio_bitrate': '128k'}
+
+
+def normalize_renditions(renditions):
+    """レンディション指定（プリセット名または dict）を dict のリストにそろえる"""
+    normalized = []
+    for rendition in renditions or []:
+        if isinstance(rendition, str):
+            if rendition not in RENDITION_PRESETS:
+                raise ValueError(f"不明なレンディションです: {rendition}（{', '.join(RENDITION_PRESETS)} または dict で指定してください）")
+            rendition = dict(RENDITION_PRESETS[rendition], name=rendition)
+        rendition = dict(RENDITION_DEFAULTS, **rendition)
+        if not rendition.get('name') or not rendition.get('width') or not rendition.get('height'):
+            raise ValueError("レンディションには name・width・height を指定してください")
+        rendition['name'] = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in str(rendition['name']))
+        normalized.append(rendition)
+    return normalized
+
+
+def rendition_path(output_path, name):
+    """レンディションの出力パス（出力ファイル名の末尾に _<name> を付ける）"""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_{name}{ext or '.mp4'}"
+
+
+def _rendition_encode_args(rendition):
+    args = ['-c:v', rendition['codec'], '-preset', rendition['preset'], '-crf', str(rendition['crf'])]
+    if rendition.get('maxrate'):
+        # CRFの品質を保ちつつ、ビットレートの上限を設ける
+        maxrate = str(rendition['maxrate'])
+        bufsize = f"{int(maxrate.rstrip('kK')) * 2}k" if maxrate.lower().endswith('k') else maxrate
+        args.extend(['-maxrate', maxrate, '-bufsize', bufsize])
+    if rendition['codec'] in ('libx265', 'hevc'):
+        args.extend(['-tag:v', 'hvc1'])  # Safari で再生できるように
+    args.extend(['-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', str(rendition['audio_bitrate']), *FASTSTART_ARGS])
+    return args
+
+
+def _split_filter(base_filter, count):
+    """1回のデコード結果を split で count 系統に分ける filter_complex（ラベル [out0]…）"""
+    labels = ''.join(f'[out{i}]' for i in range(count))
+    return f"[0:v]{base_filter or 'null'},split={count}{labels}" if count > 1 else f"[0:v]{base_filter or 'null'}[out0]"
+
+
+def create_renditions(video_path, output_path, renditions):
+    """完成した動画から複数サイズの出力を作成（デコードは1回、split で各エンコーダーに分配）
+
+    戻り値: {レンディション名: 出力パス}
+    """
+    import subprocess
+
+    renditions = normalize_renditions(renditions)
+    if not renditions:
+        return {}
+    filters = [_split_filter(None, len(renditions))]
+    cmd = ['ffmpeg', '-i', video_path]
+    outputs = {}
+    for i, rendition in enumerate(renditions):
+        filters.append(f"[out{i}]scale={rendition['width']}:{rendition['height']},setsar=1[v{i}]")
+    cmd.extend(['-filter_complex', ';'.join(filters)])
+    for i, rendition in enumerate(renditions):
+        path = rendition_path(output_path, rendition['name'])
+        cmd.extend(['-map', f'[v{i}]', '-map', '0:a?', *_rendition_encode_args(rendition), '-y', path])
+        outputs[rendition['name']] = path
+    duration = probe_video(video_path)['duration']
+    started = time.monotonic()
+    try:
+        supervisor.run(cmd, stage='encode', duration=duration, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"レンディションの作成に失敗しました: {e.stderr.decode()}")
+    metrics.record_encode('renditions', duration, started)
+    return outputs
+
+
+def fit_to_shorts(original_width, original_height, scale_factor=1.0):
+    """ショートの枠（1080x1920）に収まるサイズに scale_factor を掛けたサイズ（枠からはみ出す場合もある）"""
+    original_ratio = original_width / original_height
+    target_ratio = SHORTS_WIDTH / SHORTS_HEIGHT
+
+    # 基本スケール計算（ターゲット枠に収まるサイズ）
+    if original_ratio > target_ratio:
+        # 横長の場合、幅をターゲット幅に合わせる
+        base_width = SHORTS_WIDTH
+        base_height = int(SHORTS_WIDTH / original_ratio)
+    else:
+        # 縦長の場合、高さをターゲット高さに合わせる
+        base_height = SHORTS_HEIGHT
+        base_width = int(SHORTS_HEIGHT * original_ratio)
+
+    # scale_factorを適用（拡大倍率による調整）
+    # 拡大倍率が1.0より大きい場合、動画がターゲットフレームからはみ出すのは正常
+    # パディングエラーを避けるため、最小サイズは1ピクセル以上を保証
+    return max(1, int(base_width * scale_factor)), max(1, int(base_height * scale_factor))
+
+
+def shorts_picture_size(original_width, original_height, scale_factor=1.0, keep_original_size=False, reframe=False):
+    """リサイズ後に映像が映っている部分のサイズ（余白の黒帯を除く。ビットレートの予測に使う）"""
+    if keep_original_size:
+        return original_width, original_height
+    if reframe:
+        return SHORTS_WIDTH, SHORTS_HEIGHT
+    width, height = fit_to_shorts(original_width, original_height, scale_factor)
+    return min(width, SHORTS_WIDTH), min(height, SHORTS_HEIGHT)
+
+
+def resize_video_to_shorts(video_path, output_path, scale_factor=1.0, start_time=None, end_time=None, keep_original_size=False, reframe=False, renditions=None, encoding=None):
+    """動画をYouTubeショート形式(9:16)にリサイズ、または元のサイズを維持
+
+    reframe=True の場合、横長の動画は被写体（顔・動き）を追跡して9:16に切り抜きます。
+    renditions を指定すると、同じデコード結果を split で分けて追加サイズも同時に出力します
+    （出力先は rendition_path(output_path, name)）。
+    encoding: ratecontrol.plan_encoding のエンコード設定（None で ratecontrol.DEFAULT_ENCODING）
+    長い素材（chunked.CHUNKED_MIN_SECONDS 以上）はキーフレームで分割して並列にエンコードします
+    （オートリフレーム・レンディションを使う場合を除く）。
+    """
+    import subprocess
+    import tempfile
+    from moviepy import VideoFileClip
+    
+    # FFmpegコマンドで動画変換
+    ffmpeg_cmd = ['ffmpeg', '-i', video_path]
+    
+    # トリミングが指定されている場合（出力オプションのため、出力ごとに指定する）
+    trim_args = []
+    if start_time is not None and end_time is not None:
+        trim_args = ['-ss', str(start_time), '-t', str(end_time - start_time)]
+    renditions = normalize_renditions(renditions)
+    if not renditions:
+        ffmpeg_cmd.extend(trim_args)
+    vf = None
+
+    # オートリフレーム用の sendcmd スクリプト（終了後に削除）
+    command_path = None
+    reframe_vf = None
+    if reframe and not keep_original_size:
+        from .reframe import build_reframe_filter
+
+        fd, command_path = tempfile.mkstemp(suffix='_reframe.txt')
+        os.close(fd)
+        trim = start_time is not None and end_time is not None
+        reframe_vf = build_reframe_filter(
+            video_path, command_path, scale_factor=scale_factor,
+            start_time=start_time if trim else None, end_time=end_time if trim else None
+        )
+
+    if reframe_vf:
+        # 被写体を追跡するクロップ → 1080x1920
+        vf = reframe_vf
+    elif not keep_original_size:
+        # 元の動画情報を取得
+        clip = VideoFileClip(video_path)
+        original_width, original_height = clip.size
+        clip.close()
+
+        target_width = SHORTS_WIDTH
+        target_height = SHORTS_HEIGHT
+        final_width, final_height = fit_to_shorts(original_width, original_height, scale_factor)
+
+        # ビデオフィルターを構築
+        if scale_factor > 1.0:
+            # 拡大時：スケール→中央クロップ→パディング
+            vf = f'scale={final_width}:{final_height},crop={min(final_width, target_width)}:{min(final_height, target_height)},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black'
+        else:
+            # 縮小時：スケール→パディング
+            vf = f'scale={final_width}:{final_height},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2:black'
+
+    if renditions:
+        # 1回のデコード → split → [メイン出力, 各レンディション] のエンコーダー
+        filters = [_split_filter(vf, len(renditions) + 1)]
+        for i, rendition in enumerate(renditions, start=1):
+            filters.append(f"[out{i}]scale={rendition['width']}:{rendition['height']},setsar=1[v{i}]")
+        ffmpeg_cmd.extend(['-filter_complex', ';'.join(filters), '-map', '[out0]', '-map', '0:a?', *trim_args])
+    else:
+        # 出力を tee で分ける場合（preview.live_hls）に備えてストリームを明示する
+        ffmpeg_cmd.extend(['-map', '0:v:0', '-map', '0:a:0?'])
+        if vf:
+            ffmpeg_cmd.extend([
+                '-vf', vf
+            ])
+    
+    ffmpeg_cmd.extend([
+        *x264_args(encoding),
+        '-c:a', 'aac',
+        '-y',  # overwrite output file
+        *output_args(output_path)
+    ])
+    for i, rendition in enumerate(renditions, start=1):
+        ffmpeg_cmd.extend([
+            '-map', f'[v{i}]', '-map', '0:a?', *trim_args,
+            *_rendition_encode_args(rendition), '-y', rendition_path(output_path, rendition['name'])
+        ])
+    
+    try:
+        media_seconds = end_time - start_time if trim_args else probe_video(video_path)['duration']
+        if not renditions and not reframe_vf and media_seconds >= chunked.CHUNKED_MIN_SECONDS \
+                and chunked.encode_workers() > 1:
+            trim = start_time is not None and end_time is not None
+            if chunked.encode_chunked(video_path, output_path, vf, encoding,
+                                      start_time if trim else None, end_time if trim else None):
+                return output_path
+        started = time.monotonic()
+        supervisor.run(ffmpeg_cmd, stage='encode', duration=media_seconds, check=True, capture_output=True)
+        metrics.record_encode('resize', media_seconds, started)
+        return output_path
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"FFmpeg処理でエラーが発生しました: {e.stderr.decode()}")
+    except FileNotFoundError:
+        raise Exception("FFmpegが見つかりません。システムにFFmpegがインストールされていることを確認してください。")
+    finally:
+        if command_path and os.path.exists(command_path):
+            os.unlink(command_path)
+
+def add_multiple_voices_to_video(video_path, output_path, voices, original_volume=1.0, on_warning=None, voice_paths=None):
+    """動画に複数の音声を追加（FFmpeg直接実行版）
+
+    on_warning: 音声生成をスキップした際の通知先（UIでは st.warning を渡す）
+    voice_paths: {voices のインデックス: 合成済みのWAV}。指定された音声は合成せずにそのファイルを使います（削除はしません）。
+    """
+    
+    print(f"DEBUG: FFmpeg直接実行版で音声追加開始")
+    
+    temp_voice_files = []
+    try:
+        # VOICEVOX音声を生成
+        voice_files = []
+        for i, voice in enumerate(voices):
+            try:
+                voice_path = (voice_paths or {}).get(i)
+                if not voice_path:
+                    voice_path = generate_voice_with_voicevox(voice['text'])
+                    temp_voice_files.append(voice_path)
+                voice_files.append({
+                    'path': voice_path,
+                    'start_time': voice['start_time'],
+                    'volume': voice['volume']
+                })
+            except Exception as e:
+                message = f"⚠️ 音声「{voice['text'][:20]}...」の生成をスキップしました: {str(e)}"
+                if on_warning is not None:
+                    on_warning(message)
+                else:
+                    print(f"WARNING: {message}")
+                continue
+        
+        if not voice_files:
+            # 音声追加がない場合は元動画をそのままコピー
+            import shutil
+            shutil.copy2(video_path, output_path)
+            return output_path
+        
+        # FFmpegコマンドを構築（動画ストリームはコピー、音声のみ処理）
+        ffmpeg_cmd = ['ffmpeg', '-i', video_path, '-y']
+        
+        # 各音声ファイルを入力として追加
+        for voice_file in voice_files:
+            ffmpeg_cmd.extend(['-i', voice_file['path']])
+        
+        # フィルター構築（シンプルに音声をミックス）
+        if len(voice_files) == 1:
+            # 1つの音声のみ
+            voice = voice_files[0]
+            delay_ms = int(voice['start_time'] * 1000)  # ミリ秒に変換
+            if delay_ms > 0:
+                audio_filter = f'[1:a]volume={voice["volume"]},adelay={delay_ms}[voice];[0:a][voice]amix=inputs=2:duration=first[audio]'
+            else:
+                audio_filter = f'[1:a]volume={voice["volume"]}[voice];[0:a][voice]amix=inputs=2:duration=first[audio]'
+        else:
+            # 複数音声をミックス
+            voice_filters = []
+            for i, voice in enumerate(voice_files):
+                delay_ms = int(voice['start_time'] * 1000)  # ミリ秒に変換
+                if delay_ms > 0:
+                    voice_filters.append(f'[{i+1}:a]volume={voice["volume"]},adelay={delay_ms}[voice{i}]')
+                else:
+                    voice_filters.append(f'[{i+1}:a]volume={voice["volume"]}[voice{i}]')
+            
+            # 全音声をミックス
+            voice_labels = ''.join(f'[voice{i}]' for i in range(len(voice_files)))
+            audio_filter = ';'.join(voice_filters) + f';[0:a]{voice_labels}amix=inputs={len(voice_files)+1}:duration=first[audio]'
+        
+        # 動画ストリームはコピー、音声のみ処理
+        ffmpeg_cmd.extend([
+            '-filter_complex', audio_filter,
+            '-map', '0:v',  # 動画ストリームはそのままコピー
+            '-map', '[audio]',  # 処理された音声
+            '-c:v', 'copy',  # 動画は再エンコードしない（重要！）
+            '-c:a', 'aac',
+            *output_args(output_path)
+        ])
+        
+        print(f"DEBUG: FFmpeg実行: {' '.join(ffmpeg_cmd)}")
+        result = supervisor.run(ffmpeg_cmd, stage='audio', duration=probe_video(video_path)['duration'],
+                                capture_output=True, text=True)
+        
+        if result.returncode != 0:
+            print(f"DEBUG: FFmpeg エラー: {result.stderr}")
+            raise Exception(f"FFmpeg処理に失敗しました: {result.stderr}")
+        
+        print(f"DEBUG: FFmpeg成功")
+        
+    finally:
+        # 一時ファイル削除
+        for temp_file in temp_voice_files:
+            try:
+                os.unlink(temp_file)
+            except:
+                pass
+    
+    return output_path
+
+
+def add_bgm_to_video(video_path, output_path, bgm_path=None, bgm_volume=0.5, original_volume=1.0, loop_bgm=True, bgm_start_time=0.0, encoding=None, bgm_track=None):
+    """動画にBGMを追加（FFmpegを使用してより正確に）
+
+    bgm_track: BGMライブラリのトラックID（bgm_path の代わりに指定）。保存済みのPCMを読み、
+               ラウドネスをそろえるゲイン（bgm.track_gain）を掛けてから bgm_volume を適用する
+    encoding: ratecontrol.plan_encoding のエンコード設定（None で ratecontrol.DEFAULT_ENCODING）
+    """
+    import tempfile
+    from moviepy import VideoFileClip, AudioFileClip, CompositeAudioClip, concatenate_audioclips
+
+    from .bgm import CHANNELS, SAMPLE_RATE, ffmpeg_input_args, get_track, pcm_input_args
+    
+    print(f"DEBUG BGM: FFmpeg方式でBGM追加開始")
+    
+    # 元の動画の情報を取得
+    clip = VideoFileClip(video_path)
+    original_video_duration = clip.duration
+    original_fps = clip.fps
+    print(f"DEBUG BGM: 元の動画 - 長さ: {original_video_duration}秒, FPS: {original_fps}")
+    clip.close()
+    
+    track = get_track(bgm_track) if bgm_track else None
+    if track is not None or (bgm_path and os.path.exists(bgm_path)):
+        bed_path = None
+        try:
+            # FFmpegでBGMを追加
+            # 1) BGMを動画の長さにそろえた音声（ループ・開始時間・音量）をPCMで作る
+            #    ループは aloop フィルターで行う（-stream_loop は途中で出力を打ち切ると ffmpeg が
+            #    終了しないことがある）。ミックスと分けることで、各コマンドは入力の終わりで必ず終わる
+            if track is not None:
+                bgm_input = ffmpeg_input_args(track['id'])
+                volume = bgm_volume * 10 ** (track['gain'] / 20)
+            else:
+                bgm_input = ['-i', bgm_path]
+                volume = bgm_volume
+            bed_filter = f'aresample={SAMPLE_RATE}'
+            if loop_bgm:
+                bed_filter += f',aloop=loop=-1:size={LOOP_MAX_SAMPLES}'
+            bed_filter += f',atrim=0:{max(original_video_duration - bgm_start_time, 0.0):.3f}'
+            if bgm_start_time > 0.0:
+                delay_ms = int(bgm_start_time * 1000)
+                bed_filter += f',adelay={delay_ms}|{delay_ms}'
+            fd, bed_path = tempfile.mkstemp(suffix='_bgm.pcm')
+            os.close(fd)
+            bed_cmd = [
+                'ffmpeg', '-v', 'error', *bgm_input, '-vn', '-af', f'{bed_filter},volume={volume:.4f}',
+                '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS), '-y', bed_path
+            ]
+            result = supervisor.run(bed_cmd, stage='audio', duration=original_video_duration,
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise Exception(f"BGMの準備に失敗しました: {result.stderr[-1000:]}")
+
+            # 2) 動画と合成
+            ffmpeg_cmd = ['ffmpeg', '-i', video_path, *pcm_input_args(bed_path), '-y']
+            
+            # フィルター構築
+            filter_parts = []
+            
+            # 動画トラック
+            filter_parts.append('[0:v]copy[video]')
+            
+            # 元の音声がある場合はミックス
+            if probe_video(video_path)['has_audio']:
+                filter_parts.append(f'[0:a]volume={original_volume}[orig]')
+                filter_parts.append('[orig][1:a]amix=inputs=2:duration=first[audio]')
+            else:
+                filter_parts.append('[1:a]acopy[audio]')
+            
+            # フィルターグラフを完成
+            filter_complex = ';'.join(filter_parts)
+            ffmpeg_cmd.extend([
+                '-filter_complex', filter_complex,
+                '-map', '[video]',
+                '-map', '[audio]',
+                '-t', str(original_video_duration),
+                '-r', str(original_fps),
+                *x264_args(encoding),
+                '-c:a', 'aac',
+                *output_args(output_path)
+            ])
+            
+            print(f"DEBUG BGM: FFmpeg実行: {' '.join(ffmpeg_cmd)}")
+            result = supervisor.run(ffmpeg_cmd, stage='encode', duration=original_video_duration,
+                                    capture_output=True, text=True)
+            
+            if result.returncode == 0:
+                print(f"DEBUG BGM: FFmpeg成功")
+                return output_path
+            else:
+                print(f"DEBUG BGM: FFmpeg エラー: {result.stderr}")
+                if track is not None:
+                    raise Exception(f"BGMの追加に失敗しました: {result.stderr[-1000:]}")
+                # フォールバック処理へ続行
+                
+        except Exception as e:
+            # ライブラリのBGMは元のファイルを持たないため、フォールバックしない
+            if track is not None:
+                raise
+            print(f"DEBUG BGM: FFmpeg方式失敗: {str(e)}")
+            # フォールバック処理へ続行
+        finally:
+            if bed_path and os.path.exists(bed_path):
+                os.unlink(bed_path)
+        
+        # フォールバック：MoviePy方式
+        print("DEBUG BGM: MoviePyフォールバック方式を使用")
+        clip = VideoFileClip(video_path)
+        bgm = AudioFileClip(bgm_path)
+        
+        # BGMの音量を調整
+        bgm = bgm.with_fps(44100)
+        if bgm_volume != 1.0:
+            bgm = bgm.with_volume_scaled(bgm_volume)
+        
+        # BGMをループ再生するかどうか
+        if loop_bgm and bgm.duration < original_video_duration:
+            # BGMをループして動画の長さに合わせる
+            loops_needed = int(clip.duration / bgm.duration) + 1
+            try:
+                # ループ処理を行い、動画の長さに合わせてカット
+                bgm = bgm.audio_loop(n=loops_needed).subclipped(0, clip.duration)
+            except Exception as e:
+                # ループ処理に失敗した場合は、単純に繰り返し再生
+                bgm_list = []
+                current_duration = 0
+                while current_duration < clip.duration:
+                    remaining_duration = clip.duration - current_duration
+                    if remaining_duration >= bgm.duration:
+                        bgm_list.append(bgm)
+                        current_duration += bgm.duration
+                    else:
+                        bgm_list.append(bgm.subclipped(0, remaining_duration))
+                        current_duration += remaining_duration
+                
+                if bgm_list:
+                    bgm = concatenate_audioclips(bgm_list)
+                else:
+                    bgm = bgm.subclipped(0, min(bgm.duration, clip.duration))
+        else:
+            # BGMを動画の長さに合わせてカット
+            bgm = bgm.subclipped(0, min(bgm.duration, clip.duration))
+        
+        # BGMの開始時間を適用
+        if bgm_start_time > 0.0 and bgm_start_time < clip.duration:
+            # 無音の音声を作成してBGMの前に追加
+            silence_duration = min(bgm_start_time, clip.duration)
+            remaining_duration = clip.duration - silence_duration
+            
+            if remaining_duration > 0:
+                # BGMを残り時間に合わせてカット
+                bgm = bgm.subclipped(0, min(bgm.duration, remaining_duration))
+                # 無音とBGMを結合
+                bgm = bgm.with_start(bgm_start_time)
+            else:
+                # 開始時間が動画の長さを超えている場合は無音
+                bgm = None
+        
+        # 元の音声があるかチェック
+        if clip.audio is not None:
+            # 元の音声の音量を調整
+            original_audio = clip.audio
+            if original_volume != 1.0:
+                original_audio = original_audio.with_volume_scaled(original_volume)
+            # BGMと元の音声を合成
+            if bgm is not None:
+                final_audio = CompositeAudioClip([original_audio, bgm])
+            else:
+                final_audio = original_audio
+        else:
+            # 元の音声がない場合はBGMのみ
+            if bgm is not None:
+                final_audio = bgm
+            else:
+                final_audio = None
+        
+        # 動画に音声を設定（フレームレートを維持）
+        if final_audio is not None:
+            # 音声の長さを動画の長さに合わせる
+            if final_audio.duration > original_video_duration:
+                final_audio = final_audio.subclipped(0, original_video_duration)
+            elif final_audio.duration < original_video_duration:
+                final_audio = final_audio.with_duration(original_video_duration)
+            
+            # 重要：元の動画のFPSを保持
+            final_clip = clip.with_audio(final_audio).with_fps(original_fps)
+        else:
+            final_clip = clip.with_fps(original_fps)
+        
+        # 動画の長さを確実に設定
+        final_clip = final_clip.with_duration(original_video_duration)
+        
+        # 出力（元のFPSを明示的に指定）
+        final_clip.write_videofile(
+            output_path,
+            codec='libx264',
+            audio_codec='aac',
+            fps=original_fps,  # 重要：元のFPSを明示的に指定
+            ffmpeg_params=[*moviepy_params(encoding), *FASTSTART_ARGS]
+        )
+        
+        # リソースをクリーンアップ
+        clip.close()
+        bgm.close()
+        final_clip.close()
+        if clip.audio is not None:
+            original_audio.close()
+        final_audio.close()
+    else:
+        # BGMがない場合は元の動画をそのままコピー（FPSを保持）
+        clip = VideoFileClip(video_path)
+        final_clip = clip.with_fps(original_fps).with_duration(original_video_duration)
+        final_clip.write_videofile(
+            output_path,
+            codec='libx264',
+            audio_codec='aac',
+            fps=original_fps,
+            ffmpeg_params=[*moviepy_params(encoding), *FASTSTART_ARGS]
+        )
+        clip.close()
+        final_clip.close()
+    
+    return output_path
+
+def _layout_telop(draw, telop, font, frame_width, frame_height):
+    """テロップの描画位置を計算（フレーム幅に収まらない場合は禁則処理付きで折り返す）"""
+    from .textlayout import wrap_text
+
+    text = "\n".join(wrap_text(telop['text'], font, frame_width - TELOP_MARGIN * 2))
+
+    # テキストサイズを取得
+    bbox = draw.multiline_textbbox((0, 0), text, font=font, align='center')
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    # 位置を計算（中央寄りに調整）
+    position = telop['position']
+    x = (frame_width - text_width) // 2
+    if position == "top":
+        y = frame_height // 4 - text_height // 2  # 中央寄りの上
+    elif position == "bottom":
+        y = frame_height * 3 // 4 - text_height // 2  # 中央寄りの下
+    else:  # center
+        y = (frame_height - text_height) // 2
+    return text, x, y
+
+
+def add_text_to_video(video_path, output_path, telops, font_size=60, encoding=None):
+    """動画に時間ベースのテキストオーバーレイを追加
+
+    encoding: ratecontrol.plan_encoding のエンコード設定（None で ratecontrol.DEFAULT_ENCODING）
+    """
+    import numpy as np
+    from moviepy import VideoFileClip
+    from PIL import Image, ImageDraw
+
+    from .textlayout import load_font
+
+    clip = VideoFileClip(video_path)
+
+    # フォントとテロップのレイアウトはフレームごとではなく最初に一度だけ計算
+    font = load_font(font_size)
+    measure_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    layouts = [
+        (telop, *_layout_telop(measure_draw, telop, font, clip.w, clip.h))
+        for telop in telops
+        if telop['text']  # 空のテキストはスキップ
+    ]
+
+    def add_text_frame(get_frame, t):
+        # MoviePy のエンコード中も取り消しを確認する（例外で書き出しが止まり ffmpeg も閉じられる）
+        supervisor.check_cancelled()
+        frame = get_frame(t)
+        # numpy配列をPIL Imageに変換
+        img = Image.fromarray(frame.astype('uint8'))
+        draw = ImageDraw.Draw(img)
+
+        # 現在の時間に表示すべきテロップを描画
+        for telop, text, x, y in layouts:
+            # 時間範囲内かチェック
+            if telop['start_time'] <= t <= telop['end_time']:
+                # テロップの色設定（デフォルトは白）
+                text_color = telop.get('color', (255, 255, 255))
+
+                # テキストを描画（影付き）
+                draw.multiline_text((x+2, y+2), text, font=font, fill=(0, 0, 0), align='center')  # 影
+                draw.multiline_text((x, y), text, font=font, fill=text_color, align='center')  # テキスト
+
+        return np.array(img)
+    
+    # テキスト付きの動画を作成
+    final_video = clip.transform(add_text_frame)
+    
+    # 出力（高画質設定）
+    final_video.write_videofile(
+        output_path, 
+        codec='libx264', 
+        audio_codec='aac',
+        ffmpeg_params=[*moviepy_params(encoding), *FASTSTART_ARGS]
+    )
+    clip.close()
+    final_video.close()
+    
+    return output_path
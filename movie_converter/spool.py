@@ -0,0 +1,321 @@
+"""共有スプールによる分散ワーカー
+
+複数のノードで同じディレクトリ（NFS などの共有ボリューム）をマウントし、
+UI・ジョブAPIが投入したジョブを、任意の数のワーカー（`python -m movie_converter worker`）で処理します。
+
+    <スプール>/jobs/<ジョブID>/                 spec.json・status.json・inputs/・出力（ジョブAPIと同じ形式）
+    <スプール>/queue/<ジョブID>                 待機中のジョブ（空のファイル、作成順に処理）
+    <スプール>/running/<ジョブID>@<ワーカーID>  処理中のジョブ（ファイルの更新時刻がハートビート）
+    <スプール>/metrics/<ワーカーID>.json        ワーカーのメトリクス（ジョブAPIの /metrics で合算）
+
+- 取得: queue/ のファイルを running/ へ rename します。rename はアトミックなため、
+  同じジョブを同時に取りに行ったワーカーのうち1つだけが成功します
+- ハートビート: 処理中は HEARTBEAT_SECONDS ごとに running/ のファイルの更新時刻を更新します
+- リース: 更新時刻が LEASE_SECONDS より古いジョブ（ノードの停止など）は、他のワーカーが queue/ に戻して
+  再実行します（MAX_ATTEMPTS 回まで）。リースを失ったワーカーは処理を取り消し、状態を書き込みません
+- 取り消し: ジョブディレクトリの cancel ファイル（server.CANCEL_FLAG）をワーカーが確認します
+
+ノード間でファイルの更新時刻を比較するため、各ノードの時刻は NTP などで合わせてください。
+スプールの場所は MOVIE_CONVERTER_SPOOL_DIR で指定します。
+"""
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from . import metrics, supervisor
+from .server import CANCEL_FLAG, FINISHED_STATES, _read_json, _update_status, run_job_in_dir, write_job
+
+JOBS_DIR = 'jobs'
+QUEUE_DIR = 'queue'
+RUNNING_DIR = 'running'
+METRICS_DIR = 'metrics'
+
+POLL_SECONDS = 1.0          # 待機中のジョブ・ジョブの状態を確認する間隔
+HEARTBEAT_SECONDS = 10.0    # リースを更新する間隔
+LEASE_SECONDS = 60.0        # この時間ハートビートがなければワーカーが停止したとみなす
+MAX_ATTEMPTS = 3            # リースの期限切れで再実行する上限（ジョブの失敗は再実行しない）
+
+
+def get_spool_dir():
+    """MOVIE_CONVERTER_SPOOL_DIR（未設定なら None = このプロセスで実行）"""
+    return os.getenv('MOVIE_CONVERTER_SPOOL_DIR') or None
+
+
+def init(spool_dir):
+    for name in (JOBS_DIR, QUEUE_DIR, RUNNING_DIR, METRICS_DIR):
+        os.makedirs(os.path.join(spool_dir, name), exist_ok=True)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def enqueue(spool_dir, job_id):
+    """ジョブを待機列に追加する（jobs/<ジョブID> に spec.json・status.json を書いてから呼ぶ）"""
+    # 書きかけのファイルを取得されないよう、queue/ の外で作成してから移動する
+    tmp_path = os.path.join(spool_dir, JOBS_DIR, job_id, '.ticket')
+    with open(tmp_path, 'w'):
+        pass
+    os.replace(tmp_path, os.path.join(spool_dir, QUEUE_DIR, job_id))
+
+
+def queue_length(spool_dir):
+    return len(os.listdir(os.path.join(spool_dir, QUEUE_DIR)))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _heartbeat_time(path):
+    """最後のハートビートの時刻（rename でも ctime は更新されるため、取得した直後も新しい時刻になる）"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+class Lease:
+    """取得したジョブのリース（別スレッドでハートビートを送る）"""
+
+    def __init__(self, spool_dir, job_id, ticket_path):
+        self.spool_dir = spool_dir
+        self.job_id = job_id
+        self.ticket_path = ticket_path
+        self._lost = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name="spool-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        while not self._done.wait(HEARTBEAT_SECONDS):
+            try:
+                os.utime(self.ticket_path)
+            except FileNotFoundError:
+                # 期限切れで他のワーカーに戻された
+                self._lost.set()
+                return
+
+    @property
+    def held(self):
+        """リースが有効か（失っていれば処理を取り消す）"""
+        if not self._lost.is_set() and not os.path.exists(self.ticket_path):
+            self._lost.set()
+        return not self._lost.is_set()
+
+    def _stop(self):
+        self._done.set()
+        self._thread.join()
+
+    def release(self):
+        """処理を終えてリースを返す"""
+        self._stop()
+        try:
+            os.unlink(self.ticket_path)
+        except FileNotFoundError:
+            pass
+
+    def requeue(self):
+        """処理を中断して待機列に戻す（ワーカーの終了時。他のワーカーがすぐに再実行できる）"""
+        self._stop()
+        try:
+            os.replace(self.ticket_path, os.path.join(self.spool_dir, QUEUE_DIR, self.job_id))
+        except FileNotFoundError:
+            pass
+
+
+def claim(spool_dir, worker_id):
+    """待機中のジョブを作成順に1つ取得して Lease を返す（なければ None）"""
+    queue_dir = os.path.join(spool_dir, QUEUE_DIR)
+    tickets = []
+    for job_id in os.listdir(queue_dir):
+        mtime = _mtime(os.path.join(queue_dir, job_id))
+        if mtime is not None:
+            tickets.append((mtime, job_id))
+    for _, job_id in sorted(tickets):
+        ticket_path = os.path.join(spool_dir, RUNNING_DIR, f"{job_id}@{worker_id}")
+        try:
+            os.rename(os.path.join(queue_dir, job_id), ticket_path)
+        except FileNotFoundError:
+            continue   # 他のワーカーが先に取得した
+        # rename は更新時刻（mtime）を変えないため、取得した時刻からリースを数える
+        os.utime(ticket_path)
+        return Lease(spool_dir, job_id, ticket_path)
+    return None
+
+
+def reap(spool_dir, now=None):
+    """リースが切れたジョブを待機列に戻し、戻したジョブIDのリストを返す"""
+    running_dir = os.path.join(spool_dir, RUNNING_DIR)
+    now = time.time() if now is None else now
+    reaped = []
+    for name in os.listdir(running_dir):
+        heartbeat = _heartbeat_time(os.path.join(running_dir, name))
+        if heartbeat is None or now - heartbeat <= LEASE_SECONDS:
+            continue
+        job_id = name.split('@', 1)[0]
+        try:
+            # 同時に戻そうとしたワーカーのうち1つだけが成功する
+            os.rename(os.path.join(running_dir, name), os.path.join(spool_dir, QUEUE_DIR, job_id))
+        except FileNotFoundError:
+            continue
+        reaped.append(job_id)
+    return reaped
+
+
+def process(spool_dir, lease, worker_id):
+    """取得したジョブを実行し、終了後の状態を返す（リースを失った場合は None）"""
+    job_dir = os.path.join(spool_dir, JOBS_DIR, lease.job_id)
+    attempts = None
+    try:
+        status = _read_json(os.path.join(job_dir, 'status.json'))
+        if status.get('state') in FINISHED_STATES:
+            # 終了の書き込み後・リースを返す前にワーカーが停止した
+            lease.release()
+            return status
+        attempts = status.get('attempts', 0) + 1
+        if attempts > MAX_ATTEMPTS:
+            status = _update_status(job_dir, state="failed", finished=time.time(),
+                                    error=f"ワーカーの停止が続いたため中止しました（{MAX_ATTEMPTS}回）")
+            lease.release()
+            return status
+        _update_status(job_dir, attempts=attempts, worker=worker_id)
+        status = run_job_in_dir(job_dir, is_owner=lambda: lease.held)
+    except Exception as e:
+        status = _update_status(job_dir, state="failed", finished=time.time(), error=str(e)) if lease.held else None
+    except BaseException:
+        # ワーカーの終了（SIGTERM・Ctrl+C）。試行回数に数えずに待機列へ戻す
+        if lease.held:
+            if attempts is not None:
+                _update_status(job_dir, state="queued", attempts=attempts - 1,
+                               message="ワーカーの終了により再実行を待っています")
+            lease.requeue()
+        raise
+    lease.release()
+    return status
+
+
+def run_worker(spool_dir, worker_id=None, exit_when_idle=False, stop=None):
+    """スプールのジョブを1件ずつ処理し続ける（処理したジョブ数を返す）
+
+    exit_when_idle: 待機中・処理中のジョブがなくなったら終了する（テスト・一括処理用）
+    stop: threading.Event（設定されたら、処理中のジョブを終えてから終了する）
+    """
+    worker_id = worker_id or default_worker_id()
+    init(spool_dir)
+    metrics_dir = os.path.join(spool_dir, METRICS_DIR)
+    processed = 0
+    while stop is None or not stop.is_set():
+        reap(spool_dir)
+        lease = claim(spool_dir, worker_id)
+        if lease is None:
+            if exit_when_idle and not os.listdir(os.path.join(spool_dir, QUEUE_DIR)) \
+                    and not os.listdir(os.path.join(spool_dir, RUNNING_DIR)):
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+        process(spool_dir, lease, worker_id)
+        processed += 1
+        # ノードが違うと PID が重なるため、ワーカーIDで書き出す
+        metrics.flush(metrics_dir, name=worker_id)
+    return processed
+
+
+def submit(spec, spool_dir=None):
+    """ジョブをスプールに投入してジョブIDを返す
+
+    spec の入力ファイル（input / inputs / bgm_path）はスプールにコピーします。
+    input にはファイルライクオブジェクトも指定できます（Streamlit のアップロードなど）。
+    """
+    spool_dir = spool_dir or get_spool_dir()
+    init(spool_dir)
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(spool_dir, JOBS_DIR, job_id)
+    os.makedirs(os.path.join(job_dir, 'inputs'))
+    copied = []
+
+    def copy_input(source, name):
+        path = os.path.join('inputs', f"{len(copied):03d}_{name}")
+        if isinstance(source, (str, os.PathLike)):
+            shutil.copyfile(source, os.path.join(job_dir, path))
+        else:
+            source.seek(0)
+            with open(os.path.join(job_dir, path), 'wb') as f:
+                shutil.copyfileobj(source, f)
+        copied.append(path)
+        return path
+
+    spec = dict(spec, tool=spec.get('tool', 'shorts'), output='result.mp4')
+    spec.pop('preview_dir', None)
+    for key in ('input', 'bgm_path'):
+        if spec.get(key) is not None:
+            filename = os.path.basename(getattr(spec[key], 'name', None) or str(spec[key]))
+            spec[key] = copy_input(spec[key], filename or key)
+    if spec.get('inputs'):
+        spec['inputs'] = [copy_input(path, os.path.basename(path)) for path in spec['inputs']]
+    write_job(job_dir, job_id, spec)
+    enqueue(spool_dir, job_id)
+    return job_id
+
+
+def wait(job_id, progress=None, on_warning=None, spool_dir=None):
+    """ジョブの終了を待ち、進捗・警告を中継して最後の状態を返す
+
+    待っている間に取り消された場合（supervisor.supervise のトークン）はジョブも取り消します。
+    """
+    spool_dir = spool_dir or get_spool_dir()
+    job_dir = os.path.join(spool_dir, JOBS_DIR, job_id)
+    reported = (None, None)
+    warnings = 0
+    while True:
+        try:
+            supervisor.check_cancelled()
+        except supervisor.Cancelled:
+            supervisor.CancelToken(flag_path=os.path.join(job_dir, CANCEL_FLAG)).cancel()
+            raise
+        status = _read_json(os.path.join(job_dir, 'status.json'))
+        for message in status.get('warnings', [])[warnings:]:
+            if on_warning is not None:
+                on_warning(message)
+        warnings = len(status.get('warnings', []))
+        if status['state'] in FINISHED_STATES:
+            return status
+        if progress is not None and (status['progress'], status['message']) != reported:
+            reported = (status['progress'], status['message'])
+            progress(*reported)
+        time.sleep(POLL_SECONDS)
+
+
+def run_job(spec, progress=None, on_warning=None, spool_dir=None):
+    """jobs.run_job と同じ使い方で、処理をスプールのワーカーに任せる（出力は spec['output'] にコピー）"""
+    from .cover import cover_path, normalize_cover_count
+    from .shorts import normalize_renditions, rendition_path
+
+    spool_dir = spool_dir or get_spool_dir()
+    job_id = submit(spec, spool_dir)
+    status = wait(job_id, progress, on_warning, spool_dir)
+    job_dir = os.path.join(spool_dir, JOBS_DIR, job_id)
+    try:
+        if status['state'] == "cancelled":
+            raise supervisor.Cancelled("処理が取り消されました")
+        if status['state'] != "done":
+            raise Exception(status.get('error') or f"ジョブが失敗しました（{job_id}）")
+        result_path = os.path.join(job_dir, 'result.mp4')
+        shutil.copyfile(result_path, spec['output'])
+        for rendition in normalize_renditions(spec.get('renditions') or []):
+            shutil.copyfile(rendition_path(result_path, rendition['name']), rendition_path(spec['output'], rendition['name']))
+        for index in range(1, normalize_cover_count(spec.get('covers')) + 1):
+            if os.path.exists(cover_path(result_path, index)):
+                shutil.copyfile(cover_path(result_path, index), cover_path(spec['output'], index))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    if progress is not None:
+        progress(status['progress'], status['message'])
+    return spec['output']
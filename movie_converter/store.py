@@ -0,0 +1,218 @@
+"""処理段階ごとの成果物ストア（内容アドレス・LRU）
+
+各段階（リサイズ・テロップ・音声・BGM など）の出力を
+「入力成果物のキー + 正規化したパラメータ」のハッシュで保存します。
+キーは入力ファイルの内容ハッシュから順に連鎖させるため、実行前に全段階のキーが決まり、
+保存済みの最も後ろの段階から再開できます（同じジョブは即座に、BGM音量だけ変えた場合はBGM段階だけ再計算）。
+
+保存先は MOVIE_CONVERTER_CACHE_DIR/artifacts、上限サイズは MOVIE_CONVERTER_STORE_MAX_MB
+（既定: 2048、0で無効）です。上限を超えたら最終利用時刻の古いものから削除します。
+他のジョブ（別プロセスを含む）がいつ削除してもよいよう、成果物は必ずハードリンクかコピーで
+作業用のパスに取り出してから使います（ストア内のパスをそのまま渡さない）。
+"""
+import os
+import shutil
+import tempfile
+
+from . import metrics, supervisor
+from .cache import get_cache_dir, params_digest
+
+STORE_VERSION = 1   # 出力形式を変えたら上げる（既存の成果物を使わなくなる）
+
+
+def store_budget():
+    """ストアの上限サイズ（バイト）。0 の場合はストアを使わない"""
+    return int(float(os.getenv('MOVIE_CONVERTER_STORE_MAX_MB', '2048')) * 1024 * 1024)
+
+
+def _artifact_path(key, suffix='.mp4'):
+    return os.path.join(get_cache_dir('artifacts'), f"{key}{suffix}")
+
+
+def artifact_key(stage, input_keys, params):
+    """段階の出力キー（入力成果物のキー・段階名・パラメータから計算）"""
+    return params_digest({
+        'stage': stage,
+        'inputs': list(input_keys),
+        'params': params,
+        'version': STORE_VERSION,
+    })
+
+
+def lookup(key, suffix='.mp4'):
+    """保存済みの成果物のパスを返す（なければ None）。見つかった場合は最終利用時刻を更新"""
+    path = _artifact_path(key, suffix)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+
+def put(key, path, suffix='.mp4'):
+    """成果物をストアにコピーし、上限を超えた分を削除"""
+    budget = store_budget()
+    if budget <= 0 or os.path.getsize(path) > budget:
+        return None
+    stored_path = _artifact_path(key, suffix)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(stored_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, stored_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return None
+    evict(budget, keep=stored_path)
+    return stored_path
+
+
+def evict(budget=None, keep=None):
+    """合計サイズが上限以下になるまで、最終利用時刻の古い成果物から削除"""
+    budget = store_budget() if budget is None else budget
+    directory = get_cache_dir('artifacts')
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.endswith('.tmp'):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _link_or_copy(src, dst):
+    """ストアの成果物を作業用パスに取り出す（ハードリンクできなければコピー）
+
+    取り出した後にストア側が削除されても作業用のファイルは残ります。
+    """
+    if os.path.exists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def fetch(key, dst, suffix='.mp4'):
+    """保存済みの成果物を dst に取り出す（なければ False）"""
+    stored_path = lookup(key, suffix)
+    if stored_path is not None:
+        try:
+            _link_or_copy(stored_path, dst)
+        except OSError:
+            # 取り出す直前に他のプロセスが削除した場合
+            stored_path = None
+    metrics.inc('cache_requests_total', cache="artifacts", result="hit" if stored_path else "miss")
+    return stored_path is not None
+
+
+def run_stages(source_key, input_path, stages, output_path, progress=None, on_warning=None):
+    """段階のリストを成果物ストアを使って実行
+
+    stages: [{'name': 段階名, 'params': パラメータ, 'run': run(入力パス, 出力パス, on_warning),
+              'percent': 進捗, 'message': 進捗メッセージ}, ...]
+    段階の実行中に警告が出た場合（音声合成の失敗など）、その段階以降の出力は保存しません。
+    戻り値: ストアから復元した段階数
+    """
+    keys = []
+    previous = source_key
+    for stage in stages:
+        previous = artifact_key(stage['name'], [previous], stage['params'])
+        keys.append(previous)
+
+    use_store = store_budget() > 0
+    # 保存済みの最も後ろの段階を探し、作業用のパスに取り出す
+    resume = 0
+    current_path = input_path
+    owned = False   # current_path がこの関数で作った一時ファイルか
+    if use_store:
+        for i in range(len(stages), 0, -1):
+            stored_path = lookup(keys[i - 1])
+            if stored_path is None:
+                continue
+            fd, work_path = tempfile.mkstemp(suffix=f"_{stages[i - 1]['name']}.mp4")
+            os.close(fd)
+            try:
+                _link_or_copy(stored_path, work_path)
+            except OSError:
+                # 見つけた直後に他のプロセスが削除した場合は、その前の段階を探す
+                if os.path.exists(work_path):
+                    os.unlink(work_path)
+                continue
+            resume = i
+            current_path, owned = work_path, True
+            break
+        # 再開位置より前の段階は計算を省いたのでヒット扱い
+        metrics.inc('cache_requests_total', resume, cache="artifacts", result="hit")
+        metrics.inc('cache_requests_total', len(stages) - resume, cache="artifacts", result="miss")
+
+    if resume == len(stages) and stages:
+        if progress is not None:
+            progress(90, "保存済みの結果を使用します")
+        # 出力はストアとファイルを共有しない（上書きされてもストアの成果物が壊れないようコピーする）
+        try:
+            shutil.copyfile(current_path, output_path)
+        finally:
+            os.unlink(current_path)
+        return resume
+
+    if resume and progress is not None:
+        progress(stages[resume - 1]['percent'], f"{stages[resume - 1]['name']}: 保存済みの結果を使用します")
+
+    tainted = False
+    try:
+        for stage, key in zip(stages[resume:], keys[resume:]):
+            supervisor.check_cancelled()
+            if progress is not None:
+                progress(stage['percent'], stage['message'])
+            fd, next_path = tempfile.mkstemp(suffix=f"_{stage['name']}.mp4")
+            os.close(fd)
+            warnings = []
+
+            def warn(message):
+                warnings.append(message)
+                if on_warning is not None:
+                    on_warning(message)
+
+            try:
+                with metrics.timed('stage_duration_seconds', stage=stage['name']):
+                    stage['run'](current_path, next_path, warn)
+            except BaseException:
+                # 取り消された場合も途中の出力を残さない
+                os.unlink(next_path)
+                raise
+            tainted = tainted or bool(warnings)
+            if use_store and not tainted:
+                put(key, next_path)
+            if owned:
+                os.unlink(current_path)
+            current_path, owned = next_path, True
+
+        if owned:
+            shutil.move(current_path, output_path)
+        else:
+            shutil.copyfile(current_path, output_path)
+        owned = False
+    finally:
+        if owned and os.path.exists(current_path):
+            os.unlink(current_path)
+    return resume
@@ -0,0 +1,135 @@
+"""VOICEVOXの発話区間からの自動字幕
+
+音声合成に使った audio_query のモーラ長から、各チャンク（文・読点の区切り）と
+アクセント句の発話区間がわかります。これをテロップ（add_text_to_video の形式）に変換します。
+
+- phrase:  チャンクごとに、話している間だけ表示
+- karaoke: アクセント句ごとに、話し終えた部分までの文字を順に表示
+
+アクセント句ごとの文字の割り当ては、モーラ数と文字の読みの長さ（漢字は2、かなは1）の比率から推定します。
+"""
+import os
+
+from .cache import load_json, params_digest, save_json
+from .voicevox import CLAUSE_PAUSE, SENTENCE_PAUSE, generate_voice_with_timings
+
+SUBTITLE_MODES = ("phrase", "karaoke")
+HOLD_SECONDS = 0.5   # 話し終えた後に字幕を残す最大時間（次の字幕が始まる場合はそこまで）
+SMALL_KANA = "ぁぃぅぇぉゃゅょゎァィゥェォャュョヮ"   # 直前の文字と合わせて1モーラ
+
+
+def _reading_weight(char):
+    """文字の読みのおおよそのモーラ数"""
+    if char.isspace() or not char.isalnum() and char != "ー":
+        return 0.0   # 句読点・記号
+    if char in SMALL_KANA:
+        return 0.0
+    if '一' <= char <= '鿿' or char == '々':
+        return 2.0   # 漢字
+    return 1.0
+
+
+def _split_by_moras(text, mora_counts):
+    """テキストをアクセント句のモーラ数の比率で分け、句ごとの終了位置（文字数）を返す"""
+    weights = [_reading_weight(char) for char in text]
+    total_weight = sum(weights) or 1.0
+    total_moras = sum(mora_counts) or 1
+    ends = []
+    spoken = 0
+    position = 0
+    cumulative = 0.0
+    for count in mora_counts:
+        spoken += count
+        target = total_weight * spoken / total_moras
+        while position < len(text) and cumulative + weights[position] / 2 <= target:
+            cumulative += weights[position]
+            position += 1
+        ends.append(position)
+    if ends:
+        ends[-1] = len(text)
+    return ends
+
+
+def subtitle_segments(timings, start_time=0.0, mode="phrase"):
+    """generate_voice_with_timings の発話区間を字幕の区間に変換
+
+    start_time: 動画内で音声が始まる時刻
+    戻り値: [{'text': 表示する文字列, 'start_time': 秒, 'end_time': 秒}, ...]
+    """
+    if mode not in SUBTITLE_MODES:
+        raise ValueError(f"不明な字幕モードです: {mode}（{', '.join(SUBTITLE_MODES)} のいずれかを指定してください）")
+
+    segments = []
+    for i, chunk in enumerate(timings):
+        text = chunk['text'].strip()
+        if not text:
+            continue
+        next_start = timings[i + 1]['start'] if i + 1 < len(timings) else None
+        end = chunk['end'] + HOLD_SECONDS
+        if next_start is not None:
+            end = min(end, max(chunk['end'], next_start))
+
+        phrases = chunk['phrases']
+        if mode == "phrase" or len(phrases) < 2:
+            segments.append({'text': text, 'start_time': chunk['start'], 'end_time': end})
+            continue
+        ends = _split_by_moras(text, [phrase['moras'] for phrase in phrases])
+        for j, (phrase, position) in enumerate(zip(phrases, ends)):
+            if position == 0:
+                continue
+            phrase_end = phrases[j + 1]['start'] if j + 1 < len(phrases) else end
+            segments.append({'text': text[:position], 'start_time': phrase['start'], 'end_time': phrase_end})
+
+    return [
+        dict(segment, start_time=round(start_time + segment['start_time'], 3),
+             end_time=round(start_time + segment['end_time'], 3))
+        for segment in segments
+        if segment['end_time'] > segment['start_time']
+    ]
+
+
+def get_voice_timings(text, speaker_id=10):
+    """音声の発話区間を取得（キャッシュがなければ合成する）
+
+    戻り値: (発話区間, 合成したWAVのパス または None)
+    WAVのパスが返った場合は、音声の追加に使い回してから呼び出し側で削除します。
+    """
+    key = params_digest({
+        'text': text, 'speaker_id': speaker_id,
+        'sentence_pause': SENTENCE_PAUSE, 'clause_pause': CLAUSE_PAUSE,
+    })
+    timings = load_json('voice_timings', key)
+    if timings is not None:
+        return timings, None
+    voice_path, timings = generate_voice_with_timings(text, speaker_id)
+    save_json('voice_timings', key, timings)
+    return timings, voice_path
+
+
+def voice_subtitle_telops(voices, mode="phrase", position="bottom", color=(255, 255, 255), on_warning=None):
+    """音声設定（text・start_time）から字幕テロップのリストを作成
+
+    戻り値: (テロップのリスト, {音声のインデックス: 合成済みWAVのパス})
+    """
+    if mode not in SUBTITLE_MODES:
+        raise ValueError(f"不明な字幕モードです: {mode}（{', '.join(SUBTITLE_MODES)} のいずれかを指定してください）")
+    telops = []
+    voice_paths = {}
+    for i, voice in enumerate(voices):
+        try:
+            timings, voice_path = get_voice_timings(voice['text'])
+        except Exception as e:
+            if on_warning is not None:
+                on_warning(f"⚠️ 音声「{voice['text'][:20]}...」の字幕を作成できませんでした: {str(e)}")
+            continue
+        if voice_path:
+            voice_paths[i] = voice_path
+        for segment in subtitle_segments(timings, voice.get('start_time', 0.0), mode):
+            telops.append(dict(segment, position=position, color=tuple(color)))
+    return telops, voice_paths
+
+
+def remove_voice_files(voice_paths):
+    for path in voice_paths.values():
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,291 @@
+"""子プロセス（ffmpeg・ffprobe・LibreOffice）の監視
+
+- 取り消し: セッション・ジョブごとの CancelToken を supervise() で設定すると、
+  その中で起動した子プロセスは取り消し時にすぐ停止し、Cancelled を送出します
+- タイムアウト: 段階ごとの基本時間 + 素材の長さ × 係数（STAGE_TIMEOUTS）。
+  MOVIE_CONVERTER_TIMEOUT_SCALE で全体の倍率を変更できます（0 で無効）
+- プロセスグループ: 子プロセスは新しいセッションで起動し、停止時は SIGTERM → 猶予後 SIGKILL を
+  グループ全体に送ります（ffmpeg が SIGTERM に応答しない場合や、孫プロセスも止めるため）
+- 優先度: 'interactive'（UIのプレビュー・変換）と 'batch'（CLI・ジョブAPI）の nice・ionice。
+  MOVIE_CONVERTER_NICE_<優先度> / MOVIE_CONVERTER_IONICE_<優先度>（"クラス" または "クラス:レベル"）で変更できます
+
+監視はプロセスごとの監視スレッドで行うため、呼び出し元は subprocess.run と同じように待つだけです。
+"""
+import atexit
+import contextlib
+import contextvars
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+from . import metrics
+
+POLL_SECONDS = 0.2      # 取り消し・タイムアウトを確認する間隔
+KILL_GRACE_SECONDS = 2  # SIGTERM から SIGKILL までの猶予
+
+# 段階 → (基本時間（秒）, 素材1秒あたりの追加時間（秒）)
+STAGE_TIMEOUTS = {
+    'probe': (60, 0),        # ffprobe・短いフレームの読み出し
+    'analyse': (120, 10),    # 縮小した解析・比較
+    'audio': (120, 5),       # 音声のみの処理（映像はコピー）
+    'copy': (120, 1),        # 再エンコードしない連結・分割
+    'encode': (300, 60),     # 映像の再エンコード（preset slow・1080x1920 を1コアで処理しても収まる長さ）
+    'convert': (300, 0),     # LibreOffice による PowerPoint の変換
+}
+
+# 優先度 → nice 値・ionice（クラス, レベル）。None は変更しない
+PRIORITIES = {
+    'interactive': {'nice': 0, 'ionice': None},
+    'batch': {'nice': 10, 'ionice': (2, 7)},
+}
+DEFAULT_PRIORITY = 'interactive'
+
+
+class Cancelled(BaseException):
+    """処理が取り消された（except Exception で握りつぶされないよう BaseException を継承）"""
+
+
+class CancelToken:
+    """取り消しの要求を伝える
+
+    flag_path: このファイルが作られたら取り消し（別プロセスのジョブAPIから取り消すため）
+    is_alive: False を返したら取り消し（Streamlit のセッションが終わった場合など）
+    """
+
+    def __init__(self, flag_path=None, is_alive=None):
+        self.flag_path = flag_path
+        self.is_alive = is_alive
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+        if self.flag_path:
+            with open(self.flag_path, 'a'):
+                pass
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if (self.flag_path and os.path.exists(self.flag_path)) or (self.is_alive is not None and not self.is_alive()):
+            self._event.set()
+            return True
+        return False
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled("処理が取り消されました")
+
+
+_supervision = contextvars.ContextVar('movie_converter_supervision', default=(None, DEFAULT_PRIORITY))
+_process_priority = DEFAULT_PRIORITY
+_live = set()   # 実行中の子プロセス（別セッションのため、終了時に自分で止める）
+
+
+@contextlib.contextmanager
+def supervise(token=None, priority=None):
+    """この中で起動する子プロセスに取り消しと優先度を適用する（スレッドへは contextvars で引き継ぐ）"""
+    current_token, current_priority = _supervision.get()
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"不明な優先度です: {priority}（{', '.join(PRIORITIES)} のいずれかを指定してください）")
+    reset = _supervision.set((token or current_token, priority or current_priority))
+    try:
+        yield token
+    finally:
+        _supervision.reset(reset)
+
+
+def current_token():
+    return _supervision.get()[0]
+
+
+def check_cancelled():
+    """取り消されていれば Cancelled を送出（MoviePy のフレーム処理など、子プロセス以外の長い処理用）"""
+    token = current_token()
+    if token is not None:
+        token.check()
+
+
+def wait_result(future):
+    """Future の結果を待つ（待っている間も取り消しを確認する）"""
+    from concurrent.futures import TimeoutError as FutureTimeout
+
+    while True:
+        try:
+            return future.result(timeout=POLL_SECONDS)
+        except FutureTimeout:
+            check_cancelled()
+
+
+def stage_timeout(stage, duration=None):
+    """段階の制限時間（秒）。素材の長さ duration（秒）に比例して延ばす
+
+    None は無制限（無効にした場合と、長さに比例する段階で素材の長さが分からない場合）
+    """
+    scale = float(os.getenv('MOVIE_CONVERTER_TIMEOUT_SCALE', '1'))
+    base, per_second = STAGE_TIMEOUTS[stage]
+    if scale <= 0 or (per_second and not duration):
+        return None
+    return (base + per_second * (duration or 0)) * scale
+
+
+def priority_settings(priority):
+    """優先度の nice 値と ionice（環境変数で上書き可能）"""
+    settings = dict(PRIORITIES[priority])
+    nice = os.getenv(f'MOVIE_CONVERTER_NICE_{priority.upper()}')
+    if nice:
+        settings['nice'] = int(nice)
+    ionice = os.getenv(f'MOVIE_CONVERTER_IONICE_{priority.upper()}')
+    if ionice:
+        io_class, _, level = ionice.partition(':')
+        settings['ionice'] = (int(io_class), int(level) if level else None)
+    return settings
+
+
+def _priority_prefix(priority):
+    """コマンドの前に付ける nice・ionice（プロセス全体に設定済みの場合は付けない）"""
+    if os.name != 'posix' or priority == _process_priority:
+        return []
+    settings = priority_settings(priority)
+    prefix = []
+    delta = settings['nice'] - os.getpriority(os.PRIO_PROCESS, 0)
+    if delta > 0 and shutil.which('nice'):
+        prefix.extend(['nice', '-n', str(delta)])
+    if settings['ionice'] and shutil.which('ionice'):
+        io_class, level = settings['ionice']
+        prefix.extend(['ionice', '-c', str(io_class)])
+        if level is not None and io_class in (1, 2):
+            prefix.extend(['-n', str(level)])
+    return prefix
+
+
+def set_process_priority(priority):
+    """このプロセス（と以降の子プロセス）全体の優先度を下げる（ワーカープロセスの起動時に使う）"""
+    global _process_priority
+    if os.name != 'posix':
+        return
+    settings = priority_settings(priority)
+    delta = settings['nice'] - os.getpriority(os.PRIO_PROCESS, 0)
+    if delta > 0:
+        os.nice(delta)
+    if settings['ionice'] and shutil.which('ionice'):
+        io_class, level = settings['ionice']
+        cmd = ['ionice', '-c', str(io_class)]
+        if level is not None and io_class in (1, 2):
+            cmd.extend(['-n', str(level)])
+        subprocess.run([*cmd, '-p', str(os.getpid())], capture_output=True)
+    _process_priority = priority
+
+
+def _kill_group(process):
+    """プロセスグループ全体を停止（SIGTERM に応答しなければ SIGKILL）"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=KILL_GRACE_SECONDS)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+@atexit.register
+def _kill_live():
+    """インタープリター終了時に残っている子プロセスを止める（Ctrl+C のシグナルは別セッションに届かない）"""
+    for process in list(_live):
+        _kill_group(process)
+
+
+class _Watch:
+    """1つの子プロセスを監視するスレッド（取り消し・制限時間の超過で停止させる）"""
+
+    def __init__(self, process, token, timeout):
+        self.process = process
+        self.token = token
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="subprocess-watch", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._done.wait(POLL_SECONDS):
+            if self.process.poll() is not None:
+                return
+            if self.token is not None and self.token.cancelled:
+                self.reason = "cancelled"
+            elif self.deadline is not None and time.monotonic() > self.deadline:
+                self.reason = "timeout"
+            else:
+                continue
+            _kill_group(self.process)
+            return
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+
+
+@contextlib.contextmanager
+def popen(cmd, stage='encode', duration=None, timeout=None, **kwargs):
+    """監視付きで子プロセスを起動する（subprocess.Popen と同じ引数）
+
+    with ブロックを抜けると、終了していないプロセスはグループごと停止します。
+    取り消された場合は Cancelled、制限時間を超えた場合は TimeoutError を送出します。
+    timeout: 制限時間（秒）。省略時は stage と duration（素材の長さ）から決める
+    """
+    token, priority = _supervision.get()
+    if token is not None:
+        token.check()
+    prefix = _priority_prefix(priority)
+    if prefix and shutil.which(cmd[0]) is None:
+        # nice 経由で起動すると「見つからない」が終了コードになるため、先に確認する
+        raise FileNotFoundError(f"{cmd[0]} が見つかりません")
+    if timeout is None:
+        timeout = stage_timeout(stage, duration)
+    process = subprocess.Popen([*prefix, *cmd], start_new_session=os.name == 'posix', **kwargs)
+    _live.add(process)
+    watch = _Watch(process, token, timeout)
+    try:
+        yield process
+    finally:
+        watch.stop()
+        _kill_group(process)
+        process.wait()
+        _live.discard(process)
+        for stream in (process.stdin, process.stdout, process.stderr):
+            if stream is not None:
+                stream.close()
+        if watch.reason is not None:
+            metrics.inc('subprocess_terminations_total', stage=stage, reason=watch.reason)
+            if watch.reason == "cancelled":
+                raise Cancelled("処理が取り消されました")
+            raise TimeoutError(f"{os.path.basename(cmd[0])} の処理が制限時間（{timeout:.0f}秒）を超えたため停止しました")
+
+
+def run(cmd, stage='encode', duration=None, timeout=None, check=False, capture_output=False, input=None, **kwargs):
+    """監視付きの subprocess.run（戻り値・check=True の例外も subprocess.run と同じ）"""
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    with popen(cmd, stage, duration, timeout, **kwargs) as process:
+        stdout, stderr = process.communicate(input)
+    result = subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
@@ -0,0 +1,139 @@
+"""テキストの折り返しレイアウト（日本語の禁則処理対応）
+
+スライド画像とテロップで共通に使います。
+
+- フォントはパス・サイズごとにキャッシュ（毎回 .ttc を読み込まない）
+- 文字幅は font.getlength で1文字ずつ求めてフォントオブジェクトにキャッシュし、累積和で行幅を計算
+- 折り返し位置は累積和に対する二分探索で求め、行頭・行末禁則を満たす位置まで戻す
+- 英文などスペース区切りのテキストは単語単位、日本語は文字単位で折り返す
+"""
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
+# 日本語フォントの候補（先に見つかったものを使用）
+JAPANESE_FONTS = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "fonts/NotoSansJP-Regular.ttf",
+    "NotoSansCJK-Regular.ttc",
+)
+
+# 行頭禁則文字（行の先頭に置かない）
+NO_LINE_START = set(
+    "、。，．,.・：；:;？！?!‼⁇⁈⁉ー―‐–〜～…‥"
+    "）〕］｝〉》」』】〙〗〟’”｠»)]}"
+    "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶㇰㇱㇲㇳㇴㇵㇶㇷㇸㇹㇺㇻㇼㇽㇾㇿ"
+    "々〻ゝゞヽヾ゛゜%％"
+)
+# 行末禁則文字（行の末尾に置かない）
+NO_LINE_END = set("（〔［｛〈《「『【〘〖〝‘“｟«([{")
+
+
+@lru_cache(maxsize=32)
+def load_font(size, candidates=JAPANESE_FONTS):
+    """フォントを読み込む（候補を順に試し、なければPillowのデフォルトフォント）"""
+    from PIL import ImageFont
+
+    for font_path in candidates:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def char_advances(text, font):
+    """各文字の送り幅（ピクセル）のリストを返す
+
+    文字幅のキャッシュはフォントオブジェクト自体に持たせる（フォントと一緒に解放され、
+    解放後に同じ id の別サイズのフォントへ古い幅を返すことがない）。
+    """
+    cache = getattr(font, '_advance_cache', None)
+    if cache is None:
+        cache = font._advance_cache = {}
+    advances = []
+    for ch in text:
+        width = cache.get(ch)
+        if width is None:
+            width = cache[ch] = font.getlength(ch)
+        advances.append(width)
+    return advances
+
+
+def _is_wide(ch):
+    """文字単位で折り返してよい文字（CJK・全角）か"""
+    code = ord(ch)
+    return (
+        0x2E80 <= code <= 0x9FFF      # CJK部首・記号・かな・漢字
+        or 0xF900 <= code <= 0xFAFF   # CJK互換漢字
+        or 0xFF00 <= code <= 0xFFEF   # 全角英数・半角カナ
+        or 0x20000 <= code <= 0x3FFFF
+    )
+
+
+def break_positions(text):
+    """折り返し可能な位置（その位置の直前で改行できるインデックス）の昇順リスト"""
+    positions = []
+    for i in range(1, len(text)):
+        prev, cur = text[i - 1], text[i]
+        if cur == ' ':
+            continue
+        if prev == ' ':
+            # スペースの直後（単語の先頭）は常に折り返し可能
+            positions.append(i)
+            continue
+        if not (_is_wide(prev) or _is_wide(cur)):
+            continue
+        if cur in NO_LINE_START or prev in NO_LINE_END:
+            continue
+        positions.append(i)
+    return positions
+
+
+def wrap_line(text, font, max_width):
+    """改行を含まない1段落を max_width に収まる行のリストに折り返す"""
+    text = text.strip()
+    if not text:
+        return []
+    prefix = [0.0, *accumulate(char_advances(text, font))]
+    breaks = break_positions(text)
+
+    lines = []
+    start = 0
+    length = len(text)
+    while start < length:
+        # 行頭のスペースは詰める
+        while start < length and text[start] == ' ':
+            start += 1
+        if start >= length:
+            break
+        # 幅に収まる最長の終了位置を累積和から二分探索
+        end = bisect_right(prefix, prefix[start] + max_width) - 1
+        if end >= length:
+            lines.append(text[start:].rstrip())
+            break
+        # end 以下で最も後ろの折り返し可能位置まで戻す
+        candidate = breaks[bisect_right(breaks, end) - 1] if breaks and breaks[0] <= end else None
+        if candidate is None or candidate <= start:
+            # 折り返し位置がない長い単語は、禁則を無視して幅で強制改行（最低1文字）
+            candidate = max(end, start + 1)
+        lines.append(text[start:candidate].rstrip())
+        start = candidate
+    return lines
+
+
+def wrap_text(text, font, max_width):
+    """改行を含むテキストを折り返す（空行は除く）"""
+    lines = []
+    for paragraph in text.split('\n'):
+        lines.extend(wrap_line(paragraph, font, max_width))
+    return lines
+
+
+def line_width(line, font):
+    """行幅（ピクセル）"""
+    return sum(char_advances(line, font))
@@ -0,0 +1,303 @@
+"""2つの出力動画が同等かを確認する（高速化した処理の回帰チェック用）
+
+ストリームコピーでの連結・フィルターグラフの統合などで処理を置き換えたときに、
+従来の出力と見た目・音声・形式が変わっていないことを数値で確認します。
+
+- 映像: 両方の動画から同じ時刻のフレームを ffmpeg の rawvideo で縮小して読み出し、
+        PSNR と SSIM（7×7 の窓）をフレーム単位でまとめて計算
+- 音声: モノラル・低サンプルレートにしたPCMの相互相関から、ずれ（秒）と相関の強さを計算
+- 形式: 長さ・解像度・FPS・音声の有無・サンプルレート・チャンネル数を比較
+
+    python -m movie_converter compare reference.mp4 candidate.mp4
+    python -m movie_converter compare ./baseline ./out     # 同じ名前のファイルどうしを比較
+"""
+import itertools
+import json
+import os
+import subprocess
+
+from . import supervisor
+from .media import iter_frames
+
+# 許容範囲の既定値
+DEFAULT_TOLERANCES = {
+    'psnr_min': 35.0,           # フレームごとのPSNRの最小値（dB）
+    'ssim_min': 0.97,           # フレームごとのSSIMの最小値
+    'audio_offset_max': 0.02,   # 音声のずれ（秒）
+    'audio_correlation_min': 0.8,   # 音声の相互相関のピーク（正規化、1.0 = 完全一致）
+    'duration_diff_max': 0.1,   # 長さの差（秒）
+}
+ANALYSIS_WIDTH = 320      # フレーム比較の解像度（幅）
+SAMPLE_FPS = 2            # フレーム比較のサンプリング間隔（1秒あたりの枚数）
+AUDIO_RATE = 8000         # 音声比較のサンプルレート
+MAX_AUDIO_SHIFT = 1.0     # 音声のずれを探す範囲（±秒）
+AUDIO_WINDOW = 20.0       # 音声を比較する区間の長さ（秒）。長い動画は先頭・中央・末尾の3区間
+SSIM_WINDOW = 7
+BATCH_FRAMES = 32         # まとめて計算するフレーム数
+PSNR_IDENTICAL = 100.0    # 完全一致のフレームのPSNR（無限大の代わり）
+
+
+def probe_streams(path):
+    """比較に使うストリーム情報（映像・音声の形式と長さ）を取得"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries',
+        'stream=codec_type,codec_name,width,height,pix_fmt,avg_frame_rate,sample_rate,channels:format=duration',
+        '-of', 'json', path
+    ]
+    try:
+        result = supervisor.run(cmd, stage='probe', check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"動画情報の取得に失敗しました: {e.stderr}")
+    data = json.loads(result.stdout)
+    video = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in data.get('streams', []) if s.get('codec_type') == 'audio'), None)
+    if video is None:
+        raise Exception(f"映像ストリームが見つかりません: {path}")
+    num, _, den = (video.get('avg_frame_rate') or '0/1').partition('/')
+    return {
+        'duration': float(data.get('format', {}).get('duration') or 0.0),
+        'video_codec': video.get('codec_name'),
+        'width': int(video['width']),
+        'height': int(video['height']),
+        'pix_fmt': video.get('pix_fmt'),
+        'fps': round(float(num) / float(den), 3) if float(den or 0) else 0.0,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'sample_rate': int(audio['sample_rate']) if audio and audio.get('sample_rate') else None,
+        'channels': audio.get('channels') if audio else None,
+    }
+
+
+def iter_frame_batches(reference, candidate, width, height, sample_fps=SAMPLE_FPS, batch_size=BATCH_FRAMES):
+    """2つの動画の同じ時刻のフレームを batch_size 枚ずつ読み出す（グレースケール、枚数 × 高さ × 幅）
+
+    両方を同時にデコードするため、メモリには1バッチ分しか保持しません。
+    """
+    import numpy as np
+
+    pairs = zip(iter_frames(reference, width, height, sample_fps=sample_fps),
+                iter_frames(candidate, width, height, sample_fps=sample_fps))
+    while True:
+        batch = list(itertools.islice(pairs, batch_size))
+        if not batch:
+            return
+        yield np.stack([a for a, _ in batch]), np.stack([b for _, b in batch])
+
+
+def psnr(reference, candidate):
+    """フレームごとのPSNR（dB）。完全一致のフレームは PSNR_IDENTICAL"""
+    import numpy as np
+
+    diff = reference.astype(np.float64) - candidate.astype(np.float64)
+    mse = (diff ** 2).reshape(len(diff), -1).mean(axis=1)
+    with np.errstate(divide='ignore'):
+        values = 10 * np.log10(255.0 ** 2 / mse)
+    return np.minimum(values, PSNR_IDENTICAL)
+
+
+def _box_mean(frames, size):
+    """各フレームの size×size 窓の平均（積分画像で計算、窓がはみ出さない範囲のみ）"""
+    import numpy as np
+
+    integral = np.pad(frames, ((0, 0), (1, 0), (1, 0))).cumsum(axis=1).cumsum(axis=2)
+    total = (integral[:, size:, size:] - integral[:, :-size, size:]
+             - integral[:, size:, :-size] + integral[:, :-size, :-size])
+    return total / (size * size)
+
+
+def ssim(reference, candidate, window=SSIM_WINDOW):
+    """フレームごとのSSIM（一様な window×window の窓、グレースケール）"""
+    import numpy as np
+
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x = reference.astype(np.float64)
+    y = candidate.astype(np.float64)
+    # 標本分散にそろえる補正（scikit-image の既定と同じ）
+    correction = window * window / (window * window - 1)
+    mean_x = _box_mean(x, window)
+    mean_y = _box_mean(y, window)
+    var_x = (_box_mean(x * x, window) - mean_x ** 2) * correction
+    var_y = (_box_mean(y * y, window) - mean_y ** 2) * correction
+    cov = (_box_mean(x * y, window) - mean_x * mean_y) * correction
+    index = ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2))
+    return index.reshape(len(index), -1).mean(axis=1)
+
+
+def read_audio(path, rate=AUDIO_RATE, start_time=None, duration=None):
+    """音声をモノラル・rate Hz の float32 配列で読み出す（音声がなければ空の配列）"""
+    import numpy as np
+
+    cmd = ['ffmpeg', '-v', 'error']
+    if start_time:
+        cmd.extend(['-ss', str(start_time)])
+    cmd.extend(['-i', path])
+    if duration:
+        cmd.extend(['-t', str(duration)])
+    cmd.extend(['-vn', '-ac', '1', '-ar', str(rate), '-f', 'f32le', '-'])
+    try:
+        result = supervisor.run(cmd, stage='audio', duration=duration, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"音声の読み出しに失敗しました: {e.stderr.decode()}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def audio_offset(reference, candidate, rate=AUDIO_RATE, max_shift=MAX_AUDIO_SHIFT):
+    """相互相関（FFT）から音声のずれを求める
+
+    戻り値: (ずれ（秒、正なら candidate が遅れている）, 正規化した相関のピーク)
+    どちらかが無音の場合は (0.0, None)
+    """
+    import numpy as np
+
+    length = min(len(reference), len(candidate))
+    a = reference[:length].astype(np.float64)
+    b = candidate[:length].astype(np.float64)
+    a -= a.mean() if length else 0.0
+    b -= b.mean() if length else 0.0
+    energy = np.sqrt((a * a).sum() * (b * b).sum())
+    if length == 0 or energy == 0:
+        return 0.0, None
+
+    size = 1 << int(2 * length - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size)), size)
+    # 負のずれは配列の後ろ側に入る
+    correlation = np.concatenate([correlation[-(length - 1):], correlation[:length]]) if length > 1 else correlation[:1]
+    lags = np.arange(-(length - 1), length)
+    limit = int(max_shift * rate)
+    window = np.abs(lags) <= limit
+    best = np.argmax(correlation[window])
+    return float(lags[window][best] / rate), float(correlation[window][best] / energy)
+
+
+def compare_audio(reference, candidate, duration, window=AUDIO_WINDOW):
+    """先頭・中央・末尾の区間ごとに音声のずれを求め、最も大きくずれた区間の結果を返す
+
+    区間に分けるのは、メモリを抑えつつ途中から徐々にずれる場合も見つけるため。
+    戻り値: {'offset': 秒, 'correlation': 相関, 'at': 区間の開始時刻}
+    """
+    if duration <= window * 3:
+        starts = [0.0]
+        window = None
+    else:
+        starts = [0.0, (duration - window) / 2, duration - window]
+    results = []
+    for start in starts:
+        offset, correlation = audio_offset(
+            read_audio(reference, start_time=start, duration=window),
+            read_audio(candidate, start_time=start, duration=window),
+        )
+        results.append({
+            'offset': round(offset, 4),
+            'correlation': None if correlation is None else round(correlation, 4),
+            'at': round(start, 3),
+        })
+    # ずれの大きい区間、同じなら相関の低い区間
+    return max(results, key=lambda r: (abs(r['offset']), -(1.0 if r['correlation'] is None else r['correlation'])))
+
+
+def compare_outputs(reference, candidate, tolerances=None, sample_fps=SAMPLE_FPS, width=ANALYSIS_WIDTH):
+    """2つの動画を比較して結果を返す
+
+    tolerances: DEFAULT_TOLERANCES の一部を上書きする dict
+    戻り値: {'passed': bool, 'failures': [許容範囲を超えた項目の説明], 'reference': ..., 'candidate': ...,
+             'video': {'frames', 'psnr_min', 'psnr_mean', 'ssim_min', 'ssim_mean', 'worst_time'（SSIMが最小の時刻）},
+             'audio': {'offset', 'correlation', 'at'} または None, 'duration_diff': 秒}
+    """
+    import numpy as np
+
+    limits = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    ref_info = probe_streams(reference)
+    cand_info = probe_streams(candidate)
+    failures = []
+
+    # 形式
+    duration_diff = abs(ref_info['duration'] - cand_info['duration'])
+    if duration_diff > limits['duration_diff_max']:
+        failures.append(f"長さが異なります: {ref_info['duration']:.3f}秒 / {cand_info['duration']:.3f}秒")
+    for key, label in (('width', "幅"), ('height', "高さ"), ('fps', "FPS"), ('sample_rate', "サンプルレート"), ('channels', "チャンネル数")):
+        if ref_info[key] != cand_info[key]:
+            failures.append(f"{label}が異なります: {ref_info[key]} / {cand_info[key]}")
+    if (ref_info['audio_codec'] is None) != (cand_info['audio_codec'] is None):
+        failures.append("片方にだけ音声があります")
+
+    # 映像（基準の縦横比で縮小し、同じ時刻のフレームどうしを比較）
+    height = max(2, int(round(width * ref_info['height'] / ref_info['width'] / 2)) * 2)
+    frame_psnr = []
+    frame_ssim = []
+    for ref_frames, cand_frames in iter_frame_batches(reference, candidate, width, height, sample_fps):
+        frame_psnr.append(psnr(ref_frames, cand_frames))
+        frame_ssim.append(ssim(ref_frames, cand_frames))
+    video = {'frames': sum(len(values) for values in frame_psnr)}
+    if frame_psnr:
+        frame_psnr = np.concatenate(frame_psnr)
+        frame_ssim = np.concatenate(frame_ssim)
+        worst = int(np.argmin(frame_ssim))
+        video.update({
+            'psnr_min': round(float(frame_psnr.min()), 2),
+            'psnr_mean': round(float(frame_psnr.mean()), 2),
+            'ssim_min': round(float(frame_ssim.min()), 4),
+            'ssim_mean': round(float(frame_ssim.mean()), 4),
+            'worst_time': round(worst / sample_fps, 3),
+        })
+        if video['psnr_min'] < limits['psnr_min']:
+            failures.append(f"PSNRが低すぎます: {video['psnr_min']}dB（基準 {limits['psnr_min']}dB）")
+        if video['ssim_min'] < limits['ssim_min']:
+            failures.append(f"SSIMが低すぎます: {video['ssim_min']}（{video['worst_time']}秒付近、基準 {limits['ssim_min']}）")
+    else:
+        failures.append("比較できるフレームがありません")
+
+    # 音声
+    audio = None
+    if ref_info['audio_codec'] and cand_info['audio_codec']:
+        audio = compare_audio(reference, candidate, min(ref_info['duration'], cand_info['duration']))
+        offset, correlation = audio['offset'], audio['correlation']
+        if abs(offset) > limits['audio_offset_max']:
+            failures.append(f"音声が {offset * 1000:+.0f}ms ずれています（{audio['at']}秒からの区間、基準 ±{limits['audio_offset_max'] * 1000:.0f}ms）")
+        if correlation is not None and correlation < limits['audio_correlation_min']:
+            failures.append(f"音声の相関が低すぎます: {correlation:.3f}（基準 {limits['audio_correlation_min']}）")
+
+    return {
+        'passed': not failures,
+        'failures': failures,
+        'reference': ref_info,
+        'candidate': cand_info,
+        'video': video,
+        'audio': audio,
+        'duration_diff': round(duration_diff, 3),
+    }
+
+
+def assert_equivalent(reference, candidate, tolerances=None, **kwargs):
+    """許容範囲を超えた差があれば例外を送出（テスト用）。比較結果を返す"""
+    report = compare_outputs(reference, candidate, tolerances, **kwargs)
+    if not report['passed']:
+        raise Exception(f"出力が一致しません（{os.path.basename(candidate)}）: " + " / ".join(report['failures']))
+    return report
+
+
+def pair_files(reference_dir, candidate_dir, extensions=('.mp4', '.mov', '.mkv')):
+    """2つのディレクトリで同じ名前の動画の組を返す（基準側にしかないファイルは candidate が None）"""
+    pairs = []
+    for name in sorted(os.listdir(reference_dir)):
+        if not name.lower().endswith(extensions):
+            continue
+        candidate = os.path.join(candidate_dir, name)
+        pairs.append((os.path.join(reference_dir, name), candidate if os.path.exists(candidate) else None))
+    return pairs
+
+
+def format_report(report):
+    """比較結果を表示用の文字列にする"""
+    video = report['video']
+    lines = [f"{'✅ 一致' if report['passed'] else '❌ 不一致'}"]
+    if 'psnr_min' in video:
+        lines.append(
+            f"  映像: {video['frames']}フレーム  PSNR 最小 {video['psnr_min']}dB / 平均 {video['psnr_mean']}dB"
+            f"  SSIM 最小 {video['ssim_min']} / 平均 {video['ssim_mean']}"
+        )
+    if report['audio']:
+        lines.append(f"  音声: ずれ {report['audio']['offset'] * 1000:+.1f}ms  相関 {report['audio']['correlation']}")
+    lines.append(f"  長さの差: {report['duration_diff']}秒")
+    lines.extend(f"  - {failure}" for failure in report['failures'])
+    return "\n".join(lines)
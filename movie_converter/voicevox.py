@@ -0,0 +1,465 @@
+"""VOICEVOX音声合成エンジンとの通信
+
+長いテキストは文・読点の単位に分割して並列に合成し、無音を挟んで1つのWAVに連結します。
+複数のエンジンを VOICEVOX_URLS（カンマ区切り）で指定すると、
+未完了リクエスト数が最も少ないエンジンに振り分けます（VoicevoxPool）。
+エンジンごとにヘルスチェック・サーキットブレーカー・リトライ（指数バックオフ）を行い、
+一部のエンジンが停止していても残りのエンジンで処理を続けます。
+"""
+import os
+import random
+import threading
+import time
+
+from . import metrics, supervisor
+
+# サーキットブレーカーの状態
+CLOSED = "closed"        # 正常（リクエストを送る）
+OPEN = "open"            # 連続失敗のため一時的に使わない
+HALF_OPEN = "half_open"  # 復旧確認のため1件だけ試す
+
+CONNECT_TIMEOUT = 3.05   # 接続タイムアウト（秒）。停止したエンジンを早く見切る
+
+
+def get_voicevox_url():
+    """VOICEVOX接続URLを取得（環境変数を優先）"""
+    # 環境変数から取得（Docker環境で設定）
+    voicevox_url = os.getenv('VOICEVOX_URL')
+    if voicevox_url:
+        return voicevox_url
+
+    # Docker Compose環境では voicevox サービス名で接続
+    try:
+        # Docker環境かチェック
+        if os.path.exists('/.dockerenv'):
+            return "http://voicevox:50021"
+    except:
+        pass
+
+    # WSL環境の場合はWindowsホストIPを取得
+    try:
+        with open('/etc/resolv.conf', 'r') as f:
+            for line in f:
+                if line.startswith('nameserver'):
+                    host_ip = line.split()[1]
+                    return f"http://{host_ip}:50021"
+    except:
+        pass
+
+    # フォールバック: localhost
+    return "http://localhost:50021"
+
+
+def get_voicevox_urls():
+    """VOICEVOXエンジンのURL一覧（VOICEVOX_URLS が未設定なら get_voicevox_url の1件）"""
+    urls = [url.strip().rstrip('/') for url in os.getenv('VOICEVOX_URLS', '').split(',') if url.strip()]
+    return urls or [get_voicevox_url().rstrip('/')]
+
+
+class VoicevoxEndpoint:
+    """1つのエンジンの状態（未完了リクエスト数・ヘルス・サーキットブレーカー）"""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.last_error = None
+
+    def snapshot(self):
+        return {
+            'url': self.url, 'outstanding': self.outstanding, 'healthy': self.healthy,
+            'state': self.state, 'failures': self.failures, 'last_error': self.last_error,
+        }
+
+
+class VoicevoxPool:
+    """複数のVOICEVOXエンジンへの負荷分散
+
+    failure_threshold 回連続で失敗したエンジンは reset_timeout 秒間使わず、
+    その後は1件だけ試して成功すれば復帰させます（サーキットブレーカー）。
+    probe_interval 秒ごとにバックグラウンドで /version を確認し、応答しないエンジンを除外します。
+    """
+
+    def __init__(self, urls, failure_threshold=3, reset_timeout=30.0, probe_interval=10.0,
+                 max_retries=2, backoff=0.5, read_timeout=30.0):
+        if not urls:
+            raise ValueError("VOICEVOXエンジンのURLが指定されていません")
+        self.endpoints = [VoicevoxEndpoint(url.rstrip('/')) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.read_timeout = read_timeout
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prober = None
+
+    # --- エンジンの選択とサーキットブレーカー ---
+
+    def _available(self, endpoint, now):
+        if not endpoint.healthy and endpoint.state == CLOSED:
+            return False
+        if endpoint.state == OPEN:
+            if now - endpoint.opened_at < self.reset_timeout:
+                return False
+            endpoint.state = HALF_OPEN
+        if endpoint.state == HALF_OPEN:
+            return not endpoint.trial_running
+        return True
+
+    def acquire(self, exclude=()):
+        """未完了リクエスト数が最も少ない利用可能なエンジンを選ぶ（なければ None）"""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e.url not in exclude and self._available(e, now)]
+            if not candidates and exclude:
+                # 今回失敗したエンジンしか残っていない場合は再度試す
+                candidates = [e for e in self.endpoints if self._available(e, now)]
+            if not candidates:
+                return None
+            least = min(e.outstanding for e in candidates)
+            endpoint = random.choice([e for e in candidates if e.outstanding == least])
+            endpoint.outstanding += 1
+            if endpoint.state == HALF_OPEN:
+                endpoint.trial_running = True
+            return endpoint
+
+    def release(self, endpoint, success, error=None):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.trial_running = False
+            if success:
+                endpoint.failures = 0
+                endpoint.state = CLOSED
+                endpoint.healthy = True
+                return
+            endpoint.failures += 1
+            endpoint.last_error = error
+            if endpoint.state == HALF_OPEN or endpoint.failures >= self.failure_threshold:
+                endpoint.state = OPEN
+                endpoint.opened_at = time.monotonic()
+
+    # --- リクエスト ---
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """エンジンにリクエストを送る（失敗時は別のエンジンで指数バックオフ付きリトライ）
+
+        4xx 応答はリクエスト自体の誤りとしてリトライしません。
+        """
+        import requests
+
+        self.start_probing()
+        tried = []
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            supervisor.check_cancelled()
+            if attempt:
+                # 指数バックオフ（ジッター付き）
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+            endpoint = self.acquire(exclude=tried)
+            if endpoint is None:
+                metrics.inc('voicevox_errors_total', path=path, reason="unavailable")
+                last_error = "利用可能なVOICEVOXエンジンがありません（すべて停止中またはサーキットオープン）"
+                continue
+            tried.append(endpoint.url)
+            try:
+                with metrics.timed('voicevox_request_duration_seconds', path=path):
+                    response = requests.request(
+                        method, f"{endpoint.url}{path}",
+                        timeout=(CONNECT_TIMEOUT, timeout or self.read_timeout), **kwargs
+                    )
+            except requests.exceptions.RequestException as e:
+                last_error = f"{endpoint.url}: {str(e)}"
+                metrics.inc('voicevox_errors_total', path=path, reason="connection")
+                self.release(endpoint, False, last_error)
+                continue
+            if response.status_code >= 500:
+                last_error = f"{endpoint.url}: HTTP {response.status_code}"
+                metrics.inc('voicevox_errors_total', path=path, reason="http_5xx")
+                self.release(endpoint, False, last_error)
+                continue
+            self.release(endpoint, True)
+            if response.status_code >= 400:
+                metrics.inc('voicevox_errors_total', path=path, reason="http_4xx")
+                raise Exception(f"VOICEVOXがリクエストを拒否しました (接続先: {endpoint.url}): HTTP {response.status_code} {response.text[:200]}")
+            return response
+        raise Exception(f"VOICEVOXとの通信に失敗しました (接続先: {', '.join(e.url for e in self.endpoints)}): {last_error}")
+
+    # --- ヘルスチェック ---
+
+    def probe(self):
+        """全エンジンの /version を確認して healthy を更新"""
+        import requests
+
+        for endpoint in self.endpoints:
+            try:
+                healthy = requests.get(f"{endpoint.url}/version", timeout=(CONNECT_TIMEOUT, 5)).status_code == 200
+            except requests.exceptions.RequestException:
+                healthy = False
+            with self.lock:
+                endpoint.healthy = healthy
+                if healthy and endpoint.state == OPEN and time.monotonic() - endpoint.opened_at >= self.reset_timeout:
+                    endpoint.state = HALF_OPEN
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            self.probe()
+
+    def start_probing(self):
+        """バックグラウンドのヘルスチェックを開始（エンジンが1つの場合は行わない）"""
+        if self._prober is not None or len(self.endpoints) < 2 or self.probe_interval <= 0:
+            return
+        with self.lock:
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name="voicevox-probe", daemon=True)
+                self._prober.start()
+
+    def close(self):
+        self._stop.set()
+
+    def status(self):
+        with self.lock:
+            return [e.snapshot() for e in self.endpoints]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_voicevox_pool():
+    """プロセス内で共有するエンジンプール（環境変数の設定から作成）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = VoicevoxPool(
+                get_voicevox_urls(),
+                failure_threshold=int(os.getenv('VOICEVOX_FAILURE_THRESHOLD', '3')),
+                reset_timeout=float(os.getenv('VOICEVOX_RESET_TIMEOUT', '30')),
+                probe_interval=float(os.getenv('VOICEVOX_PROBE_INTERVAL', '10')),
+                max_retries=int(os.getenv('VOICEVOX_MAX_RETRIES', '2')),
+                read_timeout=float(os.getenv('VOICEVOX_TIMEOUT', '30')),
+            )
+        return _pool
+
+
+# 長いテキストを分割する区切り文字（文末・読点・改行）
+SENTENCE_DELIMITERS = "。！？!?\n"
+CLAUSE_DELIMITERS = "、，,"
+CLOSING_BRACKETS = "」』）)】〕"   # 区切り文字の直後の閉じ括弧は前のチャンクに含める
+MAX_CHUNK_CHARS = 60     # 読点で区切った部分をまとめる最大文字数
+SENTENCE_PAUSE = 0.35    # 文末のあとに入れる無音（秒）
+CLAUSE_PAUSE = 0.15      # 読点のあとに入れる無音（秒）
+
+
+def split_text_for_synthesis(text, max_chars=MAX_CHUNK_CHARS):
+    """合成用にテキストを分割して [(チャンク, 区切りの種類), ...] を返す
+
+    文末（。！？）と改行では必ず区切り、読点（、）では max_chars を超えない範囲でまとめます。
+    区切りの種類は "sentence" または "clause"（最後のチャンクは "sentence"）。
+    """
+    pieces = []
+    current = ""
+    for ch in text:
+        if ch == '\n':
+            pieces.append((current, "sentence"))
+            current = ""
+            continue
+        if ch in CLOSING_BRACKETS and not current.strip() and pieces:
+            pieces[-1] = (pieces[-1][0] + ch, pieces[-1][1])
+            continue
+        current += ch
+        if ch in SENTENCE_DELIMITERS:
+            pieces.append((current, "sentence"))
+            current = ""
+        elif ch in CLAUSE_DELIMITERS:
+            pieces.append((current, "clause"))
+            current = ""
+    pieces.append((current, "sentence"))
+
+    chunks = []
+    for piece, boundary in pieces:
+        piece = piece.strip()
+        # 記号だけの断片は読み上げるものがないので、区切りだけ反映する
+        if not any(ch.isalnum() for ch in piece):
+            if chunks and boundary == "sentence":
+                chunks[-1] = (chunks[-1][0] + piece, "sentence")
+            continue
+        if chunks and chunks[-1][1] == "clause" and len(chunks[-1][0]) + len(piece) <= max_chars:
+            chunks[-1] = (chunks[-1][0] + piece, boundary)
+        else:
+            chunks.append((piece, boundary))
+    if chunks:
+        chunks[-1] = (chunks[-1][0], "sentence")
+    return chunks
+
+
+def query_timings(query):
+    """audio_query の結果からアクセント句ごとの発話区間を計算（合成する音声の先頭からの秒数）
+
+    各モーラの子音・母音の長さと句の後の無音（pause_mora）を足し合わせ、話速で割ります。
+    戻り値: ([{'start': 開始, 'end': 終了, 'moras': モーラ数}, ...], 音声全体の長さ)
+    """
+    speed = query.get('speedScale') or 1.0
+    t = query.get('prePhonemeLength') or 0.0
+    phrases = []
+    for phrase in query.get('accent_phrases') or []:
+        start = t
+        moras = phrase.get('moras') or []
+        for mora in moras:
+            t += (mora.get('consonant_length') or 0.0) + (mora.get('vowel_length') or 0.0)
+        phrases.append({'start': start / speed, 'end': t / speed, 'moras': len(moras)})
+        pause = phrase.get('pause_mora')
+        if pause:
+            t += pause.get('vowel_length') or 0.0
+    t += query.get('postPhonemeLength') or 0.0
+    return phrases, t / speed
+
+
+def _wav_duration(data):
+    import io
+    import wave
+
+    with wave.open(io.BytesIO(data), 'rb') as chunk:
+        return chunk.getnframes() / chunk.getframerate()
+
+
+def _chunk_timing(text, query, offset):
+    """チャンクの発話区間（offset は連結後の音声でのチャンクの開始位置）"""
+    phrases, _ = query_timings(query)
+    phrases = [
+        {'start': offset + p['start'], 'end': offset + p['end'], 'moras': p['moras']}
+        for p in phrases
+    ]
+    start = phrases[0]['start'] if phrases else offset
+    end = phrases[-1]['end'] if phrases else offset
+    return {'text': text, 'start': start, 'end': end, 'phrases': phrases}
+
+
+def _synthesize(pool, text, speaker_id):
+    """1チャンクを合成して (WAVのバイト列, audio_query の結果) を返す"""
+    import json
+
+    # 音響特徴量の生成（合成より軽いので最大10秒。VOICEVOX_TIMEOUT の方が短ければそちら）
+    query_response = pool.request(
+        'post', '/audio_query', params={'text': text, 'speaker': speaker_id}, timeout=min(10, pool.read_timeout)
+    )
+    query_data = query_response.json()
+
+    # 音声合成
+    synthesis_response = pool.request(
+        'post', '/synthesis',
+        params={'speaker': speaker_id},
+        headers={"Content-Type": "application/json"},
+        data=json.dumps(query_data),
+    )
+    return synthesis_response.content, query_data
+
+
+def _join_wav(chunks, pauses, output_path):
+    """WAVのバイト列を指定した無音（秒）を挟んで連結"""
+    import io
+    import wave
+
+    params = None
+    with wave.open(output_path, 'wb') as out:
+        for data, pause in zip(chunks, pauses):
+            with wave.open(io.BytesIO(data), 'rb') as chunk:
+                if params is None:
+                    params = chunk.getparams()
+                    out.setnchannels(params.nchannels)
+                    out.setsampwidth(params.sampwidth)
+                    out.setframerate(params.framerate)
+                elif (chunk.getnchannels(), chunk.getsampwidth(), chunk.getframerate()) != params[:3]:
+                    raise Exception("合成した音声の形式がチャンクごとに異なります")
+                out.writeframes(chunk.readframes(chunk.getnframes()))
+            if pause > 0:
+                silence_frames = int(round(pause * params.framerate))
+                out.writeframes(b'\x00' * silence_frames * params.nchannels * params.sampwidth)
+    return output_path
+
+
+def generate_voice_with_voicevox(text, speaker_id=10, output_path=None,
+                                 sentence_pause=SENTENCE_PAUSE, clause_pause=CLAUSE_PAUSE, chunk_retries=2):
+    """VOICEVOXを使用して音声を生成（雨晴はう: speaker_id=10）
+
+    長いテキストは文・読点の単位に分割して並列に合成し、区切りに無音を挟んで連結します。
+    失敗したチャンクだけを chunk_retries 回まで再合成します。
+    """
+    return generate_voice_with_timings(
+        text, speaker_id, output_path, sentence_pause, clause_pause, chunk_retries
+    )[0]
+
+
+def generate_voice_with_timings(text, speaker_id=10, output_path=None,
+                                sentence_pause=SENTENCE_PAUSE, clause_pause=CLAUSE_PAUSE, chunk_retries=2):
+    """音声を生成し、チャンク（文・読点の区切り）ごとの発話区間も返す
+
+    発話区間は合成に使った audio_query のモーラ長から計算するため、追加の解析は行いません。
+    戻り値: (WAVのパス, [{'text': チャンク, 'start': 秒, 'end': 秒,
+                          'phrases': [{'start', 'end', 'moras'}, ...]}, ...])
+    """
+    import contextvars
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    if output_path is None:
+        output_path = tempfile.mktemp(suffix='.wav')
+
+    pool = get_voicevox_pool()
+    chunks = split_text_for_synthesis(text) or [(text, "sentence")]
+    try:
+        if len(chunks) == 1:
+            data, query = _synthesize(pool, chunks[0][0], speaker_id)
+            with open(output_path, 'wb') as f:
+                f.write(data)
+            return output_path, [_chunk_timing(chunks[0][0], query, 0.0)]
+
+        results = [None] * len(chunks)
+        errors = {}
+        workers = max(1, int(os.getenv('VOICEVOX_CONCURRENCY', '4')))
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(chunks)))
+        try:
+            pending = list(range(len(chunks)))
+            for _ in range(chunk_retries + 1):
+                # 取り消しの設定（supervisor.supervise）を合成スレッドにも引き継ぐ
+                futures = {
+                    i: executor.submit(contextvars.copy_context().run, _synthesize, pool, chunks[i][0], speaker_id)
+                    for i in pending
+                }
+                pending = []
+                for i, future in futures.items():
+                    try:
+                        results[i] = supervisor.wait_result(future)
+                    except Exception as e:
+                        errors[i] = e
+                        pending.append(i)
+                if not pending:
+                    break
+        finally:
+            # 取り消された場合は応答待ちのリクエストを待たずに戻る（各リクエストは VOICEVOX_TIMEOUT で終わる）
+            executor.shutdown(wait=False, cancel_futures=True)
+        if pending:
+            raise Exception(f"{len(pending)}/{len(chunks)}個の区間の合成に失敗しました: {str(errors[pending[0]])}")
+
+        # 最後のチャンクのあとには無音を入れない
+        pauses = [sentence_pause if boundary == "sentence" else clause_pause for _, boundary in chunks]
+        pauses[-1] = 0
+        _join_wav([data for data, _ in results], pauses, output_path)
+
+        # 各チャンクの開始位置 = それまでのチャンクの実際の長さ + 無音
+        timings = []
+        offset = 0.0
+        for (chunk_text, _), (data, query), pause in zip(chunks, results, pauses):
+            timings.append(_chunk_timing(chunk_text, query, offset))
+            offset += _wav_duration(data) + pause
+        return output_path, timings
+
+    except Exception as e:
+        if str(e).startswith("VOICEVOX"):
+            raise
+        raise Exception(f"音声生成に失敗しました: {str(e)}")
@@ -0,0 +1,232 @@
+"""VOICEVOXエンジンの代わりに使うローカルのスタブサーバー（テスト・負荷試験用）
+
+標準ライブラリのみで動作し、本物のエンジンと同じ形式で応答します。
+
+    GET  /version, /speakers
+    POST /audio_query?text=...&speaker=...   文字ごとに1モーラのクエリ（句読点で無音）
+    POST /synthesis?speaker=...              クエリの長さどおりのWAV（24kHz・モノラル・正弦波）
+
+同じ入力には常に同じ応答を返すため、音声の長さはテキストの長さに比例します。
+遅延（latency ± jitter 秒）と失敗率（failure_rate、HTTP 503）を指定して、
+タイムアウトやリトライの動作を確認できます。
+
+    python -m movie_converter voicevox-stub --port 50021 --latency 0.2 --failure-rate 0.1
+"""
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SAMPLE_RATE = 24000
+CONSONANT_LENGTH = 0.05    # 1モーラの子音の長さ（秒）
+VOWEL_LENGTH = 0.1         # 1モーラの母音の長さ（秒）
+PAUSE_LENGTH = 0.2         # 句読点の無音（秒）
+PHRASE_MORAS = 4           # アクセント句の最大モーラ数
+PAUSE_CHARACTERS = "、。，．,.！？!?\n"
+
+SPEAKERS = [
+    {
+        'name': "雨晴はう",
+        'speaker_uuid': "00000000-0000-0000-0000-000000000010",
+        'styles': [{'name': "ノーマル", 'id': 10}],
+        'version': "stub",
+    },
+    {
+        'name': "四国めたん",
+        'speaker_uuid': "00000000-0000-0000-0000-000000000002",
+        'styles': [{'name': "ノーマル", 'id': 2}],
+        'version': "stub",
+    },
+]
+
+
+def make_audio_query(text, speaker=10):
+    """テキストから audio_query 形式のクエリを作る（空白以外の1文字 = 1モーラ）"""
+    phrases = []
+    moras = []
+
+    def close_phrase(pause):
+        if moras:
+            phrases.append({
+                'moras': list(moras),
+                'accent': 1,
+                'pause_mora': {
+                    'text': "、", 'consonant': None, 'consonant_length': None,
+                    'vowel': "pau", 'vowel_length': PAUSE_LENGTH, 'pitch': 0.0,
+                } if pause else None,
+                'is_interrogative': False,
+            })
+            moras.clear()
+
+    for char in text:
+        if char in PAUSE_CHARACTERS:
+            close_phrase(pause=True)
+        elif not char.isspace():
+            moras.append({
+                'text': char, 'consonant': "k", 'consonant_length': CONSONANT_LENGTH,
+                'vowel': "a", 'vowel_length': VOWEL_LENGTH, 'pitch': 5.5,
+            })
+            if len(moras) >= PHRASE_MORAS:
+                close_phrase(pause=False)
+    close_phrase(pause=False)
+    # 最後の句の後の無音は postPhonemeLength で表す
+    if phrases:
+        phrases[-1]['pause_mora'] = None
+    return {
+        'accent_phrases': phrases,
+        'speedScale': 1.0,
+        'pitchScale': 0.0,
+        'intonationScale': 1.0,
+        'volumeScale': 1.0,
+        'prePhonemeLength': 0.1,
+        'postPhonemeLength': 0.1,
+        'outputSamplingRate': SAMPLE_RATE,
+        'outputStereo': False,
+        'kana': text,
+    }
+
+
+def query_duration(query):
+    """クエリから合成される音声の長さ（秒）"""
+    total = (query.get('prePhonemeLength') or 0.0) + (query.get('postPhonemeLength') or 0.0)
+    for phrase in query.get('accent_phrases') or []:
+        for mora in phrase.get('moras') or []:
+            total += (mora.get('consonant_length') or 0.0) + (mora.get('vowel_length') or 0.0)
+        if phrase.get('pause_mora'):
+            total += phrase['pause_mora'].get('vowel_length') or 0.0
+    return total / (query.get('speedScale') or 1.0)
+
+
+def synthesize_wav(query, speaker=10):
+    """クエリの長さどおりのWAV（話者ごとに高さの違う正弦波）のバイト列"""
+    frames = int(round(query_duration(query) * SAMPLE_RATE))
+    frequency = 220.0 + 20.0 * (int(speaker) % 10)
+    step = 2 * math.pi * frequency / SAMPLE_RATE
+    samples = struct.pack(f"<{frames}h", *(int(8000 * math.sin(step * i)) for i in range(frames)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes(samples)
+    return buffer.getvalue()
+
+
+class VoicevoxStub:
+    """スタブサーバー（with 文またはstart/stopで起動・停止）
+
+    port=0 の場合は空いているポートを使います（url で確認）。
+    requests / failures / max_concurrent で受け付けた状況を確認できます。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.active = 0
+        self.max_concurrent = 0
+        handler = type('BoundStubHandler', (_StubHandler,), {'stub': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="voicevox-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread = None
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _begin(self):
+        """遅延と失敗を決める（乱数は seed から決まる）"""
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.max_concurrent = max(self.max_concurrent, self.active)
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            fail = self.random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        return delay, fail
+
+    def _end(self):
+        with self.lock:
+            self.active -= 1
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    stub = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/version':
+            return self._send_json(200, "stub")
+        if path == '/speakers':
+            return self._send_json(200, SPEAKERS)
+        return self._send_json(404, {'detail': "Not Found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if url.path not in ('/audio_query', '/synthesis'):
+            return self._send_json(404, {'detail': "Not Found"})
+
+        delay, fail = self.stub._begin()
+        try:
+            time.sleep(delay)
+            if fail:
+                return self._send_json(503, {'detail': "injected failure"})
+            if 'speaker' not in params:
+                return self._send_json(422, {'detail': "speaker is required"})
+            if url.path == '/audio_query':
+                if 'text' not in params:
+                    return self._send_json(422, {'detail': "text is required"})
+                return self._send_json(200, make_audio_query(params['text'], params['speaker']))
+            try:
+                query = json.loads(body.decode('utf-8'))
+            except ValueError:
+                return self._send_json(422, {'detail': "invalid query"})
+            return self._send(200, synthesize_wav(query, params['speaker']), "audio/wav")
+        finally:
+            self.stub._end()
+
+    def log_message(self, format, *args):
+        pass
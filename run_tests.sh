@@ -7,6 +7,8 @@ echo "=================================="
 # Python環境確認
 if command -v python3 &> /dev/null; then
     echo "✅ Python3 検出"
+    # 単体・結合テスト（VOICEVOXはスタブで代用）
+    python3 -m pytest
     python3 test_basic.py
 else
     echo "❌ Python3 が見つかりません"
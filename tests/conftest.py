@@ -0,0 +1,123 @@
+"""テスト共通のフィクスチャ
+
+VOICEVOXはローカルのスタブサーバー（movie_converter.voicevox_stub）で代用し、
+動画・音声・PowerPointはテストのたびに ffmpeg / python-pptx で生成します。
+ネットワークやDockerには依存しません。
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from movie_converter import voicevox  # noqa: E402
+from movie_converter.voicevox_stub import VoicevoxStub  # noqa: E402
+
+requires_ffmpeg = pytest.mark.skipif(
+    shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None,
+    reason="ffmpeg / ffprobe が必要です",
+)
+
+
+@pytest.fixture(autouse=True)
+def isolated_environment(tmp_path, monkeypatch):
+    """キャッシュ・成果物ストア・BGMライブラリをテストごとに分け、VOICEVOXの設定をリセット"""
+    monkeypatch.setenv('MOVIE_CONVERTER_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.delenv('MOVIE_CONVERTER_BGM_DIR', raising=False)
+    for name in ('VOICEVOX_URL', 'VOICEVOX_URLS', 'VOICEVOX_TIMEOUT', 'VOICEVOX_MAX_RETRIES',
+                 'VOICEVOX_CONCURRENCY', 'VOICEVOX_FAILURE_THRESHOLD', 'VOICEVOX_PROBE_INTERVAL'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('VOICEVOX_PROBE_INTERVAL', '0')
+    _reset_pool()
+    yield
+    _reset_pool()
+
+
+def _reset_pool():
+    with voicevox._pool_lock:
+        if voicevox._pool is not None:
+            voicevox._pool.close()
+        voicevox._pool = None
+
+
+@pytest.fixture
+def voicevox_stub(monkeypatch):
+    """スタブサーバーを起動して VOICEVOX_URL に設定する（引数で遅延・失敗率を指定）"""
+    stubs = []
+
+    def start(**kwargs):
+        stub = VoicevoxStub(**kwargs).start()
+        stubs.append(stub)
+        monkeypatch.setenv('VOICEVOX_URL', stub.url)
+        _reset_pool()
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture
+def unused_url():
+    """接続を受け付けないURL（停止したエンジンの代わり）"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', *args], check=True, capture_output=True)
+
+
+@pytest.fixture(scope='session')
+def media_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('media')
+
+
+@pytest.fixture(scope='session')
+def landscape_video(media_dir):
+    """640x360・25fps・2秒・ステレオ音声付き"""
+    path = str(media_dir / 'landscape.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc=s=640x360:r=25:d=2', '-f', 'lavfi', '-i', 'sine=f=440:d=2',
+            '-ac', '2', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+            '-shortest', path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def portrait_video(media_dir):
+    """360x640・30fps・1.5秒・音声なし"""
+    path = str(media_dir / 'portrait.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc2=s=360x640:r=30:d=1.5',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def bgm_audio(media_dir):
+    path = str(media_dir / 'bgm.mp3')
+    _ffmpeg('-f', 'lavfi', '-i', 'sine=f=330:d=1', '-ac', '2', path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def pptx_deck(media_dir):
+    """3枚のスライド（2枚にノートあり）"""
+    pptx = pytest.importorskip('pptx')
+    presentation = pptx.Presentation()
+    for i, notes in enumerate(["最初のスライドです。", "", "最後のスライドです、ありがとう。"]):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"スライド{i + 1}"
+        slide.placeholders[1].text = f"本文{i + 1}"
+        if notes:
+            slide.notes_slide.notes_text_frame.text = notes
+    path = str(media_dir / 'deck.pptx')
+    presentation.save(path)
+    return path
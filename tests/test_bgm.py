@@ -0,0 +1,94 @@
+"""BGMライブラリ: 追加時のデコード・ラウドネス測定、トラックIDの検証、ジョブでのループ再生"""
+import json
+import re
+import subprocess
+
+import pytest
+
+from conftest import _ffmpeg, requires_ffmpeg
+from movie_converter import bgm
+from movie_converter.jobs import run_job
+from movie_converter.media import probe_video
+from movie_converter.shorts import add_bgm_to_video
+
+pytestmark = requires_ffmpeg
+
+
+def _audio_duration(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=duration', '-of', 'json', path],
+        capture_output=True, text=True, check=True,
+    )
+    return float(json.loads(result.stdout)['streams'][0]['duration'])
+
+
+def _tail_volume(path, seconds):
+    """最後の seconds 秒の平均音量（dB）"""
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-sseof', f"-{seconds}", '-i', path, '-vn', '-af', 'volumedetect', '-f', 'null', '-'],
+        capture_output=True, text=True,
+    )
+    return float(re.search(r'mean_volume: (-?[\d.]+|-inf) dB', result.stderr).group(1))
+
+
+def test_add_track_decodes_once_and_measures_loudness(bgm_audio, monkeypatch):
+    track = bgm.add_track(bgm_audio, name="テスト曲")
+    assert re.match(bgm.TRACK_ID_PATTERN, track['id'])
+    assert track['name'] == "テスト曲"
+    assert track['duration'] == pytest.approx(1.0, abs=0.05)
+    assert track['loudness'] < 0 and track['true_peak'] < 0
+    assert bgm.load_pcm(track['id']).shape == (round(track['duration'] * bgm.SAMPLE_RATE), bgm.CHANNELS)
+    assert [t['id'] for t in bgm.list_tracks()] == [track['id']]
+
+    # 同じ内容のファイルはデコードせずに既存のトラックを返す
+    monkeypatch.setattr(subprocess, 'Popen', lambda *args, **kwargs: pytest.fail("デコードしないはず"))
+    assert bgm.add_track(bgm_audio)['id'] == track['id']
+
+
+def test_gain_targets_loudness_within_peak_limit():
+    quiet = {'loudness': -40.0, 'true_peak': -30.0}
+    assert bgm.track_gain(quiet) == pytest.approx(17.0)
+    # ピークが高い場合はトゥルーピークの上限で抑える
+    peaky = {'loudness': -40.0, 'true_peak': -6.0}
+    assert bgm.track_gain(peaky) == pytest.approx(5.0)
+    assert bgm.track_gain({'loudness': None, 'true_peak': None}) == 0.0
+
+
+@pytest.mark.parametrize('track_id', ["../../etc/passwd", "0123456789ABCDEF", "", None])
+def test_invalid_track_ids_are_rejected(track_id):
+    with pytest.raises(ValueError):
+        bgm.get_track(track_id)
+
+
+def test_removed_track_is_not_found(bgm_audio):
+    track = bgm.add_track(bgm_audio)
+    assert bgm.remove_track(track['id'])
+    assert bgm.get_track(track['id'], missing_ok=True) is None
+    with pytest.raises(ValueError, match="見つかりません"):
+        run_job({'tool': "shorts", 'input': "unused.mp4", 'output': "unused_out.mp4", 'bgm_track': track['id']})
+
+
+def test_library_track_loops_over_video_without_audio(portrait_video, bgm_audio, tmp_path):
+    track = bgm.add_track(bgm_audio)
+    warnings = []
+    output = run_job({
+        'tool': "shorts",
+        'input': portrait_video,
+        'output': str(tmp_path / 'short.mp4'),
+        'bgm_track': track['id'],
+    }, on_warning=warnings.append)
+    assert warnings == []
+    assert probe_video(output)['has_audio']
+    # 1秒のBGMを1.5秒の動画の最後までループする
+    assert _audio_duration(output) == pytest.approx(1.5, abs=0.1)
+    assert _tail_volume(output, 0.3) > -40
+
+
+def test_uploaded_bgm_loops_with_delay(landscape_video, media_dir, tmp_path):
+    short_bgm = str(media_dir / 'short_bgm.wav')
+    _ffmpeg('-f', 'lavfi', '-i', 'sine=f=880:d=0.5', '-ac', '2', short_bgm)
+    output = str(tmp_path / 'mixed.mp4')
+    add_bgm_to_video(landscape_video, output, short_bgm, bgm_volume=1.0, original_volume=0.0, bgm_start_time=0.5)
+    assert _audio_duration(output) == pytest.approx(2.0, abs=0.1)
+    # 開始を遅らせてもループは動画の最後まで続く
+    assert _tail_volume(output, 0.3) > -40
@@ -0,0 +1,100 @@
+"""キーフレーム単位の分割エンコード: 区間の選び方・フレーム数と長さ・連続した音声"""
+import json
+import subprocess
+
+import pytest
+
+from conftest import _ffmpeg, requires_ffmpeg
+from movie_converter import chunked
+from movie_converter.shorts import resize_video_to_shorts
+from movie_converter.verify import compare_outputs
+
+pytestmark = requires_ffmpeg
+
+FAST_ENCODING = {'crf': 23, 'preset': 'ultrafast', 'tune': None, 'maxrate': None, 'bufsize': None}
+
+
+@pytest.fixture(scope='session')
+def keyframed_video(media_dir):
+    """640x360・25fps・6秒・1秒ごとにキーフレーム・Bフレームあり・音声付き"""
+    path = str(media_dir / 'keyframed.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc2=s=640x360:r=25:d=6', '-f', 'lavfi', '-i', 'sine=f=440:d=6',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '25', '-bf', '2', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-shortest', path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def offset_video(media_dir):
+    """keyframed_video と同じ内容で、タイムスタンプが10秒から始まる（音声はプライミング分だけ映像より前）"""
+    path = str(media_dir / 'offset.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc2=s=640x360:r=25:d=6', '-f', 'lavfi', '-i', 'sine=f=440:d=6',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '25', '-bf', '2', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-shortest', '-output_ts_offset', '10', path)
+    return path
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(chunked, 'CHUNKED_MIN_SECONDS', 0)
+    monkeypatch.setattr(chunked, 'CHUNK_MIN_SECONDS', 1)
+    monkeypatch.setenv('MOVIE_CONVERTER_ENCODE_WORKERS', '3')
+
+
+def _streams(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-count_frames', '-show_entries', 'stream=codec_type,nb_read_frames,duration',
+         '-of', 'json', path],
+        capture_output=True, text=True, check=True,
+    )
+    return {s['codec_type']: s for s in json.loads(result.stdout)['streams']}
+
+
+def test_boundaries_are_keyframes_of_similar_length(keyframed_video, small_chunks):
+    points, time_base, origin = chunked.keyframes(keyframed_video)
+    assert origin == 0
+    assert len(points) == 6
+    boundaries = chunked.plan_chunks(points, time_base, 0, round(6 / time_base), None, workers=3)
+    assert boundaries[0] == 0 and boundaries[-1] is None
+    assert set(boundaries[1:-1]) <= set(points)
+    assert len(boundaries) - 1 == 6
+    # 短すぎる区間は作らない
+    assert chunked.plan_chunks(points, time_base, 0, round(1.5 / time_base), None, workers=3) == [0, None]
+
+
+def test_keyframes_are_absolute_with_file_start_time(offset_video):
+    points, time_base, origin = chunked.keyframes(offset_video, 1.3, 4.7)
+    assert origin * time_base == pytest.approx(10, abs=0.05)
+    # 読み出す範囲も先頭時刻からの相対（1.3〜4.7秒のキーフレームは 2, 3, 4 秒）
+    assert [round((pts - round(10 / time_base)) * time_base) for pts in points] == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('source', ['keyframed_video', 'offset_video'])
+@pytest.mark.parametrize('trim', [(None, None), (1.3, 4.7)])
+def test_chunked_encode_matches_single_encoder(request, source, small_chunks, tmp_path, monkeypatch, trim):
+    keyframed_video = request.getfixturevalue(source)
+    calls = []
+    original = chunked.encode_chunked
+    monkeypatch.setattr(chunked, 'encode_chunked', lambda *args, **kwargs: calls.append(args) or original(*args, **kwargs))
+    output = resize_video_to_shorts(keyframed_video, str(tmp_path / 'chunked.mp4'),
+                                    start_time=trim[0], end_time=trim[1], encoding=FAST_ENCODING)
+    assert calls
+
+    monkeypatch.setenv('MOVIE_CONVERTER_ENCODE_WORKERS', '1')
+    reference = resize_video_to_shorts(keyframed_video, str(tmp_path / 'single.mp4'),
+                                       start_time=trim[0], end_time=trim[1], encoding=FAST_ENCODING)
+    assert len(calls) == 1
+
+    actual, expected = _streams(output), _streams(reference)
+    # 境界でフレームが重複・欠落せず、音声は1本で途切れない
+    assert actual['video']['nb_read_frames'] == expected['video']['nb_read_frames']
+    assert float(actual['video']['duration']) == pytest.approx(float(expected['video']['duration']), abs=0.001)
+    assert float(actual['audio']['duration']) == pytest.approx(float(expected['audio']['duration']), abs=0.03)
+    if trim == (None, None):
+        assert compare_outputs(reference, output)['passed']
+
+
+def test_short_inputs_are_not_split(landscape_video, tmp_path, monkeypatch):
+    monkeypatch.setenv('MOVIE_CONVERTER_ENCODE_WORKERS', '4')
+    monkeypatch.setattr(chunked, 'encode_chunked', lambda *args, **kwargs: pytest.fail("分割しないはず"))
+    resize_video_to_shorts(landscape_video, str(tmp_path / 'short.mp4'), encoding=FAST_ENCODING)
@@ -0,0 +1,93 @@
+"""カバー画像の候補: まとめた採点・転換の途中の除外・元の解像度での書き出し・ショート動画での出力"""
+import numpy as np
+import pytest
+
+from conftest import _ffmpeg, requires_ffmpeg
+from movie_converter import cover, media
+from movie_converter.cli import execute_job
+from movie_converter.media import probe_video
+
+
+@pytest.fixture(scope='session')
+def scenes_video(media_dir):
+    """640x360・25fps・7秒: 鮮明（0〜2秒）→ 黒（2〜4秒）→ ぼかし（4〜5秒）→ 1秒のフェードで別の鮮明な場面へ"""
+    path = str(media_dir / 'scenes.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc2=s=640x360:r=25:d=2', '-f', 'lavfi', '-i', 'color=black:s=640x360:r=25:d=2',
+            '-f', 'lavfi', '-i', 'testsrc2=s=640x360:r=25:d=2', '-f', 'lavfi', '-i', 'testsrc=s=640x360:r=25:d=2',
+            '-filter_complex', '[2]gblur=sigma=8[blur];[0][1][blur]concat=n=3,settb=1/25[first];[3]settb=1/25[second];'
+            '[first][second]xfade=transition=fade:duration=1:offset=5[v]',
+            '-map', '[v]', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path)
+    return path
+
+
+def test_batch_metrics_rank_sharp_and_exposed_frames():
+    import cv2
+
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(40, 200, size=(90, 160), dtype=np.uint8)
+    blurred = cv2.GaussianBlur(sharp, (0, 0), 4)
+    dark = (sharp // 16).astype(np.uint8)
+    metrics = cover.frame_metrics(np.stack([sharp, blurred, dark]))
+    assert metrics['sharpness'][0] > metrics['sharpness'][1] * 10
+    assert metrics['exposure'][0] > 0.8 > 0.1 > metrics['exposure'][2]
+    # 先頭は比べるフレームがない。previous を渡すと続きとして差分を求める
+    assert np.isnan(metrics['change'][0])
+    continued = cover.frame_metrics(np.stack([sharp]), previous=sharp)
+    assert continued['change'][0] == 0
+
+
+def test_frames_in_the_middle_of_a_transition_score_zero():
+    metrics = {
+        'times': [0.0, 0.5, 1.0, 1.5],
+        'sharpness': [500.0] * 4,
+        'exposure': [0.9] * 4,
+        'face': [0.0] * 4,
+        # 0.5秒のフレームは前後どちらとも大きく違う。1.0秒はカット直後で次のフレームとは同じ
+        'change': [None, 0.3, 0.3, 0.01],
+    }
+    scores = cover.score_frames(metrics)
+    assert scores[1] == 0
+    assert scores[0] == pytest.approx(scores[2]) == pytest.approx(scores[3])
+
+
+def test_picked_covers_are_apart():
+    times = [0.0, 0.5, 1.0, 1.5, 2.0]
+    assert cover.pick_covers(times, [0.9, 0.8, 0.1, 0.7, 0.6], count=3, min_gap=1.0) == [0, 3]
+    assert cover.pick_covers(times, [0.9, 0.8, 0.1, 0.7, 0.6], count=2) == [0, 1]
+
+
+@pytest.mark.parametrize('covers', [-1, 11, 1.5, "3", True])
+def test_invalid_cover_counts_are_rejected(covers):
+    with pytest.raises(ValueError):
+        cover.normalize_cover_count(covers)
+
+
+@requires_ffmpeg
+def test_covers_skip_dark_blurred_and_fading_frames(scenes_video, tmp_path, monkeypatch):
+    decodes = []
+    original = media.iter_frames
+    monkeypatch.setattr(media, 'iter_frames', lambda *args, **kwargs: decodes.append(args) or original(*args, **kwargs))
+    covers = cover.select_covers(scenes_video, 3, str(tmp_path / 'out.mp4'))
+    assert len(decodes) == 1
+    assert [c['path'] for c in covers] == [str(tmp_path / f'out_cover{i}.jpg') for i in (1, 2, 3)]
+    assert [c['score'] for c in covers] == sorted((c['score'] for c in covers), reverse=True)
+    for c in covers:
+        assert c['time'] < 2 or c['time'] >= 6
+        # 縮小せず元の解像度で書き出す
+        info = probe_video(c['path'])
+        assert (info['width'], info['height']) == (640, 360)
+
+    # 同じ動画は再解析しない
+    assert cover.select_covers(scenes_video, 3, str(tmp_path / 'again.mp4'))[0]['time'] == covers[0]['time']
+    assert len(decodes) == 1
+
+
+@requires_ffmpeg
+def test_shorts_job_writes_covers_next_to_output(landscape_video, tmp_path):
+    output = str(tmp_path / 'out' / 'short.mp4')
+    result = execute_job({'tool': "shorts", 'input': landscape_video, 'output': output, 'covers': 2})
+    assert result['status'] == "done", result.get('error')
+    assert result['covers'] == [str(tmp_path / 'out' / 'short_cover1.jpg'), str(tmp_path / 'out' / 'short_cover2.jpg')]
+    info = probe_video(result['covers'][0])
+    assert (info['width'], info['height']) == (1080, 1920)
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == ['short.mp4', 'short_cover1.jpg', 'short_cover2.jpg']
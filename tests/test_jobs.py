@@ -0,0 +1,115 @@
+"""ジョブ全体（ショート動画・結合・PowerPoint）をスタブのVOICEVOXで実行"""
+import shutil
+
+import pytest
+
+from conftest import _reset_pool, requires_ffmpeg
+from movie_converter.cache import get_cache_dir
+from movie_converter.jobs import run_job
+from movie_converter.media import probe_video
+
+pytestmark = requires_ffmpeg
+
+
+def test_shorts_job_with_voice_subtitles_and_bgm(voicevox_stub, unused_url, monkeypatch, landscape_video, bgm_audio,
+                                                 tmp_path):
+    stub = voicevox_stub(latency=0.05)
+    spec = {
+        'tool': "shorts",
+        'input': landscape_video,
+        'output': str(tmp_path / 'short.mp4'),
+        'voices': [{'text': "こんにちは、テストです。", 'start_time': 0.2, 'volume': 1.0}],
+        'voice_subtitles': "karaoke",
+        'bgm_path': bgm_audio,
+    }
+    warnings = []
+    progress = []
+    output = run_job(spec, progress=lambda p, m: progress.append(p), on_warning=warnings.append)
+    assert warnings == []
+    assert progress[-1] == 100
+    info = probe_video(output)
+    assert (info['width'], info['height'], info['has_audio']) == (1080, 1920, True)
+    assert info['duration'] == pytest.approx(2.0, abs=0.15)
+    # 字幕用に合成した音声をそのまま使うため、合成は1回（audio_query + synthesis）
+    assert stub.requests == 2
+
+    # 同じジョブは成果物ストアから復元し、VOICEVOXも呼ばない
+    progress.clear()
+    run_job(dict(spec, output=str(tmp_path / 'again.mp4')), progress=lambda p, m: progress.append(p))
+    assert stub.requests == 2
+    assert (tmp_path / 'again.mp4').read_bytes() == (tmp_path / 'short.mp4').read_bytes()
+
+    # 発話タイミングのキャッシュが消え、VOICEVOXが止まっていても、保存済みの結果を警告なしで返す
+    shutil.rmtree(get_cache_dir('voice_timings'))
+    monkeypatch.setenv('VOICEVOX_URL', unused_url)
+    monkeypatch.setenv('VOICEVOX_MAX_RETRIES', '0')
+    _reset_pool()
+    run_job(dict(spec, output=str(tmp_path / 'third.mp4')), on_warning=warnings.append)
+    assert warnings == []
+    assert stub.requests == 2
+    assert (tmp_path / 'third.mp4').read_bytes() == (tmp_path / 'short.mp4').read_bytes()
+
+
+def test_shorts_job_warns_when_voicevox_is_down(unused_url, monkeypatch, landscape_video, bgm_audio, tmp_path):
+    monkeypatch.setenv('VOICEVOX_URL', unused_url)
+    monkeypatch.setenv('VOICEVOX_MAX_RETRIES', '0')
+    warnings = []
+    output = run_job({
+        'tool': "shorts",
+        'input': landscape_video,
+        'output': str(tmp_path / 'short.mp4'),
+        # spec の path は使わない（サーバー上の任意のファイルを読ませない）ので、合成に失敗して警告になる
+        'voices': [{'text': "届かない音声", 'start_time': 0.0, 'volume': 1.0, 'path': bgm_audio}],
+    }, on_warning=warnings.append)
+    assert warnings
+    assert probe_video(output)['width'] == 1080
+
+
+def test_combine_job(landscape_video, portrait_video, tmp_path):
+    output = run_job({
+        'tool': "combine",
+        'inputs': [portrait_video, landscape_video],
+        'output': str(tmp_path / 'combined.mp4'),
+        'transition': "dissolve",
+        'transition_duration': 0.3,
+    })
+    assert probe_video(output)['duration'] == pytest.approx(3.2, abs=0.1)
+
+
+@pytest.mark.parametrize('tool', ["shorts", "combine"])
+def test_preview_is_written_by_the_final_encode(tool, landscape_video, portrait_video, tmp_path, monkeypatch):
+    from movie_converter import jobs
+    from movie_converter.preview import join_live_segments, playlist_segments, write_hls
+
+    spec = {'tool': tool, 'output': str(tmp_path / 'out.mp4'), 'preview_dir': str(tmp_path / 'preview')}
+    spec.update({'input': landscape_video} if tool == "shorts" else {'inputs': [portrait_video, landscape_video]})
+    # 完成後の分割ではなく、最後のエンコードの出力を tee で分けてHLSを書き出す
+    monkeypatch.setattr(jobs, 'write_hls', lambda *args: pytest.fail("完成後に分割しました"))
+    output = run_job(spec)
+    segments, finished = playlist_segments(spec['preview_dir'])
+    assert finished and segments and all(name.endswith('.m4s') for name in segments)
+    # 書き終わったセグメントをつなぐと、UIで再生できるMP4になる
+    assert join_live_segments(spec['preview_dir'], str(tmp_path / 'partial.mp4')) == len(segments)
+    assert probe_video(str(tmp_path / 'partial.mp4'))['duration'] == pytest.approx(probe_video(output)['duration'], abs=0.1)
+
+    # 成果物ストアの結果を使う場合はエンコードしないので、完成した動画を分割する
+    monkeypatch.setattr(jobs, 'write_hls', write_hls)
+    run_job(dict(spec, output=str(tmp_path / 'again.mp4'), preview_dir=str(tmp_path / 'again')))
+    segments, finished = playlist_segments(str(tmp_path / 'again'))
+    assert finished and segments and all(name.endswith('.ts') for name in segments)
+
+
+def test_pptx_job_narrates_notes(voicevox_stub, pptx_deck, tmp_path, monkeypatch):
+    monkeypatch.setenv('VOICEVOX_CONCURRENCY', '2')
+    stub = voicevox_stub(latency=0.05)
+    output = run_job({
+        'tool': "pptx",
+        'input': pptx_deck,
+        'output': str(tmp_path / 'slides.mp4'),
+        'slide_duration': 2,
+    }, on_warning=lambda message: None)
+    info = probe_video(output)
+    assert info['has_audio']
+    # ノートのあるスライドは最低3秒、ノートのないスライドは slide_duration
+    assert info['duration'] == pytest.approx(3 + 2 + 3, abs=0.3)
+    assert stub.requests > 0
@@ -0,0 +1,91 @@
+"""ffmpeg を使う処理（動画情報・フィルムストリップ・リサイズ・結合・プレビュー）"""
+import os
+
+import pytest
+
+from conftest import requires_ffmpeg
+from movie_converter.combine import combine_videos, concat_videos_copy
+from movie_converter.filmstrip import create_filmstrip
+from movie_converter.media import probe_video
+from movie_converter.preview import PLAYLIST_NAME, live_hls, output_args, write_hls
+from movie_converter.shorts import normalize_renditions, rendition_path, resize_video_to_shorts
+
+pytestmark = requires_ffmpeg
+
+
+def test_probe_video(landscape_video, portrait_video):
+    info = probe_video(landscape_video)
+    assert (info['width'], info['height'], info['has_audio']) == (640, 360, True)
+    assert info['fps'] == pytest.approx(25)
+    assert info['duration'] == pytest.approx(2.0, abs=0.1)
+    assert probe_video(portrait_video)['has_audio'] is False
+
+
+def test_probe_video_reports_missing_file(tmp_path):
+    with pytest.raises(Exception, match="動画情報の取得に失敗しました"):
+        probe_video(str(tmp_path / 'missing.mp4'))
+
+
+def test_filmstrip_is_cached(landscape_video):
+    first = create_filmstrip(landscape_video, count=4, thumb_width=80)
+    assert first['thumb_height'] == 44
+    assert first['times'] == [0.0, 0.5, 1.0, 1.5]
+    mtime = os.path.getmtime(first['image_path'])
+    second = create_filmstrip(landscape_video, count=4, thumb_width=80)
+    assert second == first
+    assert os.path.getmtime(second['image_path']) == mtime
+
+
+def test_resize_with_renditions(landscape_video, tmp_path):
+    output = str(tmp_path / 'short.mp4')
+    renditions = [{'name': "small", 'width': 180, 'height': 320, 'preset': "ultrafast"}]
+    resize_video_to_shorts(landscape_video, output, start_time=0.5, end_time=1.5, renditions=renditions)
+    master = probe_video(output)
+    small = probe_video(rendition_path(output, "small"))
+    assert (master['width'], master['height']) == (1080, 1920)
+    assert (small['width'], small['height']) == (180, 320)
+    assert master['duration'] == pytest.approx(1.0, abs=0.1)
+    assert small['duration'] == pytest.approx(master['duration'], abs=0.05)
+
+
+def test_unknown_rendition_preset():
+    with pytest.raises(ValueError, match="不明なレンディション"):
+        normalize_renditions(["4k"])
+
+
+def test_combine_mixed_inputs_with_transition(landscape_video, portrait_video, tmp_path):
+    plain = combine_videos([landscape_video, portrait_video], str(tmp_path / 'plain.mp4'))
+    faded = combine_videos(
+        [landscape_video, portrait_video], str(tmp_path / 'faded.mp4'), transition="fade", transition_duration=0.4
+    )
+    plain_info, faded_info = probe_video(plain), probe_video(faded)
+    # 最大の幅・高さのキャンバスにそろえ、音声のない動画には無音を入れる
+    assert (plain_info['width'], plain_info['height'], plain_info['has_audio']) == (640, 640, True)
+    assert plain_info['fps'] == pytest.approx(30)
+    assert plain_info['duration'] == pytest.approx(3.5, abs=0.1)
+    assert faded_info['duration'] == pytest.approx(3.1, abs=0.1)
+
+
+def test_concat_copy_and_hls(landscape_video, tmp_path):
+    output = concat_videos_copy([landscape_video, landscape_video], str(tmp_path / 'concat.mp4'))
+    assert probe_video(output)['duration'] == pytest.approx(4.0, abs=0.1)
+    playlist = write_hls(output, str(tmp_path / 'preview'), segment_seconds=1)
+    assert os.path.basename(playlist) == PLAYLIST_NAME
+    with open(playlist) as f:
+        content = f.read()
+    assert "#EXT-X-ENDLIST" in content
+    segments = [line for line in content.splitlines() if line.endswith('.ts')]
+    assert segments and all(os.path.exists(tmp_path / 'preview' / name) for name in segments)
+
+
+def test_live_hls_tees_only_its_own_output(tmp_path):
+    output = str(tmp_path / 'out.mp4')
+    assert output_args(output) == ['-movflags', '+faststart', output]
+    with live_hls(output, str(tmp_path / 'preview')):
+        args = output_args(output)
+        assert args[args.index('-f') + 1] == "tee"
+        assert output_args(str(tmp_path / 'other.mp4'))[-1] == str(tmp_path / 'other.mp4')
+    # tee の区切り文字を含むパスでは分けない（完成後に write_hls で分割する）
+    odd = str(tmp_path / 'a:b.mp4')
+    with live_hls(odd, str(tmp_path / 'preview')):
+        assert output_args(odd) == ['-movflags', '+faststart', odd]
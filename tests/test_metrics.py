@@ -0,0 +1,41 @@
+"""メトリクスの記録とPrometheusテキスト形式の出力"""
+import json
+
+from movie_converter import metrics
+
+
+def _lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_histogram_buckets_are_cumulative():
+    for value in (0.07, 0.3, 0.3, 40):
+        metrics.observe('voicevox_request_duration_seconds', value, path="/test_histogram")
+    text = metrics.render()
+    buckets = {}
+    for line in _lines(text, 'movie_converter_voicevox_request_duration_seconds_bucket{path="/test_histogram"'):
+        bound = line.split('le="')[1].split('"')[0]
+        buckets[bound] = int(line.rsplit(' ', 1)[1])
+    assert buckets['0.05'] == 0
+    assert buckets['0.1'] == 1
+    assert buckets['0.5'] == 3
+    assert buckets['30'] == 3
+    assert buckets['+Inf'] == 4
+    assert 'movie_converter_voicevox_request_duration_seconds_count{path="/test_histogram"} 4' in text
+    assert '# TYPE movie_converter_voicevox_request_duration_seconds histogram' in text
+
+
+def test_labels_are_escaped():
+    metrics.inc('voicevox_errors_total', reason='quote"back\\slash')
+    assert 'reason="quote\\"back\\\\slash"' in metrics.render()
+
+
+def test_render_merges_worker_snapshots(tmp_path):
+    metrics.inc('jobs_completed_total', tool="test_merge")
+    worker = {'values': [['jobs_completed_total', {'tool': "test_merge"}, 2]], 'histograms': []}
+    (tmp_path / '12345.json').write_text(json.dumps(worker))
+    (tmp_path / 'broken.json').write_text("{")
+    text = metrics.render(str(tmp_path))
+    assert _lines(text, 'movie_converter_jobs_completed_total{tool="test_merge"}') == [
+        'movie_converter_jobs_completed_total{tool="test_merge"} 3'
+    ]
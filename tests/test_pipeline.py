@@ -0,0 +1,134 @@
+"""段階の並列処理（run_pipeline）と成果物ストア（run_stages）"""
+import os
+import threading
+import time
+
+import pytest
+
+from movie_converter import store
+from movie_converter.pipeline import run_pipeline
+
+
+def test_results_keep_input_order():
+    def slow_when_even(x):
+        time.sleep(0.02 if x % 2 == 0 else 0.0)
+        return x
+
+    completed = []
+    results = run_pipeline(
+        range(10),
+        [("double", lambda x: x * 2, 3), ("wait", slow_when_even, 2), ("inc", lambda x: x + 1, 1)],
+        on_result=lambda index, result: completed.append(index),
+    )
+    assert results == [x * 2 + 1 for x in range(10)]
+    assert sorted(completed) == list(range(10))
+
+
+def test_first_error_stops_the_pipeline():
+    processed = []
+    lock = threading.Lock()
+
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("失敗")
+        return x
+
+    def record(x):
+        time.sleep(0.01)
+        with lock:
+            processed.append(x)
+        return x
+
+    with pytest.raises(ValueError, match="失敗"):
+        run_pipeline(range(100), [("check", fail_on_three, 1), ("record", record, 1)], queue_size=1)
+    assert len(processed) < 100
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _append_stage(name, suffix, calls, warning=None):
+    def run(src, dst, warn):
+        calls.append(name)
+        with open(src) as f:
+            content = f.read()
+        _write(dst, content + suffix)
+        if warning:
+            warn(warning)
+
+    return {'name': name, 'params': {'suffix': suffix}, 'run': run, 'percent': 50, 'message': name}
+
+
+def test_run_stages_resumes_from_last_stored_stage(tmp_path):
+    source = tmp_path / 'source.txt'
+    _write(source, "a")
+    calls = []
+    stages = [_append_stage("first", "b", calls), _append_stage("second", "c", calls)]
+    assert store.run_stages("source", str(source), stages, str(tmp_path / 'out1.txt')) == 0
+    assert (tmp_path / 'out1.txt').read_text() == "abc"
+    assert calls == ["first", "second"]
+
+    # 同じジョブはストアから復元する
+    calls.clear()
+    assert store.run_stages("source", str(source), stages, str(tmp_path / 'out2.txt')) == 2
+    assert (tmp_path / 'out2.txt').read_text() == "abc"
+    assert calls == []
+
+    # 最後の段階のパラメータだけ変えた場合は、その段階だけ再計算する
+    stages[1] = _append_stage("second", "d", calls)
+    assert store.run_stages("source", str(source), stages, str(tmp_path / 'out3.txt')) == 1
+    assert (tmp_path / 'out3.txt').read_text() == "abd"
+    assert calls == ["second"]
+    assert source.read_text() == "a"
+
+
+def test_stages_with_warnings_are_not_stored(tmp_path):
+    source = tmp_path / 'source.txt'
+    _write(source, "a")
+    calls = []
+    warnings = []
+    stages = [_append_stage("first", "b", calls, warning="警告"), _append_stage("second", "c", calls)]
+    store.run_stages("source", str(source), stages, str(tmp_path / 'out.txt'), on_warning=warnings.append)
+    assert warnings == ["警告"]
+    calls.clear()
+    assert store.run_stages("source", str(source), stages, str(tmp_path / 'out.txt')) == 0
+    assert calls == ["first", "second"]
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    for i, key in enumerate(["old", "middle", "new"]):
+        path = tmp_path / f"{key}.bin"
+        path.write_bytes(b"x" * 100)
+        os.utime(store.put(key, str(path)), (1000 + i, 1000 + i))
+    store.lookup("old")   # 参照すると最終利用時刻が新しくなる
+    assert store.evict(budget=250) == 1
+    assert store.lookup("old") is not None
+    assert store.lookup("middle") is None
+    assert store.lookup("new") is not None
+
+
+def test_artifact_removed_after_lookup_falls_back_to_earlier_stage(tmp_path, monkeypatch):
+    source = tmp_path / 'source.txt'
+    _write(source, "a")
+    calls = []
+    stages = [_append_stage("first", "b", calls), _append_stage("second", "c", calls)]
+    store.run_stages("source", str(source), stages, str(tmp_path / 'out1.txt'))
+    calls.clear()
+
+    # 最後の段階の成果物を、見つけた直後に他のプロセスが削除した
+    lookup = store.lookup
+    first_key = store.artifact_key("first", ["source"], {'suffix': "b"})
+    last_key = store.artifact_key("second", [first_key], {'suffix': "c"})
+
+    def lookup_then_evicted(key, suffix='.mp4'):
+        path = lookup(key, suffix)
+        if path is not None and key == last_key:
+            os.unlink(path)
+        return path
+
+    monkeypatch.setattr(store, 'lookup', lookup_then_evicted)
+    assert store.run_stages("source", str(source), stages, str(tmp_path / 'out2.txt')) == 1
+    assert (tmp_path / 'out2.txt').read_text() == "abc"
+    assert calls == ["second"]
@@ -0,0 +1,81 @@
+"""PowerPointの解析（内容ハッシュでのキャッシュ）"""
+import io
+
+import pytest
+
+from movie_converter import presentation
+
+pytest.importorskip('pptx')
+
+
+def test_analysis_reads_text_notes_and_size(pptx_deck):
+    analysis = presentation.analyse_presentation(pptx_deck)
+    assert analysis['slide_count'] == 3
+    assert (analysis['slide_width'], analysis['slide_height']) == (960, 720)
+    assert [slide['notes_text'] for slide in analysis['slides']] == ["最初のスライドです。", "", "最後のスライドです、ありがとう。"]
+    assert analysis['slides'][1]['slide_text'] == "スライド2 本文2"
+    assert analysis['media'] == []
+
+
+def test_analysis_is_cached_by_content(pptx_deck, monkeypatch):
+    with open(pptx_deck, 'rb') as f:
+        data = f.read()
+    monkeypatch.setattr(presentation, '_analysis_memo', {})
+    first = presentation.extract_slides_and_notes(io.BytesIO(data))
+
+    def fail(pptx_file):
+        raise AssertionError("解析済みのデッキを再解析しました")
+
+    monkeypatch.setattr(presentation, '_analyse_presentation', fail)
+    # プロセス内のメモを消しても、保存済みの結果を使う
+    monkeypatch.setattr(presentation, '_analysis_memo', {})
+    uploaded = io.BytesIO(data)
+    assert presentation.extract_slides_and_notes(uploaded) == first
+    assert uploaded.tell() == 0
+    # 戻り値を書き換えても次回の結果は変わらない
+    first[0]['notes_text'] = "変更"
+    assert presentation.extract_slides_and_notes(io.BytesIO(data))[0]['notes_text'] == "最初のスライドです。"
+
+
+def test_embedded_media_inventory(tmp_path):
+    pptx = pytest.importorskip('pptx')
+    from PIL import Image
+
+    image = io.BytesIO()
+    Image.new('RGB', (32, 16), 'red').save(image, 'PNG')
+    deck = pptx.Presentation()
+    for _ in range(2):
+        slide = deck.slides.add_slide(deck.slide_layouts[6])
+        image.seek(0)
+        slide.shapes.add_picture(image, 0, 0)
+    path = str(tmp_path / 'media.pptx')
+    deck.save(path)
+
+    media = presentation.analyse_presentation(path)['media']
+    assert [(item['slide_number'], item['kind'], item['content_type']) for item in media] == [
+        (1, 'image', 'image/png'), (2, 'image', 'image/png'),
+    ]
+    assert all(item['size'] > 0 for item in media)
+
+
+def test_stored_slide_images_survive_eviction(pptx_deck, tmp_path, monkeypatch):
+    def render(pptx_file):
+        paths = []
+        for i in range(3):
+            path = tmp_path / f"render_{len(list(tmp_path.iterdir()))}_{i}.png"
+            path.write_bytes(b"png" * (i + 1))
+            paths.append(str(path))
+        return paths, str(tmp_path / 'unused')
+
+    monkeypatch.setattr(presentation, 'create_slide_images_from_pptx', render)
+    with open(pptx_deck, 'rb') as f:
+        first = presentation.get_slide_images(f)
+        monkeypatch.setattr(presentation, 'create_slide_images_from_pptx',
+                            lambda pptx_file: pytest.fail("保存済みの画像を使うはず"))
+        second = presentation.get_slide_images(f)
+    assert set(first).isdisjoint(second)
+
+    # 同じジョブの後の保存などでストアから削除されても、渡した画像は残る
+    from movie_converter import store
+    assert store.evict(budget=0) == 3
+    assert [open(path, 'rb').read() for path in second] == [b"png", b"pngpng", b"pngpngpng"]
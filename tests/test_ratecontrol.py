@@ -0,0 +1,102 @@
+"""内容に合わせたエンコード設定: 解析・CRFの範囲・tune・予測と実際のビットレート"""
+import subprocess
+
+import pytest
+
+from conftest import _ffmpeg, requires_ffmpeg
+from movie_converter import ratecontrol
+from movie_converter.jobs import run_job
+
+pytestmark = requires_ffmpeg
+
+
+@pytest.fixture(scope='session')
+def still_video(media_dir):
+    """動きのない単色の動画"""
+    path = str(media_dir / 'still.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'color=c=navy:s=320x180:r=25:d=2',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def noisy_video(media_dir):
+    """細かいノイズが毎フレーム変わる動画（圧縮しにくい）"""
+    path = str(media_dir / 'noisy.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'testsrc2=s=320x180:r=25:d=2', '-vf', 'noise=alls=40:allf=t',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '10', '-pix_fmt', 'yuv420p', path)
+    return path
+
+
+def test_still_and_noisy_videos_get_different_settings(still_video, noisy_video):
+    still = ratecontrol.analyse_complexity(still_video)
+    noisy = ratecontrol.analyse_complexity(noisy_video)
+    assert still['static_ratio'] == 1.0
+    assert noisy['static_ratio'] == 0.0
+    assert noisy['probe_bpp'] > still['probe_bpp'] * 10
+
+    pixels = 1080 * 608
+    still_encoding = ratecontrol.choose_encoding(still, pixels, 25)
+    noisy_encoding = ratecontrol.choose_encoding(noisy, pixels, 25)
+    assert still_encoding['tune'] == 'stillimage'
+    assert noisy_encoding['tune'] == 'film'
+    assert still_encoding['crf'] == ratecontrol.QUALITY_PRESETS['high']['crf_max']
+    assert noisy_encoding['crf'] < still_encoding['crf']
+    assert noisy_encoding['predicted_kbps'] > still_encoding['predicted_kbps']
+
+
+@pytest.mark.parametrize('quality', list(ratecontrol.QUALITY_PRESETS))
+def test_crf_stays_within_quality_bounds(noisy_video, still_video, quality):
+    bounds = ratecontrol.QUALITY_PRESETS[quality]
+    for path in (still_video, noisy_video):
+        encoding = ratecontrol.plan_encoding(path, 1080 * 1920, 30, quality)
+        assert bounds['crf_min'] <= encoding['crf'] <= bounds['crf_max']
+        assert encoding['preset'] == bounds['preset']
+        assert int(encoding['bufsize'][:-1]) == 2 * int(encoding['maxrate'][:-1])
+
+
+def test_unknown_quality_is_rejected(still_video):
+    with pytest.raises(ValueError, match="画質"):
+        ratecontrol.plan_encoding(still_video, 1080 * 1920, 30, 'ultra')
+
+
+def test_no_quality_skips_analysis(monkeypatch, still_video):
+    monkeypatch.setattr(ratecontrol, 'analyse_complexity', lambda *args: pytest.fail("解析しないはず"))
+    assert ratecontrol.plan_encoding(still_video, 1080 * 1920, 30, None) == ratecontrol.DEFAULT_ENCODING
+
+
+def test_analysis_is_cached(monkeypatch, noisy_video):
+    first = ratecontrol.analyse_complexity(noisy_video)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("キャッシュがあれば ffmpeg は実行しない")
+
+    monkeypatch.setattr(subprocess, 'Popen', fail)
+    assert ratecontrol.analyse_complexity(noisy_video) == first
+
+
+def test_encoder_arguments_do_not_mix_bitrate_and_crf():
+    encoding = {'crf': 21, 'preset': 'medium', 'tune': 'animation', 'maxrate': '4000k', 'bufsize': '8000k'}
+    args = ratecontrol.x264_args(encoding)
+    assert '-b:v' not in args
+    assert args[args.index('-crf') + 1] == '21'
+    assert args[args.index('-tune') + 1] == 'animation'
+    assert args[args.index('-maxrate') + 1] == '4000k'
+    # MoviePy は -c:v と -pix_fmt を自分で付ける
+    params = ratecontrol.moviepy_params(encoding)
+    assert '-c:v' not in params and '-pix_fmt' not in params
+    assert '-tune' not in ratecontrol.x264_args(ratecontrol.DEFAULT_ENCODING)
+
+
+def test_job_reports_predicted_and_actual_bitrate(landscape_video, tmp_path):
+    messages = []
+    output = run_job(
+        {'tool': "shorts", 'input': landscape_video, 'output': str(tmp_path / 'short.mp4'), 'quality': "standard"},
+        progress=lambda percent, message: messages.append(message),
+    )
+    assert "予測" in messages[-1] and "実際" in messages[-1]
+    encoding = ratecontrol.plan_encoding(landscape_video, 1080 * 607, 25, "standard")
+    report = ratecontrol.bitrate_report(encoding, output)
+    assert report['actual_kbps'] > 0
+    # 予測は目安（合成した映像で実際の 0.2〜3.5 倍）
+    assert 0.1 < report['ratio'] < 10
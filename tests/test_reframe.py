@@ -0,0 +1,37 @@
+"""オートリフレーム: 被写体の追跡・9:16 の出力サイズ・トリミング後の長さ"""
+import pytest
+
+from conftest import _ffmpeg, requires_ffmpeg
+from movie_converter import reframe
+from movie_converter.media import probe_video
+from movie_converter.shorts import resize_video_to_shorts
+
+pytestmark = requires_ffmpeg
+
+
+@pytest.fixture(scope='session')
+def moving_subject_video(media_dir):
+    """640x360・25fps・3秒: 黒地の上を模様入りの四角が左端から右端へ動く（音声付き）"""
+    path = str(media_dir / 'moving_subject.mp4')
+    _ffmpeg('-f', 'lavfi', '-i', 'color=black:s=640x360:r=25:d=3', '-f', 'lavfi', '-i', 'testsrc=s=80x80:r=25:d=3',
+            '-f', 'lavfi', '-i', 'sine=f=440:d=3', '-filter_complex', "[0][1]overlay=x='20+t*180':y=140[v]",
+            '-map', '[v]', '-map', '2', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-shortest', path)
+    return path
+
+
+def test_subject_path_follows_the_moving_box(moving_subject_video):
+    path = reframe.analyse_subject_path(moving_subject_video)
+    assert len(path['times']) == len(path['x']) == len(path['y'])
+    # 窓は被写体を追って左から右へ動く
+    assert path['x'][0] < 0.35 < 0.65 < path['x'][-1]
+    assert all(0 <= x <= 1 for x in path['x'])
+
+
+@pytest.mark.parametrize('start_time, end_time, duration', [(None, None, 3.0), (0.5, 2.0, 1.5)])
+def test_reframed_short_is_vertical_and_trimmed(moving_subject_video, tmp_path, start_time, end_time, duration):
+    output = str(tmp_path / 'reframed.mp4')
+    resize_video_to_shorts(moving_subject_video, output, start_time=start_time, end_time=end_time, reframe=True)
+    info = probe_video(output)
+    assert (info['width'], info['height'], info['has_audio']) == (1080, 1920, True)
+    assert info['duration'] == pytest.approx(duration, abs=0.1)
@@ -0,0 +1,53 @@
+"""ジョブAPI: クライアントの spec からサーバー上のファイルを指定させない"""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from movie_converter.server import make_server
+
+
+@pytest.fixture
+def api(tmp_path):
+    server = make_server('127.0.0.1', 0, str(tmp_path / 'api_jobs'), workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.manager.shutdown()
+
+
+def _post_job(server, spec, files):
+    boundary = 'testboundary'
+    body = b''
+    body += (f'--{boundary}\r\nContent-Disposition: form-data; name="spec"\r\n\r\n'
+             f'{json.dumps(spec)}\r\n').encode()
+    for name, (filename, data) in files.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/jobs", data=body, method='POST',
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+@pytest.mark.parametrize('voices', [
+    [{'text': "こんにちは", 'start_time': 0, 'volume': 1.0, 'path': "/etc/passwd"}],
+    "こんにちは",
+])
+def test_voice_paths_from_clients_are_rejected(api, tmp_path, voices):
+    status, body = _post_job(api, {'tool': "shorts", 'voices': voices}, {'input': ("in.mp4", b"not a video")})
+    assert status == 400
+    assert 'voices' in body['error']
+    # ジョブは作られず、アップロードも残らない
+    assert api.manager.list() == []
+    assert list((tmp_path / 'api_jobs').iterdir()) == []
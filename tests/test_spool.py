@@ -0,0 +1,146 @@
+"""共有スプールの分散ワーカー: rename による取得・リースの期限切れ・複数プロセスでの処理"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import ROOT, requires_ffmpeg
+from movie_converter import spool
+from movie_converter.media import probe_video
+from movie_converter.server import CANCEL_FLAG, write_job
+
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, 'POLL_SECONDS', 0.05)
+    path = str(tmp_path / 'spool')
+    spool.init(path)
+    return path
+
+
+def _status(spool_dir, job_id):
+    with open(os.path.join(spool_dir, spool.JOBS_DIR, job_id, 'status.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _enqueue(spool_dir, job_id, spec):
+    job_dir = os.path.join(spool_dir, spool.JOBS_DIR, job_id)
+    os.makedirs(job_dir)
+    write_job(job_dir, job_id, spec)
+    spool.enqueue(spool_dir, job_id)
+    return job_dir
+
+
+def test_only_one_worker_claims_a_job(spool_dir):
+    _enqueue(spool_dir, 'a' * 32, {'tool': "shorts"})
+    leases = []
+    barrier = threading.Barrier(8)
+
+    def worker(i):
+        barrier.wait()
+        leases.append(spool.claim(spool_dir, f"worker-{i}"))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    claimed = [lease for lease in leases if lease is not None]
+    assert len(claimed) == 1
+    assert len(os.listdir(os.path.join(spool_dir, spool.RUNNING_DIR))) == 1
+    claimed[0].release()
+    assert os.listdir(os.path.join(spool_dir, spool.RUNNING_DIR)) == []
+
+
+def test_expired_lease_is_requeued_and_old_worker_loses_it(spool_dir):
+    job_id = 'b' * 32
+    _enqueue(spool_dir, job_id, {'tool': "shorts"})
+    lease = spool.claim(spool_dir, "stalled")
+    assert spool.reap(spool_dir) == []
+    assert lease.held
+    # ハートビートが LEASE_SECONDS より前で止まった
+    assert spool.reap(spool_dir, now=time.time() + spool.LEASE_SECONDS + 1) == [job_id]
+    assert not lease.held
+    new_lease = spool.claim(spool_dir, "healthy")
+    assert new_lease.job_id == job_id and new_lease.held
+    lease.release()   # 古いワーカーは新しいワーカーのリースを消さない
+    assert new_lease.held
+    new_lease.release()
+
+
+def test_job_is_failed_after_too_many_lost_leases(spool_dir):
+    job_id = 'c' * 32
+    job_dir = _enqueue(spool_dir, job_id, {'tool': "shorts", 'input': "missing.mp4", 'output': "out.mp4"})
+    with open(os.path.join(job_dir, 'status.json'), 'r+', encoding='utf-8') as f:
+        status = dict(json.load(f), attempts=spool.MAX_ATTEMPTS)
+        f.seek(0)
+        json.dump(status, f)
+        f.truncate()
+    assert spool.run_worker(spool_dir, "w", exit_when_idle=True) == 1
+    status = _status(spool_dir, job_id)
+    assert status['state'] == "failed" and "ワーカーの停止" in status['error']
+
+
+def test_cancelled_job_is_not_run(spool_dir):
+    job_id = 'd' * 32
+    job_dir = _enqueue(spool_dir, job_id, {'tool': "shorts", 'input': "missing.mp4", 'output': "out.mp4"})
+    open(os.path.join(job_dir, CANCEL_FLAG), 'w').close()
+    spool.run_worker(spool_dir, "w", exit_when_idle=True)
+    assert _status(spool_dir, job_id)['state'] == "cancelled"
+
+
+@requires_ffmpeg
+def test_job_from_a_dead_worker_is_run_again(spool_dir, landscape_video):
+    job_id = spool.submit({'tool': "shorts", 'input': landscape_video}, spool_dir)
+    lease = spool.claim(spool_dir, "dead")
+    lease._stop()
+    # 停止したワーカーのハートビートは更新されない
+    assert spool.reap(spool_dir, now=time.time() + spool.LEASE_SECONDS + 1) == [job_id]
+    assert spool.run_worker(spool_dir, "alive", exit_when_idle=True) == 1
+    status = _status(spool_dir, job_id)
+    assert (status['state'], status['attempts'], status['worker']) == ("done", 1, "alive")
+
+
+@requires_ffmpeg
+def test_several_worker_processes_share_the_spool(spool_dir, landscape_video, tmp_path):
+    outputs = [str(tmp_path / f"short_{i}.mp4") for i in range(4)]
+    job_ids = [spool.submit({'tool': "shorts", 'input': landscape_video, 'output': output}, spool_dir)
+               for output in outputs]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'movie_converter', 'worker', '--spool', spool_dir,
+                          '--concurrency', "1", '--exit-when-idle'], cwd=ROOT, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(3)
+    ]
+    for worker in workers:
+        assert worker.wait(timeout=300) == 0
+    for job_id in job_ids:
+        status = _status(spool_dir, job_id)
+        assert (status['state'], status['attempts']) == ("done", 1)
+        assert probe_video(os.path.join(spool_dir, spool.JOBS_DIR, job_id, 'result.mp4'))['width'] == 1080
+    assert os.listdir(os.path.join(spool_dir, spool.QUEUE_DIR)) == []
+    assert os.listdir(os.path.join(spool_dir, spool.RUNNING_DIR)) == []
+    assert os.listdir(os.path.join(spool_dir, spool.METRICS_DIR))
+
+
+@requires_ffmpeg
+def test_run_job_waits_for_a_worker_and_copies_the_result(spool_dir, landscape_video, tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=spool.run_worker, args=(spool_dir, "thread"), kwargs={'stop': stop})
+    worker.start()
+    messages = []
+    try:
+        output = spool.run_job({'tool': "shorts", 'input': landscape_video, 'output': str(tmp_path / 'short.mp4')},
+                               progress=lambda percent, message: messages.append(percent), spool_dir=spool_dir)
+    finally:
+        stop.set()
+        worker.join()
+    assert probe_video(output)['width'] == 1080
+    assert messages[-1] == 100
+    # 結果を受け取ったジョブはスプールから消す
+    assert os.listdir(os.path.join(spool_dir, spool.JOBS_DIR)) == []
@@ -0,0 +1,133 @@
+"""子プロセスの監視: タイムアウト・取り消し・プロセスグループの停止・優先度"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import requires_ffmpeg
+from movie_converter import supervisor
+from movie_converter.jobs import run_job
+from movie_converter.server import CANCEL_FLAG, run_job_in_dir
+
+# 孫プロセス（sleep）を起動して PID を書き出し、自分も待ち続けるスクリプト
+SPAWN_GRANDCHILD = (
+    "import subprocess, sys, time\n"
+    "child = subprocess.Popen(['sleep', '30'])\n"
+    "open(sys.argv[1], 'w').write(str(child.pid))\n"
+    "time.sleep(30)\n"
+)
+IGNORE_SIGTERM = "import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\nprint('ready', flush=True)\ntime.sleep(30)\n"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 停止済みで回収待ち（ゾンビ）の場合も止まったものとみなす
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(')')[-1].split()[0] != 'Z'
+
+
+def _wait_for_file(path):
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) or not open(path).read():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return int(open(path).read())
+
+
+def test_run_behaves_like_subprocess_run():
+    result = supervisor.run([sys.executable, '-c', "print('ok')"], stage='probe', capture_output=True, text=True)
+    assert (result.returncode, result.stdout) == (0, "ok\n")
+    with pytest.raises(subprocess.CalledProcessError):
+        supervisor.run([sys.executable, '-c', "raise SystemExit(3)"], stage='probe', check=True, capture_output=True)
+
+
+def test_timeout_kills_the_whole_process_group(tmp_path):
+    pid_path = str(tmp_path / 'child.pid')
+    started = time.monotonic()
+    with pytest.raises(TimeoutError, match="制限時間"):
+        supervisor.run([sys.executable, '-c', SPAWN_GRANDCHILD, pid_path], timeout=1.0)
+    assert time.monotonic() - started < 5
+    grandchild = _wait_for_file(pid_path)
+    time.sleep(0.2)
+    assert not _alive(grandchild)
+
+
+def test_cancel_stops_running_process(tmp_path):
+    token = supervisor.CancelToken()
+    threading.Timer(0.5, token.cancel).start()
+    started = time.monotonic()
+    with supervisor.supervise(token):
+        with pytest.raises(supervisor.Cancelled):
+            supervisor.run([sys.executable, '-c', "import time; time.sleep(30)"])
+        # 取り消し後は新しいプロセスを起動しない
+        with pytest.raises(supervisor.Cancelled):
+            supervisor.run([sys.executable, '-c', "print('ok')"])
+    assert time.monotonic() - started < 5
+
+
+def test_process_ignoring_sigterm_is_killed(monkeypatch):
+    monkeypatch.setattr(supervisor, 'KILL_GRACE_SECONDS', 0.3)
+    with pytest.raises(TimeoutError):
+        with supervisor.popen([sys.executable, '-c', IGNORE_SIGTERM], timeout=0.5, stdout=subprocess.PIPE) as process:
+            process.stdout.readline()
+            process.wait()
+    assert process.returncode == -9
+
+
+def test_flag_file_cancels_from_another_process(tmp_path):
+    token = supervisor.CancelToken(flag_path=str(tmp_path / 'cancel'))
+    assert not token.cancelled
+    # 別プロセス（ジョブAPIのサーバー）から同じパスのトークンで取り消す
+    supervisor.CancelToken(flag_path=str(tmp_path / 'cancel')).cancel()
+    assert token.cancelled
+
+
+def test_timeouts_scale_with_media_duration(monkeypatch):
+    base, per_second = supervisor.STAGE_TIMEOUTS['encode']
+    assert supervisor.stage_timeout('encode', 10) == base + per_second * 10
+    # 素材の長さが分からない場合は無制限（取り消しは有効）
+    assert supervisor.stage_timeout('encode') is None
+    assert supervisor.stage_timeout('probe') == supervisor.STAGE_TIMEOUTS['probe'][0]
+    monkeypatch.setenv('MOVIE_CONVERTER_TIMEOUT_SCALE', '2')
+    assert supervisor.stage_timeout('encode', 10) == (base + per_second * 10) * 2
+    monkeypatch.setenv('MOVIE_CONVERTER_TIMEOUT_SCALE', '0')
+    assert supervisor.stage_timeout('probe') is None
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="nice は POSIX のみ")
+def test_batch_priority_lowers_niceness(monkeypatch):
+    monkeypatch.setenv('MOVIE_CONVERTER_NICE_BATCH', '7')
+    current = os.getpriority(os.PRIO_PROCESS, 0)
+    cmd = [sys.executable, '-c', "import os; print(os.getpriority(os.PRIO_PROCESS, 0))"]
+    with supervisor.supervise(priority='batch'):
+        niceness = int(supervisor.run(cmd, stage='probe', capture_output=True, text=True).stdout)
+    assert niceness == max(current, 7)
+    assert int(supervisor.run(cmd, stage='probe', capture_output=True, text=True).stdout) == current
+
+
+@requires_ffmpeg
+def test_cancelled_job_leaves_no_output(landscape_video, tmp_path):
+    token = supervisor.CancelToken()
+    output = tmp_path / 'short.mp4'
+    with supervisor.supervise(token):
+        with pytest.raises(supervisor.Cancelled):
+            # 最初の進捗通知で取り消す（次に起動する ffmpeg の前に止まる）
+            run_job({'tool': "shorts", 'input': landscape_video, 'output': str(output)},
+                    progress=lambda percent, message: token.cancel())
+    assert not output.exists()
+
+
+def test_api_job_cancelled_while_queued(tmp_path):
+    job_dir = tmp_path / 'job'
+    job_dir.mkdir()
+    (job_dir / 'spec.json').write_text('{"tool": "shorts", "input": "missing.mp4", "output": "out.mp4"}')
+    (job_dir / 'status.json').write_text('{"state": "queued"}')
+    (job_dir / CANCEL_FLAG).touch()
+    status = run_job_in_dir(str(job_dir))
+    assert status['state'] == "cancelled"
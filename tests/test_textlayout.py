@@ -0,0 +1,55 @@
+"""テキストの折り返し: 文字幅のキャッシュ・禁則処理・単語単位の折り返し・幅を超える単語"""
+import gc
+
+from movie_converter import textlayout
+
+
+def test_advance_cache_belongs_to_each_font():
+    small = textlayout.char_advances("あa", textlayout.load_font(20))
+    large = textlayout.char_advances("あa", textlayout.load_font(40))
+    assert large[0] > small[0]
+
+    # load_font のキャッシュから外れて解放されたフォントの幅を、後から読み込んだ別サイズのフォントに返さない
+    textlayout.load_font.cache_clear()
+    gc.collect()
+    for size in (40, 20, 30):
+        font = textlayout.load_font(size)
+        assert textlayout.char_advances("あa", font) == [font.getlength("あ"), font.getlength("a")]
+
+
+class MonospaceFont:
+    """全角 20px・半角 10px の等幅フォント（折り返し位置を計算で確かめられるように）"""
+
+    def getlength(self, ch):
+        return 20 if textlayout._is_wide(ch) else 10
+
+
+def test_line_start_and_end_rules():
+    font = MonospaceFont()
+    # 幅だけなら「あいうえお」で折り返すが、次の行頭が「、」になるので「お」を送る
+    lines = textlayout.wrap_line("あいうえお、かきくけこ", font, 100)
+    assert lines == ["あいうえ", "お、かきく", "けこ"]
+    # 幅だけなら「あいうえ「」で折り返すが、行末に「「」を残さない
+    lines = textlayout.wrap_line("あいうえ「おか」きく", font, 100)
+    assert lines == ["あいうえ", "「おか」き", "く"]
+    for line in textlayout.wrap_text("「テスト」です。小さい「ッ」や長音「ー」も、行頭に来ないようにする。", font, 100):
+        assert line[0] not in textlayout.NO_LINE_START
+        assert line[-1] not in textlayout.NO_LINE_END
+        assert textlayout.line_width(line, font) <= 100
+
+
+def test_latin_text_wraps_at_spaces():
+    font = MonospaceFont()
+    assert textlayout.wrap_line("the quick brown fox jumps", font, 100) == ["the quick", "brown fox", "jumps"]
+    # 単語の途中では折り返さず、空の段落は除く
+    assert textlayout.wrap_text("hello world\n\nnew  paragraph", font, 90) == ["hello", "world", "new", "paragraph"]
+    # 英単語と日本語の間は折り返せる
+    assert textlayout.wrap_line("Python入門", font, 70) == ["Python", "入門"]
+
+
+def test_token_wider_than_line_is_broken_by_width():
+    font = MonospaceFont()
+    lines = textlayout.wrap_line("a supercalifragilistic b", font, 100)
+    assert lines == ["a", "supercalif", "ragilistic", "b"]
+    # 1文字も入らない幅でも、1行に最低1文字は置く
+    assert textlayout.wrap_line("あい", font, 5) == ["あ", "い"]
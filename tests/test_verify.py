@@ -0,0 +1,67 @@
+"""出力の同等性チェック（PSNR/SSIM・音声のずれ・形式）"""
+import subprocess
+
+import numpy as np
+import pytest
+
+from conftest import requires_ffmpeg
+from movie_converter.verify import assert_equivalent, audio_offset, compare_outputs, psnr, ssim
+
+
+def test_psnr_and_ssim_of_identical_and_noisy_frames():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(3, 40, 60), dtype=np.uint8)
+    assert psnr(frames, frames).tolist() == [100.0] * 3
+    assert ssim(frames, frames) == pytest.approx([1.0] * 3)
+
+    noisy = np.clip(frames.astype(int) + rng.normal(0, 10, frames.shape), 0, 255).astype(np.uint8)
+    assert 25 < psnr(frames, noisy).min() < 30
+    assert ssim(frames, noisy).max() < 0.995
+    # フレームごとに独立して計算する
+    mixed = np.stack([frames[0], noisy[1], frames[2]])
+    values = ssim(frames, mixed)
+    assert values[0] == pytest.approx(1.0) and values[1] < 0.995 and values[2] == pytest.approx(1.0)
+
+
+def test_audio_offset_finds_delay():
+    rng = np.random.default_rng(1)
+    reference = rng.normal(size=8000).astype(np.float32)
+    delayed = np.concatenate([np.zeros(400, dtype=np.float32), reference[:-400]])
+    offset, correlation = audio_offset(reference, delayed, rate=8000)
+    assert offset == pytest.approx(0.05)
+    assert correlation > 0.9
+    offset, _ = audio_offset(delayed, reference, rate=8000)
+    assert offset == pytest.approx(-0.05)
+    assert audio_offset(reference, np.zeros(8000, dtype=np.float32)) == (0.0, None)
+
+
+@requires_ffmpeg
+def test_stream_copy_matches_source(landscape_video, tmp_path):
+    copied = str(tmp_path / 'copied.mp4')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', landscape_video, '-c', 'copy', copied], check=True)
+    report = assert_equivalent(landscape_video, copied)
+    assert report['video']['psnr_min'] == 100.0
+    assert report['audio']['offset'] == 0.0
+
+
+@requires_ffmpeg
+def test_delayed_audio_is_reported(landscape_video, tmp_path):
+    delayed = str(tmp_path / 'delayed.mp4')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', landscape_video, '-c:v', 'copy',
+                    '-af', 'adelay=100:all=1', '-c:a', 'aac', '-t', '2', delayed], check=True)
+    report = compare_outputs(landscape_video, delayed)
+    assert not report['passed']
+    assert report['audio']['offset'] == pytest.approx(0.1, abs=0.005)
+    assert any("ずれています" in failure for failure in report['failures'])
+    with pytest.raises(Exception, match="出力が一致しません"):
+        assert_equivalent(landscape_video, delayed)
+    # 許容範囲を広げれば通る
+    assert compare_outputs(landscape_video, delayed, {'audio_offset_max': 0.2, 'audio_correlation_min': 0.5})['passed']
+
+
+@requires_ffmpeg
+def test_different_streams_are_reported(landscape_video, portrait_video):
+    report = compare_outputs(landscape_video, portrait_video)
+    failures = " ".join(report['failures'])
+    assert "幅が異なります" in failures and "片方にだけ音声があります" in failures
+    assert report['audio'] is None
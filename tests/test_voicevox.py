@@ -0,0 +1,115 @@
+"""VOICEVOX連携（スタブサーバー使用）: 分割・並列合成・リトライ・タイムアウト・発話区間"""
+import time
+import wave
+
+import pytest
+import requests
+
+from movie_converter import voicevox
+from movie_converter.subtitles import subtitle_segments
+from movie_converter.voicevox_stub import make_audio_query, query_duration
+
+
+def _duration(path):
+    with wave.open(path, 'rb') as f:
+        return f.getnframes() / f.getframerate()
+
+
+def test_split_keeps_closing_brackets_with_sentence():
+    chunks = voicevox.split_text_for_synthesis("「はい。」そうです。次へ")
+    assert chunks == [("「はい。」", "sentence"), ("そうです。", "sentence"), ("次へ", "sentence")]
+
+
+def test_split_merges_short_clauses_up_to_limit():
+    chunks = voicevox.split_text_for_synthesis("あ、い、う", max_chars=10)
+    assert chunks == [("あ、い、う", "sentence")]
+
+
+def test_stub_speakers_and_deterministic_query(voicevox_stub):
+    stub = voicevox_stub()
+    speakers = requests.get(f"{stub.url}/speakers", timeout=5).json()
+    assert any(style['id'] == 10 for speaker in speakers for style in speaker['styles'])
+    first = requests.post(f"{stub.url}/audio_query", params={'text': "こんにちは", 'speaker': 10}, timeout=5).json()
+    second = requests.post(f"{stub.url}/audio_query", params={'text': "こんにちは", 'speaker': 10}, timeout=5).json()
+    assert first == second
+    assert sum(len(p['moras']) for p in first['accent_phrases']) == 5
+
+
+def test_voice_length_is_proportional_to_text(voicevox_stub, tmp_path):
+    voicevox_stub()
+    short = voicevox.generate_voice_with_voicevox("あいうえお", output_path=str(tmp_path / 'short.wav'))
+    long = voicevox.generate_voice_with_voicevox("あいうえお" * 4, output_path=str(tmp_path / 'long.wav'))
+    assert _duration(short) == pytest.approx(query_duration(make_audio_query("あいうえお")), abs=0.01)
+    assert _duration(long) - 0.2 == pytest.approx((_duration(short) - 0.2) * 4, abs=0.01)
+
+
+def test_chunks_are_synthesised_concurrently(voicevox_stub, monkeypatch, tmp_path):
+    stub = voicevox_stub(latency=0.3)
+    monkeypatch.setenv('VOICEVOX_CONCURRENCY', '4')
+    text = "一つ目の文です。二つ目の文です。三つ目の文です。四つ目の文です。"
+    started = time.monotonic()
+    path = voicevox.generate_voice_with_voicevox(text, output_path=str(tmp_path / 'voice.wav'))
+    elapsed = time.monotonic() - started
+    assert stub.max_concurrent >= 2
+    # 直列なら 4チャンク × 2リクエスト × 0.3秒 = 2.4秒
+    assert elapsed < 2.0
+    # 文末の無音（SENTENCE_PAUSE）が3つ入る
+    expected = sum(query_duration(make_audio_query(chunk)) for chunk, _ in voicevox.split_text_for_synthesis(text))
+    assert _duration(path) == pytest.approx(expected + 3 * voicevox.SENTENCE_PAUSE, abs=0.01)
+
+
+def test_failed_requests_are_retried(voicevox_stub, monkeypatch, tmp_path):
+    stub = voicevox_stub(failure_rate=0.3, seed=1)
+    monkeypatch.setenv('VOICEVOX_MAX_RETRIES', '3')
+    monkeypatch.setenv('VOICEVOX_FAILURE_THRESHOLD', '100')
+    text = "これは、リトライの、テストです。失敗しても、最後まで、合成します。"
+    path = voicevox.generate_voice_with_voicevox(text, output_path=str(tmp_path / 'voice.wav'))
+    assert stub.failures > 0
+    assert _duration(path) > 1.0
+
+
+def test_timeout_raises_without_waiting_for_slow_engine(voicevox_stub, monkeypatch, tmp_path):
+    voicevox_stub(latency=2.0)
+    monkeypatch.setenv('VOICEVOX_TIMEOUT', '0.2')
+    monkeypatch.setenv('VOICEVOX_MAX_RETRIES', '0')
+    started = time.monotonic()
+    with pytest.raises(Exception, match="VOICEVOX"):
+        voicevox.generate_voice_with_voicevox("遅いエンジン", output_path=str(tmp_path / 'voice.wav'))
+    assert time.monotonic() - started < 1.5
+
+
+def test_client_errors_are_not_retried(voicevox_stub):
+    stub = voicevox_stub()
+    pool = voicevox.get_voicevox_pool()
+    with pytest.raises(Exception, match="拒否"):
+        pool.request('post', '/audio_query', params={'text': "話者なし"})
+    assert stub.requests == 1
+
+
+def test_dead_endpoint_opens_circuit(voicevox_stub, unused_url, monkeypatch, tmp_path):
+    stub = voicevox_stub()
+    monkeypatch.setenv('VOICEVOX_URLS', f"{unused_url},{stub.url}")
+    monkeypatch.setenv('VOICEVOX_FAILURE_THRESHOLD', '1')
+    for i in range(3):
+        voicevox.generate_voice_with_voicevox(f"テスト{i}", output_path=str(tmp_path / f"{i}.wav"))
+    states = {endpoint['url']: endpoint['state'] for endpoint in voicevox.get_voicevox_pool().status()}
+    assert states[unused_url] == voicevox.OPEN
+    assert states[stub.url] == voicevox.CLOSED
+
+
+def test_timings_follow_the_joined_audio(voicevox_stub, tmp_path):
+    voicevox_stub()
+    text = "今日は晴れです。明日は、雨でしょう。"
+    path, timings = voicevox.generate_voice_with_timings(text, output_path=str(tmp_path / 'voice.wav'))
+    assert [chunk['text'] for chunk in timings] == [c for c, _ in voicevox.split_text_for_synthesis(text)]
+    starts = [chunk['start'] for chunk in timings]
+    assert starts == sorted(starts)
+    assert timings[0]['start'] == pytest.approx(0.1)   # prePhonemeLength
+    assert timings[-1]['end'] == pytest.approx(_duration(path) - 0.1, abs=0.01)   # postPhonemeLength
+
+    phrase = subtitle_segments(timings, start_time=1.0, mode="phrase")
+    assert [s['text'] for s in phrase] == [chunk['text'] for chunk in timings]
+    assert phrase[0]['start_time'] == pytest.approx(1.1)
+    karaoke = subtitle_segments(timings, start_time=1.0, mode="karaoke")
+    assert karaoke[-1]['text'] == timings[-1]['text']
+    assert len(karaoke) > len(phrase)